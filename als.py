@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy import sparse
+
+import storage
+from rating_log import LOG_FILE
+from ratings_store import file_stamp
+from similarity import top_k_neighbors
+
+ALS_DIR = "als_model"
+FACTORS = 20
+REGULARIZATION = 0.1
+EPOCHS = 10
+SOLVE_BLOCK = 1024  # rows solved together in one batched np.linalg.solve
+SOLVE_BLOCK_RATINGS = 2 ** 18  # ...or as many rows as hold this many ratings
+PAD_GROUP = 64  # rows of similar rating counts padded to a common length together
+
+
+def solve_rows(ratings, fixed, regularization=REGULARIZATION):
+    """
+    One ALS half-step for a block of rows: for every row u with observed ratings r_u on columns I,
+        x_u = (F_I^T F_I + regularization * |I| * Id)^-1 F_I^T r_u
+    where F is the fixed factor matrix. Rows are grouped by how many ratings they have and each group
+    is padded into one (rows, ratings, factors) array, so the Gram matrices are batched matmuls and
+    the solves one batched np.linalg.solve.
+    """
+    n_rows, n_factors = ratings.shape[0], fixed.shape[1]
+    per_row = np.diff(ratings.indptr)
+    grams = np.zeros((n_rows, n_factors, n_factors))
+    targets = np.zeros((n_rows, n_factors))
+
+    by_length = np.argsort(per_row, kind="stable")
+    for group in np.array_split(by_length, max(1, n_rows // PAD_GROUP)):
+        length = per_row[group].max() if len(group) else 0
+        if length == 0:
+            continue
+        slots = np.arange(length)
+        present = slots < per_row[group][:, None]
+        positions = np.where(present, ratings.indptr[group][:, None] + slots, 0)
+        picked = fixed[ratings.indices[positions]] * present[:, :, None]
+        grams[group] = picked.transpose(0, 2, 1) @ picked
+        targets[group] = np.einsum("rlf,rl->rf", picked, ratings.data[positions] * present)
+
+    grams += regularization * np.maximum(per_row, 1)[:, None, None] * np.eye(n_factors)
+    return np.linalg.solve(grams, targets[:, :, None])[:, :, 0]
+
+
+def _solve_task(args):
+    return solve_rows(*args)
+
+
+def _row_blocks(ratings):
+    """Row ranges of at most SOLVE_BLOCK rows and (past the first row) SOLVE_BLOCK_RATINGS ratings."""
+    start, n_rows = 0, ratings.shape[0]
+    while start < n_rows:
+        end = np.searchsorted(ratings.indptr, ratings.indptr[start] + SOLVE_BLOCK_RATINGS, side="right") - 1
+        end = int(min(max(end, start + 1), start + SOLVE_BLOCK, n_rows))
+        yield start, end
+        start = end
+
+
+def _half_step(ratings, fixed, regularization, pool=None):
+    blocks = [(ratings[start:end], fixed, regularization) for start, end in _row_blocks(ratings)]
+    solved = pool.map(_solve_task, blocks) if pool is not None else [_solve_task(block) for block in blocks]
+    return np.vstack(solved) if solved else np.zeros((0, fixed.shape[1]))
+
+
+class ALSModel:
+    """
+    Latent-factor model of the ratings matrix: rating(u, b) ~ mean + user_factors[u] . item_factors[b].
+    Trained by alternating least squares and saved as .npy files, so serving a user is one
+    (n_factors x n_books) dot product plus an argpartition over the catalog.
+
+    It predicts rating values from the observed ratings only, not which books a reader picks up; where
+    nearly every rating is a 4 or a 5 its predictions for unread books all sit near the mean, and
+    leave-N-out hit rates (evaluate.py) are close to random.
+    """
+
+    def __init__(self, user_factors, item_factors, mean, user_ids, books):
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.mean = mean
+        self.user_ids = list(user_ids)
+        self.books = list(books)
+        self.regularization = REGULARIZATION
+        self.stale_users = set()
+
+    @classmethod
+    def train(cls, matrix, user_ids, books, factors=FACTORS, regularization=REGULARIZATION,
+              epochs=EPOCHS, workers=1, seed=0, epoch_times=None):
+        """
+        Fit the model to a (users x books) ratings matrix. With workers > 1 the per-row solves of
+        each half-step are spread over a process pool. Wall time per epoch is appended to epoch_times.
+        """
+        rng = np.random.default_rng(seed)
+        mean = float(matrix.data.mean()) if matrix.nnz else 0.0
+        ratings = sparse.csr_matrix(matrix, dtype=np.float64, copy=True)
+        ratings.data -= mean
+        ratings_t = ratings.T.tocsr()
+        user_factors = rng.normal(0, 0.1, (matrix.shape[0], factors))
+        item_factors = rng.normal(0, 0.1, (matrix.shape[1], factors))
+
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            for _ in range(epochs):
+                start = time.perf_counter()
+                user_factors = _half_step(ratings, item_factors, regularization, pool)
+                item_factors = _half_step(ratings_t, user_factors, regularization, pool)
+                if epoch_times is not None:
+                    epoch_times.append(time.perf_counter() - start)
+        finally:
+            if pool is not None:
+                # Every map has returned (or raised): stop the workers and reap them
+                pool.terminate()
+                pool.join()
+
+        model = cls(user_factors.astype(np.float32), item_factors.astype(np.float32), mean, user_ids, books)
+        model.regularization = regularization
+        return model
+
+    @classmethod
+    def load(cls, model_dir=ALS_DIR, mmap_mode=None):
+        with open(os.path.join(model_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        user_factors = np.load(os.path.join(model_dir, "user_factors.npy"), mmap_mode=mmap_mode)
+        item_factors = np.load(os.path.join(model_dir, "item_factors.npy"), mmap_mode=mmap_mode)
+        user_ids = np.load(os.path.join(model_dir, "user_ids.npy"))
+        books = storage.load_strings(os.path.join(model_dir, "books"))
+        model = cls(user_factors, item_factors, meta["mean"], user_ids.tolist(), books)
+        model.regularization = meta["regularization"]
+        return model
+
+    def save(self, model_dir=ALS_DIR, source_stamp=None):
+        tmp_dir = model_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "user_factors.npy"), self.user_factors)
+        np.save(os.path.join(tmp_dir, "item_factors.npy"), self.item_factors)
+        np.save(os.path.join(tmp_dir, "user_ids.npy"), np.array(self.user_ids, dtype=np.int64))
+        storage.save_strings(os.path.join(tmp_dir, "books"), self.books)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"mean": self.mean, "regularization": self.regularization,
+                       "factors": self.item_factors.shape[1], "source_stamp": source_stamp}, f)
+        shutil.rmtree(model_dir, ignore_errors=True)
+        os.replace(tmp_dir, model_dir)
+
+    def mark_stale(self, user_id):
+        """The user rated something after training; their factors are re-fitted on next use."""
+        self.stale_users.add(user_id)
+
+    def fold_in(self, user_row):
+        """Factors for one user from their current ratings (a 1 x n_books CSR row), item factors fixed."""
+        n_books = self.item_factors.shape[0]
+        user_row = sparse.csr_matrix(user_row[:, :n_books], dtype=np.float64, copy=True)
+        user_row.data -= self.mean
+        return solve_rows(user_row, np.asarray(self.item_factors, dtype=np.float64), self.regularization)[0]
+
+    def user_vector(self, matrix, user_ids, user_id):
+        """The user's factors: trained ones, or folded in for stale / new users."""
+        row = user_ids.get_loc(user_id)
+        if user_id in self.stale_users or row >= len(self.user_factors) or self.user_ids[row] != user_id:
+            return self.fold_in(matrix[row])
+        return self.user_factors[row]
+
+    def knows(self, columns):
+        """Whether any of these book columns has trained factors (books added later have none)."""
+        return bool(np.any(np.asarray(columns) < self.item_factors.shape[0]))
+
+    def recommend(self, user_vector, exclude=(), n=5):
+        """
+        [(book_column, predicted_rating), ...] best first: one dot product plus an argpartition.
+        [] when every book gets the same score (a zero vector), since there is nothing to rank by.
+        """
+        scores = np.asarray(self.item_factors) @ user_vector + self.mean
+        if not len(scores) or scores.min() == scores.max():
+            return []
+        exclude = np.asarray(exclude, dtype=np.intp)
+        # Books added after training have no factors (and so are never recommended)
+        top, top_scores = top_k_neighbors(scores, n, exclude=exclude[exclude < len(scores)])
+        return list(zip(top.tolist(), top_scores.tolist()))
+
+    def rmse(self, matrix):
+        """Root mean squared error of the predictions on the observed ratings of matrix."""
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        predicted = np.einsum("ij,ij->i", self.user_factors[rows], self.item_factors[matrix.indices]) + self.mean
+        return float(np.sqrt(np.mean((predicted - matrix.data) ** 2)))
+
+
+def open_als_model(store, users_file="users.csv", log_file=LOG_FILE, model_dir=ALS_DIR, workers=1):
+    """
+    Load the saved model if it was trained on the current users.csv and rating log,
+    otherwise train it on the ratings store's matrix and save it.
+    """
+    source_files = (users_file, log_file)
+    meta_file = os.path.join(model_dir, "meta.json")
+    if os.path.isfile(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            if json.load(f)["source_stamp"] == file_stamp(*source_files):
+                return ALSModel.load(model_dir, mmap_mode='r')
+
+    matrix, user_ids, books = store.matrix()
+    model = ALSModel.train(matrix, user_ids, books, workers=workers)
+    model.save(model_dir, file_stamp(*source_files))
+    return model
@@ -0,0 +1,299 @@
+"""
+Reading analytics over all users, from aggregate tables instead of per-user history parsing.
+
+    python analytics.py [--top 10] [--user ID]
+
+AnalyticsCube is built once from the columnar ratings table with vectorized group-bys: ratings per
+(genre, age bucket), a histogram of rating values, per-book counts and per-user counts / means /
+genre counts. New ratings are folded in as they arrive (add_rating in-process, refresh() for the
+ones other processes appended to the rating log), so every query is a few array operations.
+UsersAnalysis.ipynb plots from it.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import storage
+from interning import Interner, title_key
+from rating_log import LOG_FILE, read_events
+from ratings_store import file_stamp, resized
+
+AGE_BINS = (0, 18, 25, 35, 45, 55, 65)  # lower bound of each age bucket
+AGE_LABELS = ("<18", "18-24", "25-34", "35-44", "45-54", "55-64", "65+")
+UNKNOWN_AGE = len(AGE_LABELS)  # column of users whose age is missing
+RATING_STEPS = 10  # histogram buckets per star: ratings are recorded to one decimal
+MAX_RATING = 5
+
+
+def age_buckets(ages):
+    """Index into AGE_LABELS of each age, UNKNOWN_AGE for a missing or unparseable one."""
+    ages = pd.to_numeric(pd.Series(ages, dtype=object), errors="coerce").to_numpy(np.float64)
+    buckets = np.searchsorted(AGE_BINS, np.nan_to_num(ages, nan=-1), side="right") - 1
+    return np.where(np.isfinite(ages) & (buckets >= 0), buckets, UNKNOWN_AGE)
+
+
+def _rating_buckets(ratings):
+    return np.clip(np.round(ratings * RATING_STEPS), 0, MAX_RATING * RATING_STEPS).astype(np.int64)
+
+
+class AnalyticsCube:
+    """
+    Aggregate tables over every rating: counts per (genre, age bucket), a rating histogram, and
+    counts / sums per book and per user, plus a user x genre count matrix (CSR, with new ratings
+    kept as deltas until it is read, as in the RatingsStore). Books are matched by title_key and
+    genres by normalized text, so spelling variants are counted together.
+    """
+
+    def __init__(self):
+        self.genres = Interner()
+        self.books = Interner(title_key)
+        self.user_ids = []
+        self._user_pos = {}
+        self.user_age = np.zeros(0, dtype=np.int64)  # age bucket per user
+        self.user_counts = np.zeros(0, dtype=np.int64)
+        self.user_sums = np.zeros(0, dtype=np.float64)
+        self.book_counts = np.zeros(0, dtype=np.int64)
+        self.book_sums = np.zeros(0, dtype=np.float64)
+        self.genre_age = np.zeros((0, UNKNOWN_AGE + 1), dtype=np.int64)
+        self.histogram = np.zeros(MAX_RATING * RATING_STEPS + 1, dtype=np.int64)
+        self._user_genres = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self._pending = {}  # (user row, genre ID) -> ratings not yet in _user_genres
+        self.users_file = self.log_file = self.store_dir = None
+        self.users_stamp = None
+        self.log_events = 0  # rating log events folded in so far
+
+    @classmethod
+    def build(cls, users_file=storage.USERS_FILE, log_file=LOG_FILE, store_dir=storage.STORE_DIR):
+        """Aggregate the columnar users and ratings tables (imported from users_file if stale) plus the rating log."""
+        cube = cls()
+        cube.users_file, cube.log_file, cube.store_dir = users_file, log_file, store_dir
+        cube.users_stamp = file_stamp(users_file)
+        store_dir = storage.ensure_store(users_file=users_file, store_dir=store_dir)
+        users = storage.load_table(os.path.join(store_dir, "users"), ["age", "ID"])
+        ratings = storage.load_table(os.path.join(store_dir, "ratings"), ["user_idx", "book", "genre", "rating"])
+        cube.add_users(users["ID"].to_numpy(), users["age"].to_numpy(object))
+        # user_idx is the row in the users table, which add_users kept as the user's row here
+        cube._add_ratings(ratings["user_idx"].to_numpy(np.int64), ratings["book"], ratings["genre"],
+                          ratings["rating"].to_numpy(np.float64))
+        events = read_events(log_file)
+        cube._add_events(events)
+        cube.log_events = len(events)
+        return cube
+
+    def _grow(self):
+        n_users, n_books, n_genres = len(self.user_ids), len(self.books), len(self.genres)
+        if n_users > len(self.user_counts):
+            missing = n_users - len(self.user_counts)
+            self.user_age = np.concatenate([self.user_age, np.full(missing, UNKNOWN_AGE, dtype=np.int64)])
+            self.user_counts = np.concatenate([self.user_counts, np.zeros(missing, dtype=np.int64)])
+            self.user_sums = np.concatenate([self.user_sums, np.zeros(missing)])
+        if n_books > len(self.book_counts):
+            missing = n_books - len(self.book_counts)
+            self.book_counts = np.concatenate([self.book_counts, np.zeros(missing, dtype=np.int64)])
+            self.book_sums = np.concatenate([self.book_sums, np.zeros(missing)])
+        if n_genres > len(self.genre_age):
+            missing = n_genres - len(self.genre_age)
+            self.genre_age = np.concatenate([self.genre_age, np.zeros((missing, UNKNOWN_AGE + 1), dtype=np.int64)])
+
+    def add_users(self, user_ids, ages):
+        """Register users (with their ages) in the order given; known users only get their age updated."""
+        rows = []
+        for user_id in np.asarray(user_ids).tolist():
+            row = self._user_pos.get(user_id)
+            if row is None:
+                row = self._user_pos[user_id] = len(self.user_ids)
+                self.user_ids.append(user_id)
+            rows.append(row)
+        self._grow()
+        self.user_age[np.array(rows, dtype=np.int64)] = age_buckets(ages)
+
+    def add_user(self, user_id, age):
+        self.add_users([int(user_id)], [age])
+
+    def _user_row(self, user_id):
+        row = self._user_pos.get(user_id)
+        if row is None:
+            self.add_users([user_id], [None])
+            row = self._user_pos[user_id]
+        return row
+
+    def _add_ratings(self, rows, books, genres, ratings):
+        """Fold many ratings in at once: every table is updated with one bincount."""
+        rated = np.isfinite(ratings)
+        rows, ratings = rows[rated], ratings[rated]
+        book_ids = self.books.intern_many(np.asarray(books, dtype=object)[rated]).astype(np.int64)
+        genre_ids = self.genres.intern_many(np.asarray(genres, dtype=object)[rated]).astype(np.int64)
+        self._grow()
+
+        self.user_counts += np.bincount(rows, minlength=len(self.user_counts))
+        self.user_sums += np.bincount(rows, weights=ratings, minlength=len(self.user_sums))
+        known = book_ids >= 0
+        self.book_counts += np.bincount(book_ids[known], minlength=len(self.book_counts))
+        self.book_sums += np.bincount(book_ids[known], weights=ratings[known], minlength=len(self.book_sums))
+        self.histogram += np.bincount(_rating_buckets(ratings), minlength=len(self.histogram))
+
+        known = genre_ids >= 0
+        cells = genre_ids[known] * (UNKNOWN_AGE + 1) + self.user_age[rows[known]]
+        self.genre_age += np.bincount(cells, minlength=self.genre_age.size).reshape(self.genre_age.shape)
+        shape = (len(self.user_ids), len(self.genres))
+        added = sparse.csr_matrix((np.ones(int(known.sum()), dtype=np.int64), (rows[known], genre_ids[known])),
+                                  shape=shape)
+        self._user_genres = resized(self._user_genres, shape) + added
+
+    def add_rating(self, user_id, book, genre, rating):
+        """Count one new rating: a few array increments, the user x genre matrix gets a pending delta."""
+        rating = float(rating)
+        if not np.isfinite(rating):
+            return
+        row = self._user_row(user_id)
+        book_id, genre_id = self.books.intern(book), self.genres.intern(genre)
+        self._grow()
+        self.user_counts[row] += 1
+        self.user_sums[row] += rating
+        if book_id >= 0:
+            self.book_counts[book_id] += 1
+            self.book_sums[book_id] += rating
+        self.histogram[_rating_buckets(np.array([rating]))[0]] += 1
+        if genre_id >= 0:
+            self.genre_age[genre_id, self.user_age[row]] += 1
+            self._pending[row, genre_id] = self._pending.get((row, genre_id), 0) + 1
+
+    def _add_events(self, events):
+        for event in events:
+            try:
+                user_id = int(event["user_id"])
+            except (TypeError, ValueError):
+                continue
+            self.add_rating(user_id, event["book"], event.get("genre"), event["rating"])
+
+    def refresh(self):
+        """
+        Catch up with ratings logged since the last build or refresh. If users_file changed (a new user, or
+        the log was compacted into it) the tables are rebuilt instead. Returns the number of events folded in.
+        """
+        if self.users_file is None:
+            return 0
+        events = read_events(self.log_file)
+        if file_stamp(self.users_file) != self.users_stamp or len(events) < self.log_events:
+            self.__dict__.update(AnalyticsCube.build(self.users_file, self.log_file, self.store_dir).__dict__)
+            return self.log_events
+        new_events = events[self.log_events:]
+        self._add_events(new_events)
+        self.log_events = len(events)
+        return len(new_events)
+
+    def user_genres(self):
+        """The user x genre rating-count matrix (CSR), pending ratings folded in."""
+        if self._pending:
+            shape = (len(self.user_ids), len(self.genres))
+            rows, cols = (np.array(axis, dtype=np.int64) for axis in zip(*self._pending))
+            counts = np.array(list(self._pending.values()), dtype=np.int64)
+            self._user_genres = resized(self._user_genres, shape) + sparse.csr_matrix((counts, (rows, cols)),
+                                                                                       shape=shape)
+            self._pending = {}
+        return self._user_genres
+
+    ###########################################################################
+    # QUERIES
+    ###########################################################################
+
+    def _genre_names(self, genre_ids):
+        return pd.Index(np.array(self.genres.names, dtype=object)[genre_ids], name="genre")
+
+    def genre_distribution(self, user_id=None, n=None):
+        """Ratings per genre, most rated first: over all users, or one user's history."""
+        if user_id is None:
+            counts = self.genre_age.sum(axis=1)
+        else:
+            row = self._user_pos.get(user_id)
+            counts = np.zeros(len(self.genres), dtype=np.int64)
+            if row is not None:
+                user_row = self.user_genres()[row]
+                counts[user_row.indices] = user_row.data
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0][:n]
+        return pd.Series(counts[order], index=self._genre_names(order), name="ratings")
+
+    def genre_by_age(self, n=None, share=False):
+        """
+        Ratings per genre (rows, most rated first) and age bucket (columns); the "unknown" column only
+        if some user has no age. With share=True each age column is scaled to sum to 1.
+        """
+        totals = self.genre_age.sum(axis=1)
+        order = np.argsort(-totals, kind="stable")
+        order = order[totals[order] > 0][:n]
+        columns = list(AGE_LABELS) + ["unknown"]
+        table = self.genre_age[order].astype(np.float64 if share else np.int64)
+        if share:
+            column_totals = self.genre_age.sum(axis=0)
+            table = np.divide(table, column_totals, out=np.zeros_like(table), where=column_totals > 0)
+        frame = pd.DataFrame(table, index=self._genre_names(order), columns=pd.Index(columns, name="age"))
+        return frame if self.genre_age[:, UNKNOWN_AGE].any() else frame.drop(columns="unknown")
+
+    def rating_histogram(self):
+        """Number of ratings per rating value (in 1 / RATING_STEPS star steps), zero counts left out."""
+        values = np.flatnonzero(self.histogram)
+        return pd.Series(self.histogram[values], index=pd.Index(values / RATING_STEPS, name="rating"), name="ratings")
+
+    def most_rated_books(self, n=10):
+        """The n most rated books as a DataFrame (title index; ratings and mean rating), most rated first."""
+        n = min(n, int(np.count_nonzero(self.book_counts)))
+        if n <= 0:
+            return pd.DataFrame({"ratings": [], "mean": []}, index=pd.Index([], name="title"))
+        top = np.argpartition(-self.book_counts, n - 1)[:n]
+        top = top[np.lexsort((top, -self.book_counts[top]))]
+        counts = self.book_counts[top]
+        return pd.DataFrame({"ratings": counts, "mean": self.book_sums[top] / counts},
+                            index=pd.Index(np.array(self.books.names, dtype=object)[top], name="title"))
+
+    def user_summaries(self):
+        """One row per user: ratings, mean rating, age bucket and most rated genre."""
+        matrix = self.user_genres()
+        top_genre = np.full(len(self.user_ids), None, dtype=object)
+        if matrix.nnz:
+            rated = np.flatnonzero(np.diff(matrix.indptr))
+            top_genre[rated] = np.array(self.genres.names, dtype=object)[
+                np.asarray(matrix[rated].argmax(axis=1)).ravel()]
+        counts = self.user_counts
+        return pd.DataFrame({
+            "ratings": counts,
+            "mean": np.divide(self.user_sums, counts, out=np.full(len(counts), np.nan), where=counts > 0),
+            "age": np.array(list(AGE_LABELS) + ["unknown"], dtype=object)[self.user_age],
+            "top_genre": top_genre,
+        }, index=pd.Index(self.user_ids, name="user_id"))
+
+    def user_summary(self, user_id):
+        """user_summaries() for one user as a dict, or None for an unknown user."""
+        row = self._user_pos.get(user_id)
+        if row is None:
+            return None
+        genres = self.genre_distribution(user_id, n=1)
+        count = int(self.user_counts[row])
+        return {"ratings": count, "mean": float(self.user_sums[row] / count) if count else None,
+                "age": (list(AGE_LABELS) + ["unknown"])[self.user_age[row]],
+                "top_genre": genres.index[0] if len(genres) else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print reading analytics over all users.")
+    parser.add_argument("--top", type=int, default=10, help="genres / books to list")
+    parser.add_argument("--user", type=int, help="also summarize this user")
+    args = parser.parse_args()
+
+    cube = AnalyticsCube.build()
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        print(f"{len(cube.user_ids)} users, {int(cube.user_counts.sum())} ratings\n")
+        print("Ratings per genre and age group:")
+        print(cube.genre_by_age(args.top), "\n")
+        print("Rating histogram:")
+        print(cube.rating_histogram().to_string(), "\n")
+        print("Most rated books:")
+        print(cube.most_rated_books(args.top), "\n")
+        print("Users:")
+        print(cube.user_summaries().describe(include="all"), "\n")
+        if args.user is not None:
+            print(f"User {args.user}:", cube.user_summary(args.user))
+            print(cube.genre_distribution(args.user, args.top).to_string())
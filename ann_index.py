@@ -0,0 +1,110 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
+
+from similarity import top_k_neighbors
+
+ANN_DIM = 32  # rating vectors are reduced to this many dimensions before clustering
+ANN_PROBES = 8  # clusters scanned per query; the recall / latency knob
+KMEANS_ITERATIONS = 10
+
+
+def _centred_stats(rows, n_books, method):
+    """Per-row mean and centred norm, as pearson_similarity / cosine_similarity define them."""
+    sums = np.asarray(rows.sum(axis=1)).ravel()
+    squares = np.asarray(rows.multiply(rows).sum(axis=1)).ravel()
+    if method == "cosine":
+        return np.zeros_like(sums), np.sqrt(squares)
+    means = sums / n_books
+    return means, np.sqrt(np.maximum(squares - n_books * means ** 2, 0.0))
+
+
+def _unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, None]
+
+
+class AnnIndex:
+    """
+    Approximate similar-user search (an IVF index): users' centred rating vectors are reduced to
+    `dim` dimensions with a truncated SVD, so angles between them (Pearson / cosine similarity)
+    are roughly kept, then grouped into ~sqrt(n_users) clusters by spherical k-means.
+    A query scans only the users in its `probes` closest clusters and ranks those candidates by
+    exact similarity. More probes: higher recall, slower queries.
+    """
+
+    def __init__(self, matrix, method="pearson", dim=ANN_DIM, n_lists=None, seed=0):
+        rng = np.random.default_rng(seed)
+        self.method = method
+        self.n_users, n_books = matrix.shape
+        means, _ = _centred_stats(matrix, n_books, method)
+
+        # Centre implicitly: the dense centred matrix is never built
+        centred = LinearOperator(
+            (self.n_users, n_books), dtype=np.float64,
+            matvec=lambda x: matrix @ x.ravel() - means * x.sum(),
+            rmatvec=lambda y: matrix.T @ y.ravel() - means @ y.ravel(),
+        )
+        dim = max(1, min(dim, min(matrix.shape) - 1))
+        _, _, basis = svds(centred, k=dim, random_state=seed)
+        self.basis = basis.T.astype(np.float32)
+        vectors = _unit_rows(self._project(matrix))
+
+        n_lists = max(1, int(np.sqrt(self.n_users))) if n_lists is None else n_lists
+        self.centroids = self._kmeans(vectors, n_lists, rng)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+
+        # Inverted lists: users ordered by cluster, cluster c owns order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(assignment, kind="stable").astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+    @staticmethod
+    def _kmeans(vectors, n_lists, rng, sample=256):
+        """Spherical k-means, trained on at most `sample` users per cluster."""
+        train = vectors[rng.choice(len(vectors), min(len(vectors), sample * n_lists), replace=False)]
+        centroids = train[rng.choice(len(train), min(n_lists, len(train)), replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(train @ centroids.T, axis=1)
+            members = sparse.csr_matrix((np.ones(len(train)), (assignment, np.arange(len(train)))),
+                                        shape=(len(centroids), len(train)))
+            totals = np.asarray(members @ train)
+            empty = ~totals.any(axis=1)
+            totals[empty] = centroids[empty]  # keep a centroid that lost all its members
+            centroids = _unit_rows(totals).astype(np.float32)
+        return centroids
+
+    def _project(self, rows):
+        """Centred rows of the ratings matrix in the reduced space, (n_rows, dim)."""
+        n_books = self.basis.shape[0]
+        if rows.shape[1] > n_books:  # books added after the index was built carry no weight
+            rows = rows[:, :n_books]
+        means, _ = _centred_stats(rows, n_books, self.method)
+        return np.asarray(rows @ self.basis) - np.outer(means, self.basis.sum(axis=0))
+
+    def candidates(self, matrix, row, probes=ANN_PROBES):
+        """Indexed users in the `probes` clusters closest to row (row itself excluded)."""
+        query = self._project(matrix[row])[0]
+        lists = np.argsort(-(self.centroids @ query))[:probes]
+        found = np.sort(np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists]))
+        return found[found != row]
+
+    def query(self, matrix, row, k=5, probes=ANN_PROBES):
+        """
+        Approximate top-k most similar rows to row: (indices, scores) best first, like top_k_neighbors.
+        Candidates are scored exactly against the current matrix, so ratings added since the index was
+        built still count; users added since then are only found once the index is rebuilt.
+        """
+        found = self.candidates(matrix, row, probes)
+        if len(found) == 0:
+            return found, np.array([], dtype=np.float64)
+
+        n_books = matrix.shape[1]
+        rows = matrix[np.append(found, row)]
+        means, norms = _centred_stats(rows, n_books, self.method)
+        dots = np.asarray((rows[:-1] @ rows[-1].T).todense()).ravel()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (dots - n_books * means[:-1] * means[-1]) / (norms[:-1] * norms[-1])
+
+        top, top_scores = top_k_neighbors(scores, k)
+        return found[top], top_scores
@@ -0,0 +1,134 @@
+"""
+Nightly batch: "similar users liked" recommendations for every user in one pass.
+
+    python batch_recommend.py [--output batch_recommendations.csv] [--workers N] [--block-size B]
+
+Neighbors come from the ratings store's precomputed top-k lists (or a blocked similarity product),
+each block of users is scored with one sparse (neighbor weights x ratings) product, and already-read
+books are masked out. With --workers the user blocks are spread over a process pool whose workers
+share the memory-mapped ratings store.
+"""
+import argparse
+import csv
+import multiprocessing
+
+import numpy as np
+from scipy import sparse
+
+from ratings_store import STORE_DIR, open_shared
+from similarity import SIMILARITY_METHODS, block_rows, block_top_k_neighbors, top_k_neighbors
+
+OUTPUT_FILE = "batch_recommendations.csv"
+N_NEIGHBORS = 5  # same as recommend_books_by_users
+TOP_N = 5
+
+
+def block_neighbors(store, rows, n_neighbors, method="pearson"):
+    """Neighbors of the given rows: the store's precomputed lists if long enough, else a similarity block."""
+    if store.neighbors is not None and store.neighbors.shape[1] >= n_neighbors and method == "pearson":
+        return np.asarray(store.neighbors[rows, :n_neighbors])
+    matrix, _, _ = store.matrix()
+    neighbors, _ = block_top_k_neighbors(SIMILARITY_METHODS[method](matrix, rows), rows, n_neighbors)
+    return neighbors
+
+
+def recommend_block(store, rows, n_neighbors=N_NEIGHBORS, top_n=TOP_N):
+    """
+    Score one block of users. Each user's scores are the mean rating of their neighbors
+    (the whole block is a single sparse product), restricted to unread books with a positive score.
+    Returns [(row, [(book_col, score), ...]), ...] with the best book first.
+    """
+    matrix, _, _ = store.matrix()
+    neighbors = block_neighbors(store, rows, n_neighbors)
+
+    found = neighbors >= 0
+    per_row = found.sum(axis=1)
+    weights = np.repeat(1.0 / np.maximum(per_row, 1), per_row)
+    block_index = np.repeat(np.arange(len(rows)), per_row)
+    averaging = sparse.csr_matrix((weights, (block_index, neighbors[found])), shape=(len(rows), matrix.shape[0]))
+    scores = (averaging @ matrix).tocsr()
+    read = matrix[rows]
+
+    results = []
+    for i, row in enumerate(rows):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        columns, values = scores.indices[start:end], scores.data[start:end].copy()
+        read_start, read_end = read.indptr[i], read.indptr[i + 1]
+        already_read = read.indices[read_start:read_end][read.data[read_start:read_end] > 0]
+        values[np.isin(columns, already_read) | (values <= 0)] = -np.inf
+        # Ties go to the lower column, i.e. the alphabetically first title
+        order = np.argsort(columns)
+        top, top_scores = top_k_neighbors(values[order], top_n)
+        results.append((int(row), list(zip(columns[order][top].tolist(), top_scores.tolist()))))
+    return results
+
+
+_worker_store = None
+
+def _init_worker(store_dir):
+    global _worker_store
+    _worker_store = open_shared(store_dir)
+
+def _worker_block(args):
+    rows, n_neighbors, top_n = args
+    return recommend_block(_worker_store, rows, n_neighbors, top_n)
+
+
+def recommend_all(store, n_neighbors=N_NEIGHBORS, top_n=TOP_N, block_size=1024, workers=1, store_dir=STORE_DIR):
+    """
+    Yield (row, [(book_col, score), ...]) for every user in the store, block by block.
+    With workers > 1 blocks are computed by a process pool opening store_dir read-only
+    (the store must be saved there, as open_ratings_store does).
+    """
+    matrix, _, _ = store.matrix()
+    blocks = block_rows(matrix.shape[0], max(matrix.shape), block_size)
+    if workers <= 1:
+        for rows in blocks:
+            yield from recommend_block(store, rows, n_neighbors, top_n)
+        return
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(store_dir,)) as pool:
+        for block in pool.imap(_worker_block, [(rows, n_neighbors, top_n) for rows in blocks]):
+            yield from block
+
+
+def write_batch(output_file=OUTPUT_FILE, n_neighbors=N_NEIGHBORS, top_n=TOP_N, block_size=1024, workers=1):
+    """
+    Compute recommendations for all users and write them to output_file as CSV rows
+    (user_id, rank, title, author, score). Titles missing from the cleaned catalog are skipped,
+    as recommend_books_by_users does. Returns the number of users written.
+    """
+    from recommendations_engine import get_recommender
+    recommender = get_recommender()
+    store = recommender.ratings_store
+    _, user_ids, books = store.matrix()
+    vocabulary = recommender.vocabulary
+    catalog_ids = vocabulary.catalog_ids(books)  # book ID per column, -1 if not in the cleaned catalog
+
+    n_users = 0
+    with open(output_file, mode='w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "rank", "title", "author", "score"])
+        for row, picks in recommend_all(store, n_neighbors, top_n, block_size, workers):
+            rank = 0
+            for col, score in picks:
+                book_id = catalog_ids[col]
+                if book_id >= 0:
+                    rank += 1
+                    writer.writerow([user_ids[row], rank, vocabulary.title(book_id), vocabulary.author(book_id),
+                                     round(score, 4)])
+            n_users += 1
+    return n_users
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute user-based recommendations for every user.")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread user blocks over")
+    parser.add_argument("--block-size", type=int, default=1024, help="users scored per block")
+    parser.add_argument("--neighbors", type=int, default=N_NEIGHBORS)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    count = write_batch(args.output, args.neighbors, args.top, args.block_size, args.workers)
+    print(f"Wrote recommendations for {count} users to {args.output}")
@@ -0,0 +1,47 @@
+"""
+ALS matrix factorization: training time per epoch (single process vs a process pool) and serving
+latency (one dot product + argpartition per request), on users.csv and synthetic populations.
+
+    python benchmarks/bench_als.py [workers] [synthetic sizes ...]     # default: 4 20000 100000
+
+Run from the repository root.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from als import ALSModel
+from bench_ann import shipped_matrix, synthetic_matrix
+
+EPOCHS = 5
+REQUESTS = 1000
+
+
+def run(name, matrix, workers):
+    user_ids, books = pd.RangeIndex(matrix.shape[0]), pd.RangeIndex(matrix.shape[1])
+    print(f"{name}: {matrix.shape[0]} users x {matrix.shape[1]} books, {matrix.nnz} ratings")
+
+    for n in sorted({1, workers}):
+        epoch_times = []
+        model = ALSModel.train(matrix, user_ids, books, epochs=EPOCHS, workers=n, epoch_times=epoch_times)
+        print(f"  train workers={n:<2d}  {np.mean(epoch_times) * 1000:8.1f} ms/epoch  "
+              f"train RMSE {model.rmse(matrix):.3f}")
+
+    rows = np.random.default_rng(0).integers(0, matrix.shape[0], REQUESTS)
+    start = time.perf_counter()
+    for row in rows:
+        model.recommend(model.user_factors[row], exclude=matrix[row].indices)
+    serve_ms = (time.perf_counter() - start) / REQUESTS * 1000
+    print(f"  serve top-5         {serve_ms:8.3f} ms/request")
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sizes = [int(arg) for arg in sys.argv[2:]] or [20000, 100000]
+    run("users.csv", shipped_matrix(), workers)
+    for n_users in sizes:
+        run("synthetic", synthetic_matrix(n_users), workers)
@@ -0,0 +1,85 @@
+"""
+Recall@5 and query latency of the approximate similar-user index (ann_index.AnnIndex) against exact
+Pearson, on the shipped users.csv and on synthetic populations with clustered tastes.
+
+    python benchmarks/bench_ann.py [synthetic sizes ...]     # default: 20000 100000
+
+Run from the repository root. Recall counts an approximate neighbor as a hit if its similarity is at
+least the exact 5th best, so ties between equally similar users are not counted as misses.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann_index import AnnIndex
+from similarity import pearson_similarity, top_k_neighbors
+
+K = 5
+QUERIES = 200
+PROBES = (1, 2, 4, 8, 16)
+
+
+def synthetic_matrix(n_users, n_books=5000, n_tastes=200, per_user=20, seed=0):
+    """Users drawn from n_tastes groups; each group mostly rates its own slice of the catalog."""
+    rng = np.random.default_rng(seed)
+    tastes = rng.integers(0, n_tastes, n_users)
+    slice_size = n_books // n_tastes * 4
+    own = (tastes[:, None] * (n_books // n_tastes) + rng.integers(0, slice_size, (n_users, per_user))) % n_books
+    random = rng.integers(0, n_books, (n_users, per_user))
+    books = np.where(rng.random((n_users, per_user)) < 0.8, own, random)
+    ratings = np.clip(np.round(rng.normal(3.5 + (tastes % 3)[:, None] * 0.5, 1.0, books.shape)), 1, 5)
+
+    rows = np.repeat(np.arange(n_users), per_user)
+    matrix = sparse.csr_matrix((ratings.ravel(), (rows, books.ravel())), shape=(n_users, n_books))
+    matrix.sum_duplicates()
+    matrix.data = np.minimum(matrix.data, 5.0)
+    return matrix
+
+
+def shipped_matrix():
+    from ratings_store import open_ratings_store
+    return open_ratings_store().matrix()[0]
+
+
+def run(name, matrix):
+    rng = np.random.default_rng(1)
+    queries = rng.choice(matrix.shape[0], min(QUERIES, matrix.shape[0]), replace=False)
+
+    start = time.perf_counter()
+    exact = []
+    for row in queries:
+        _, scores = top_k_neighbors(pearson_similarity(matrix, row)[0], K, exclude=row)
+        exact.append(scores)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    start = time.perf_counter()
+    index = AnnIndex(matrix)
+    build_s = time.perf_counter() - start
+    print(f"{name}: {matrix.shape[0]} users x {matrix.shape[1]} books, {matrix.nnz} ratings; "
+          f"index build {build_s:.2f} s ({len(index.centroids)} clusters)")
+    print(f"  exact Pearson       {exact_ms:8.2f} ms/query")
+
+    for probes in PROBES:
+        hits = candidates = 0
+        start = time.perf_counter()
+        for row, exact_scores in zip(queries, exact):
+            _, scores = index.query(matrix, row, K, probes)
+            if len(exact_scores):
+                hits += np.count_nonzero(scores >= exact_scores[-1] - 1e-9)
+        query_ms = (time.perf_counter() - start) / len(queries) * 1000
+        for row in queries[:50]:
+            candidates += len(index.candidates(matrix, row, probes))
+        recall = hits / sum(len(s) for s in exact)
+        print(f"  ANN probes={probes:<2d}      {query_ms:8.2f} ms/query  recall@{K} {recall:.3f}  "
+              f"~{candidates // 50} candidates scored")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [20000, 100000]
+    run("users.csv", shipped_matrix())
+    for n_users in sizes:
+        run("synthetic", synthetic_matrix(n_users))
@@ -0,0 +1,58 @@
+"""
+Per-worker resident memory when workers open the ratings store memory-mapped vs loading it privately.
+
+    python benchmarks/bench_shared_memory.py [workers]
+
+Run from the repository root after the store exists (running the CLI once, or
+`python -c "import ratings_store; ratings_store.open_ratings_store()"`, builds it).
+Linux only: reads RssAnon (private) and RssFile (shared page cache) from /proc/self/status.
+"""
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ratings_store
+import storage
+
+
+def rss_kib():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def worker(shared):
+    before = rss_kib()
+    if shared:
+        store = ratings_store.open_shared()
+        books = storage.open_books(columns=["title", "author", "rating"])
+    else:
+        store = ratings_store.RatingsStore.load()
+        books = storage.load_table(os.path.join(storage.STORE_DIR, "books"), ["title", "author", "rating"])
+    # Touch the data the way a request would
+    for user_id in store.user_ids[:50]:
+        store.similar_users(user_id, 5)
+    store.matrix()[0].sum()
+    len(books["title"])
+    after = rss_kib()
+    return {name: after[name] - before.get(name, 0) for name in after}
+
+
+def run(workers, shared):
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        results = pool.map(worker, [shared] * workers)
+    anon = sum(r["RssAnon"] for r in results) / workers
+    file_backed = sum(r["RssFile"] for r in results) / workers
+    label = "memory-mapped" if shared else "private copy "
+    print(f"{label}: {anon:10.0f} KiB private + {file_backed:10.0f} KiB shared page cache per worker")
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    run(workers, shared=False)
+    run(workers, shared=True)
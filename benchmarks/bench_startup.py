@@ -0,0 +1,56 @@
+"""
+Startup cost of the CLI and the engine: import time and import-time memory, then the cost of
+loading everything on first use (Recommender.warm).
+
+    python benchmarks/bench_startup.py [repeats]
+
+Run from the repository root. Every measurement runs in a fresh interpreter.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time, tracemalloc
+sys.path.insert(0, {root!r})
+tracemalloc.start()
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+import_peak = tracemalloc.get_traced_memory()[1]
+result = {{"import_s": import_time, "import_peak_mib": import_peak / 2**20,
+           "heavy_modules": sorted(m for m in ("numpy", "pandas", "scipy") if m in sys.modules)}}
+if {warm}:
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    import recommendations_engine
+    recommendations_engine.get_recommender().warm(background=False)
+    result["warm_s"] = time.perf_counter() - start
+    result["warm_peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+print(json.dumps(result))
+"""
+
+
+def probe(module, warm=False):
+    code = PROBE.format(root=ROOT, module=module, warm=warm)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def best(module, repeats, warm=False):
+    runs = [probe(module, warm) for _ in range(repeats)]
+    return min(runs, key=lambda r: r["import_s"])
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for module in ("interactive_code", "recommendations_engine"):
+        r = best(module, repeats)
+        heavy = ", ".join(r["heavy_modules"]) or "none"
+        print(f"import {module:24s} {r['import_s'] * 1000:8.1f} ms  "
+              f"peak {r['import_peak_mib']:6.1f} MiB  heavy modules loaded: {heavy}")
+    r = best("interactive_code", repeats, warm=True)
+    print(f"first use (Recommender.warm)     {r['warm_s'] * 1000:8.1f} ms  peak {r['warm_peak_mib']:6.1f} MiB")
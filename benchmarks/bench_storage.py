@@ -0,0 +1,59 @@
+"""
+Load time of the CSV path vs the columnar store.
+
+    python benchmarks/bench_storage.py [repeats]
+
+Run from the repository root (the data files are looked up in the current directory).
+"""
+import ast
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage
+
+
+def csv_path():
+    """What the engine did before the columnar store: read both CSVs and literal_eval every list cell."""
+    book_data = pd.read_csv(storage.BOOKS_FILE)
+    book_df = book_data.dropna(axis=1, thresh=len(book_data) * 2 / 3).dropna(subset=['genre']).copy()
+    book_df['genre'] = book_df['genre'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') else x)
+
+    user_df = pd.read_csv(storage.USERS_FILE)
+    rows = []
+    for user_id, history in zip(user_df.index, user_df["book_history"]):
+        try:
+            history = ast.literal_eval(history)
+        except (ValueError, SyntaxError):
+            continue
+        rows.extend({"user_id": user_id, "book": b["book"], "rating": b["rating"]} for b in history)
+    return book_df, user_df, pd.DataFrame(rows)
+
+
+def columnar_path():
+    return storage.load_books(), storage.load_users(), storage.load_ratings()
+
+
+def best_of(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    start = time.perf_counter()
+    storage.import_csv()
+    print(f"one-off import:  {time.perf_counter() - start:8.4f} s")
+
+    csv_time = best_of(csv_path, repeats)
+    columnar_time = best_of(columnar_path, repeats)
+    print(f"CSV load:        {csv_time:8.4f} s")
+    print(f"columnar load:   {columnar_time:8.4f} s  ({csv_time / columnar_time:.1f}x faster)")
@@ -0,0 +1,374 @@
+"""
+Benchmark suite for the engine and storage hot paths, on synthetic datasets at several scales.
+Every case runs in a fresh interpreter: wall time (min / median over repeats) and peak memory
+allocated during one call (tracemalloc) are recorded to a JSON file and compared with a baseline.
+
+    python benchmarks/bench_suite.py [--scales small medium large] [--cases ...]
+                                     [--output benchmarks/results.json]
+                                     [--baseline benchmarks/baseline.json] [--save-baseline]
+                                     [--tolerance 0.25] [--timeout 600]
+
+Scales (users x books): small 1k x 2k, medium 100k x 200k, large 1M x 200k. Datasets are generated
+once per scale with a fixed seed into benchmarks/data/<scale>/ (a users.csv, catalog CSV and
+columnar store laid out like the repository root) and reused while the generator settings match.
+Cases whose legacy path cannot fit in memory at a scale are recorded as skipped.
+
+The exit status is 1 when a case is more than --tolerance slower (median) or heavier (peak
+memory) than the baseline, so the suite can gate changes to the engine. Baselines are
+machine-specific: save one on the machine that will run the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, ROOT)
+
+SCALES = {"small": (1000, 2000), "medium": (100000, 200000), "large": (1000000, 200000)}
+DATA_DIR = os.path.join(HERE, "data")
+RESULTS_FILE = os.path.join(HERE, "results.json")
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+
+SEED = 0
+MAX_BOOKS = 20  # per simulated user: about 10 ratings on average
+N_GENRES = 300
+GENERATOR_VERSION = 1  # bump when the dataset layout changes, to regenerate cached data
+
+MIN_TIME = 1.0  # seconds of repeats per case (at least one call)
+MAX_REPEATS = 50
+TIMEOUT = 600
+TOLERANCE = 0.25
+LEGACY_MAX_USERS = 200000  # user_df with parsed histories as Python dicts: ~2M ratings
+DENSE_MAX_CELLS = 2 * 10 ** 8  # ratings_matrix pivots to a dense users x books float frame
+
+###############################################################################
+# DATASETS
+###############################################################################
+
+def synthetic_books(n_books, seed=SEED):
+    """A catalog CSV frame like Amazon_books_cleaned.csv: 1-3 genres per book, popular genres more common."""
+    rng = np.random.default_rng([seed, n_books])
+    genre_weights = 1.0 / np.arange(1, N_GENRES + 1)
+    genre_weights /= genre_weights.sum()
+    genre_lists = [sorted(set(picks)) for picks in
+                   (rng.choice(N_GENRES, rng.integers(1, 4), p=genre_weights) for _ in range(n_books))]
+    return pd.DataFrame({
+        "id": np.arange(1, n_books + 1),
+        "title": [f"Synthetic Book {i}" for i in range(n_books)],
+        "author": [f"Author {i}" for i in rng.integers(0, max(1, n_books // 4), n_books)],
+        "rating": np.round(np.clip(rng.normal(4.4, 0.3, n_books), 1, 5), 1),
+        "reviews_count": rng.integers(1, 50000, n_books),
+        "genre": [str([f"Genre {g}" for g in genres]) for genres in genre_lists],
+    })
+
+
+def ensure_dataset(scale):
+    """Generate the scale's dataset directory unless an identical one is already there."""
+    import simulate_users
+    import storage
+    n_users, n_books = SCALES[scale]
+    data_dir = os.path.join(DATA_DIR, scale)
+    settings = {"users": n_users, "books": n_books, "seed": SEED, "max_books": MAX_BOOKS,
+                "version": GENERATOR_VERSION}
+    settings_file = os.path.join(data_dir, "dataset.json")
+    if os.path.isfile(settings_file):
+        with open(settings_file, encoding="utf-8") as f:
+            if json.load(f) == settings:
+                return data_dir
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    print(f"generating {scale} dataset ({n_users} users x {n_books} books) in {data_dir}")
+    start = time.perf_counter()
+    books_file = os.path.join(data_dir, storage.BOOKS_FILE)
+    store_dir = os.path.join(data_dir, storage.STORE_DIR)
+    synthetic_books(n_books).to_csv(books_file, index=False)
+    storage.import_books(books_file, store_dir)
+
+    catalog = simulate_users.Catalog(storage.load_books(store_dir))
+    names = (np.array(["Ada", "Ben", "Chloe", "Dmitri", "Eva", "Farid", "Grace", "Hugo"], dtype=object),
+             np.array(["Ito", "Jones", "Khan", "Lopez", "Müller", "Nakamura", "Okafor"], dtype=object))
+    chunk = simulate_users.CHUNK_SIZE
+    chunks = (simulate_users.generate_chunk(catalog, names, first, min(chunk, n_users - first), MAX_BOOKS, SEED)
+              for first in range(0, n_users, chunk))
+    storage.stream_users(chunks, users_file=os.path.join(data_dir, storage.USERS_FILE), store_dir=store_dir)
+
+    with open(settings_file, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    print(f"  done in {time.perf_counter() - start:.1f} s")
+    return data_dir
+
+###############################################################################
+# CASES: each setup runs in the dataset directory and returns the call to time
+###############################################################################
+
+def _user_df():
+    import storage
+    return storage.load_users(log_file=os.devnull)
+
+
+def _book_df():
+    import storage
+    from recommendations_engine import clean_book_df
+    return clean_book_df(storage.load_books(clean=False))
+
+
+def _query_user():
+    """A fixed user in the middle of the population, so every run asks the same question."""
+    import storage
+    ids = storage.load_column(os.path.join(storage.STORE_DIR, "users"), "ID")
+    return int(ids[len(ids) // 2])
+
+
+def _store():
+    import storage
+    from ratings_store import RatingsStore
+    # No precomputed neighbor lists: the exact similarity product is what is being timed
+    return RatingsStore.from_ratings_df(storage.load_ratings(log_file=os.devnull))
+
+
+def setup_clean_book_df():
+    import storage
+    from recommendations_engine import clean_book_df
+    book_data = pd.read_csv(storage.BOOKS_FILE)
+    return lambda: clean_book_df(book_data)
+
+
+def setup_ratings_matrix():
+    from interning import Vocabulary
+    from recommendations_engine import ratings_matrix
+    user_df, vocabulary = _user_df(), Vocabulary(_book_df())
+    return lambda: ratings_matrix(user_df, vocabulary)
+
+
+def setup_find_similar_users():
+    from interning import Vocabulary
+    from recommendations_engine import find_similar_users
+    user_df, user_id, vocabulary = _user_df(), _query_user(), Vocabulary(_book_df())
+    return lambda: find_similar_users(user_id, user_df, k=5, vocabulary=vocabulary)
+
+
+def setup_find_similar_users_store():
+    from recommendations_engine import _similar_users
+    matrix, user_ids, _ = _store().matrix()
+    user_id = _query_user()
+    return lambda: _similar_users(matrix, user_ids, user_id, k=5)
+
+
+def setup_recommend_books_by_users():
+    from recommendations_engine import recommend_books_by_users
+    book_df, user_df, user_id = _book_df(), _user_df(), _query_user()
+    return lambda: recommend_books_by_users(book_df, user_df, user_id)
+
+
+def setup_recommend_books_by_users_store():
+    from interning import Vocabulary
+    from recommendations_engine import recommend_books_by_users
+    book_df, store, user_id = _book_df(), _store(), _query_user()
+    store.matrix()
+    # As the Recommender serves it: catalog interned once
+    vocabulary = Vocabulary(book_df)
+    return lambda: recommend_books_by_users(book_df, None, user_id, store=store, vocabulary=vocabulary)
+
+
+def setup_recommend_by_total_rating():
+    from recommendations_engine import recommend_by_total_rating
+    book_df, user_df, user_id = _book_df(), _user_df(), _query_user()
+    return lambda: recommend_by_total_rating(book_df, user_df, user_id)
+
+
+def setup_recommend_by_content():
+    from content_based import ContentModel
+    from interning import Vocabulary
+    from recommendations_engine import recommend_by_content
+    book_df, user_df, user_id = _book_df(), _user_df(), _query_user()
+    model = ContentModel.build(book_df, Vocabulary(book_df))
+    return lambda: recommend_by_content(user_df, user_id, model)
+
+
+def setup_analytics_cube():
+    from analytics import AnalyticsCube
+    return lambda: AnalyticsCube.build(log_file=os.devnull)
+
+
+def setup_analytics_queries():
+    from analytics import AnalyticsCube
+    cube, user_id = AnalyticsCube.build(log_file=os.devnull), _query_user()
+    return lambda: (cube.genre_by_age(10), cube.rating_histogram(), cube.most_rated_books(10),
+                    cube.user_summary(user_id))
+
+
+def setup_book_exists_in_db():
+    import storage
+    from interactive_code import book_exists_in_db
+    books = pd.read_csv(storage.BOOKS_FILE, usecols=["title", "author"])
+    title, author = books.iloc[len(books) // 2]
+    book_exists_in_db(title, author)  # the session index loads once, on first use
+    return lambda: book_exists_in_db(title, author)
+
+
+def setup_overwrite_user_row():
+    import storage
+    from interactive_code import get_user_row, overwrite_user_row
+    # Rewrites the whole file on every call, so it works on a copy
+    shutil.copyfile(storage.USERS_FILE, "overwrite_users.csv")
+    row = dict(get_user_row(str(_query_user()), "overwrite_users.csv"))
+    row["age"] = "42"
+    return lambda: overwrite_user_row(row, "overwrite_users.csv")
+
+
+def legacy_user_df(n_users, n_books):
+    if n_users > LEGACY_MAX_USERS:
+        return f"user_df with parsed histories for more than {LEGACY_MAX_USERS} users does not fit in memory"
+
+
+def dense_matrix(n_users, n_books):
+    if n_users * n_books > DENSE_MAX_CELLS:
+        return f"dense {n_users} x {n_books} pivot does not fit in memory"
+    return legacy_user_df(n_users, n_books)
+
+
+# name -> (setup, limit(n_users, n_books) returning a reason to skip, or None)
+CASES = {
+    "clean_book_df": (setup_clean_book_df, None),
+    "ratings_matrix": (setup_ratings_matrix, dense_matrix),
+    "find_similar_users": (setup_find_similar_users, legacy_user_df),
+    "find_similar_users[store]": (setup_find_similar_users_store, None),
+    "recommend_books_by_users": (setup_recommend_books_by_users, legacy_user_df),
+    "recommend_books_by_users[store]": (setup_recommend_books_by_users_store, None),
+    "recommend_by_total_rating": (setup_recommend_by_total_rating, legacy_user_df),
+    "recommend_by_content": (setup_recommend_by_content, legacy_user_df),
+    "analytics_cube": (setup_analytics_cube, None),
+    "analytics_queries": (setup_analytics_queries, None),
+    "book_exists_in_db": (setup_book_exists_in_db, None),
+    "overwrite_user_row": (setup_overwrite_user_row, None),
+}
+
+###############################################################################
+# RUNNING
+###############################################################################
+
+def measure(case):
+    """Child process: set the case up in the current directory, time it, then trace one call's memory."""
+    call = CASES[case][0]()
+    times = []
+    while not times or (sum(times) < MIN_TIME and len(times) < MAX_REPEATS):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    call()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {"repeats": len(times), "min_s": min(times), "median_s": statistics.median(times),
+            "peak_mib": peak / 2 ** 20}
+
+
+def run_case(case, scale, data_dir, timeout):
+    n_users, n_books = SCALES[scale]
+    result = {"case": case, "scale": scale, "users": n_users, "books": n_books}
+    limit = CASES[case][1]
+    reason = limit(n_users, n_books) if limit is not None else None
+    if reason is not None:
+        return {**result, "status": "skipped", "reason": reason}
+    try:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", case],
+                               cwd=data_dir, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {**result, "status": "timeout", "reason": f"over {timeout} s"}
+    if child.returncode != 0:
+        lines = (child.stderr or f"exit status {child.returncode}").strip().splitlines()
+        return {**result, "status": "error", "reason": lines[-1] if lines else f"exit status {child.returncode}"}
+    return {**result, "status": "ok", **json.loads(child.stdout.strip().splitlines()[-1])}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "pandas": pd.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, baseline, tolerance):
+    """Print each result next to its baseline; return the (case, scale) pairs that regressed."""
+    previous = {(r["case"], r["scale"]): r for r in baseline["results"] if r["status"] == "ok"}
+    regressions = []
+    for result in results:
+        old = previous.get((result["case"], result["scale"]))
+        if result["status"] != "ok" or old is None:
+            continue
+        time_ratio = result["median_s"] / old["median_s"] if old["median_s"] else 1.0
+        memory_ratio = result["peak_mib"] / old["peak_mib"] if old["peak_mib"] > 0.01 else 1.0
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append((result["case"], result["scale"]))
+        print(f"  {result['case']:34s} {result['scale']:7s} time x{time_ratio:5.2f}  memory x{memory_ratio:5.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(args):
+    results = []
+    for scale in args.scales:
+        data_dir = ensure_dataset(scale)
+        n_users, n_books = SCALES[scale]
+        print(f"{scale}: {n_users} users x {n_books} books")
+        for case in args.cases:
+            result = run_case(case, scale, data_dir, args.timeout)
+            results.append(result)
+            if result["status"] == "ok":
+                print(f"  {case:34s} {result['median_s'] * 1000:11.2f} ms median  {result['min_s'] * 1000:11.2f} ms min"
+                      f"  {result['peak_mib']:9.1f} MiB peak  ({result['repeats']} runs)")
+            else:
+                print(f"  {case:34s} {result['status']}: {result['reason']}")
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"results written to {args.output}")
+
+    regressions = []
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"compared with {args.baseline} (commit {baseline['environment'].get('commit')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the engine's hot paths on synthetic datasets.")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small"])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown / growth, 0.25 = 25%%")
+    parser.add_argument("--timeout", type=int, default=TIMEOUT, help="seconds per case")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+    else:
+        sys.exit(main(args))
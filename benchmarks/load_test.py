@@ -0,0 +1,109 @@
+"""
+Load test for server.py: many concurrent keep-alive connections sending a recommend / surprise mix.
+Reports requests per second and p50 / p99 latency per endpoint.
+
+    python server.py &
+    python benchmarks/load_test.py [--url http://127.0.0.1:8765] [--connections 32] [--requests 2000]
+
+Run from the repository root (user IDs are sampled from users.csv). Ratings are not sent by default
+because they write to the data files; --rate-share 0.05 includes them.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def user_ids(users_file=os.path.join(ROOT, "users.csv")):
+    with open(users_file, newline="", encoding="utf-8") as f:
+        return [row["ID"] for row in csv.DictReader(f)]
+
+
+def request_bytes(host, method, path, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    head = (f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n")
+    return head.encode("latin-1") + data
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+def next_request(host, ids, rate_share, rng):
+    roll = rng.random()
+    if roll < rate_share:
+        body = {"user_id": rng.choice(ids), "title": "Load Test Book", "author": "Load Tester",
+                "genre": "Testing", "rating": rng.randint(1, 5)}
+        return "/rate", request_bytes(host, "POST", "/rate", body)
+    if roll < rate_share + 0.1:
+        return "/surprise", request_bytes(host, "GET", "/surprise?n=3")
+    path = "/recommend?" + urllib.parse.urlencode({"user_id": rng.choice(ids)})
+    return "/recommend", request_bytes(host, "GET", path)
+
+
+async def connection(url, ids, count, rate_share, seed, latencies, statuses):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port)
+    try:
+        for _ in range(count):
+            endpoint, payload = next_request(url.netloc, ids, rate_share, rng)
+            start = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def main(url, connections, requests, rate_share):
+    url = urllib.parse.urlsplit(url)
+    ids = user_ids()
+    latencies, statuses = {}, {}
+    per_connection = max(1, requests // connections)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection(url, ids, per_connection, rate_share, seed, latencies, statuses)
+                           for seed in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} requests over {connections} connections in {elapsed:.2f} s: {total / elapsed:.1f} req/s")
+    print(f"status codes: {dict(sorted(statuses.items()))}")
+    everything = [value for values in latencies.values() for value in values]
+    for endpoint, values in sorted(latencies.items()) + [("all", everything)]:
+        print(f"  {endpoint:12s} n={len(values):<6d} p50 {percentile(values, 50) * 1000:8.2f} ms  "
+              f"p99 {percentile(values, 99) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test against server.py.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate-share", type=float, default=0.0, help="fraction of requests that are ratings")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.connections, args.requests, args.rate_share))
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# Catalog columns kept per book, besides the title / author / rating / genres the Vocabulary already has
+COLUMNS = ("id", "reviews_count", "image_url", "url")
+
+
+def _value(value):
+    """A catalog cell as plain JSON-friendly Python: None for NaN, numpy scalars unwrapped."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class BookMetadata:
+    """
+    Everything the catalog says about a book, by Vocabulary book ID or title: author, rating and genres
+    come from the Vocabulary's arrays, the other COLUMNS from object arrays indexed by the same IDs.
+    Built once per catalog, so describing a recommendation is a dict lookup plus a few array reads,
+    never a scan of the catalog. As in the Vocabulary, the first catalog row of a book describes it.
+    """
+
+    def __init__(self, vocabulary, book_df=None):
+        self.vocabulary = vocabulary
+        self.columns = {column: np.full(0, None, dtype=object) for column in COLUMNS}
+        self.known = np.zeros(0, dtype=bool)
+        if book_df is not None:
+            self.add_books(book_df)
+
+    def _grow(self):
+        missing = len(self.vocabulary.books) - len(self.known)
+        if missing > 0:
+            for column, values in self.columns.items():
+                self.columns[column] = np.concatenate([values, np.full(missing, None, dtype=object)])
+            self.known = np.concatenate([self.known, np.zeros(missing, dtype=bool)])
+
+    def add_books(self, book_df):
+        """Record the COLUMNS of catalog rows whose books the vocabulary has interned; the first row of a book wins."""
+        ids = self.vocabulary.catalog_ids(book_df["title"])
+        self._grow()
+        rows = np.flatnonzero(ids >= 0)
+        _, first = np.unique(ids[rows], return_index=True)
+        rows = rows[first]
+        rows = rows[~self.known[ids[rows]]]
+        books = ids[rows]
+        for column in COLUMNS:
+            if column in book_df:
+                values = book_df[column].to_numpy(object)[rows]
+                if column == "reviews_count":  # stored as text, sometimes with thousands separators
+                    values = pd.to_numeric(pd.Series(values, dtype=object).astype(str).str.replace(",", ""),
+                                           errors="coerce").round().astype("Int64").to_numpy(object)
+                self.columns[column][books] = np.where(pd.isna(values), None, values)
+        self.known[books] = True
+
+    def add_book(self, book_id, **columns):
+        """Record the catalog row of one book appended to the catalog (e.g. id=..., reviews_count=...)."""
+        self._grow()
+        if book_id < 0 or self.known[book_id]:
+            return
+        for column, value in columns.items():
+            self.columns[column][book_id] = value
+        self.known[book_id] = True
+
+    def record(self, book_id):
+        """{"title", "author", "rating", "genres", "id", "reviews_count", "image_url", "url"} of a book ID."""
+        vocabulary = self.vocabulary
+        rating = vocabulary.book_rating[book_id] if book_id < len(vocabulary.book_rating) else np.nan
+        record = {"title": vocabulary.title(book_id), "author": vocabulary.author(book_id),
+                  "rating": _value(float(rating)),
+                  "genres": [vocabulary.genres.names[g] for g in vocabulary.genres_of(book_id).tolist()]}
+        for column, values in self.columns.items():
+            record[column] = _value(values[book_id]) if book_id < len(values) else None
+        return record
+
+    def records(self, book_ids):
+        """record() of each book ID, in order."""
+        return [self.record(int(book_id)) for book_id in book_ids]
+
+    def lookup(self, titles):
+        """record() of each title, matched as the Vocabulary matches them; None for titles that aren't catalog books."""
+        books, in_catalog = self.vocabulary.books, self.vocabulary.in_catalog
+        records = []
+        for title in titles:
+            book_id = books.get(title)
+            records.append(self.record(book_id) if 0 <= book_id < len(in_catalog) and in_catalog[book_id] else None)
+        return records
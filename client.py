@@ -0,0 +1,64 @@
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+SERVER_URL = "http://127.0.0.1:8765"
+
+
+class BiblioClient:
+    """
+    Blocking client for server.py, returning the same shapes as the local functions in
+    interactive_code so the CLI can run against either.
+    """
+
+    def __init__(self, url=SERVER_URL, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, params=None, body=None):
+        url = self.url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise KeyError(json.loads(e.read()).get("error", path)) from None
+            raise
+
+    def user_exists(self, user_id, user_name):
+        return self._request("GET", "/login", {"user_id": user_id, "name": user_name})["exists"]
+
+    def recommendations(self, user_id):
+        result = self._request("GET", "/recommend", {"user_id": user_id})
+        return {source: ([book["title"] for book in books], [book["author"] for book in books])
+                for source, books in result.items()}
+
+    def rate(self, user_id, title, author, genre, rating):
+        body = {"user_id": user_id, "title": title, "author": author, "genre": genre, "rating": rating}
+        return self._request("POST", "/rate", body=body)["new_book_id"]
+
+    def surprise(self, n=3, user_id=None, weighting="rating"):
+        params = {"n": n, "weighting": weighting}
+        if user_id is not None:
+            params["user_id"] = user_id
+        return self._request("GET", "/surprise", params)["books"]
+
+    def popular(self, n=10, score="bayesian", genre=None):
+        params = {"n": n, "score": score}
+        if genre is not None:
+            params["genre"] = genre
+        return self._request("GET", "/popular", params)["books"]
+
+    def create_user(self, name, age, preferences, book_history):
+        body = {"name": name, "age": age, "preferences": preferences, "book_history": book_history}
+        result = self._request("POST", "/users", body=body)
+        return result["id"], [tuple(book) for book in result["new_books"]]
+
+    def stats(self):
+        return self._request("GET", "/stats")
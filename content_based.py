@@ -0,0 +1,210 @@
+import copy
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from interning import Interner, normalize_text
+from similarity import top_k_neighbors
+
+# Weight of each block of a book's features, before the whole row is scaled to unit length
+GENRE_WEIGHT = 1.0
+AUTHOR_WEIGHT = 1.0
+RATING_WEIGHT = 0.3
+REVIEWS_WEIGHT = 0.2
+# A user's profile: preferred genres plus their rated books, each rated book weighted by how far
+# its rating is from NEUTRAL_RATING (so disliked books pull away from their features)
+PREFERENCE_WEIGHT = 1.0
+HISTORY_WEIGHT = 1.0
+NEUTRAL_RATING = 3.0
+REVIEW_BUCKETS = 8  # log10 of the review count: 0-9, 10-99, ..., 10**7 and up
+
+_MORE = re.compile(r"&\s*\d+\s*more$")
+_ROLE = re.compile(r"\(([^)]*)\)")
+_NAME_SEPARATORS = re.compile(r",| and ")  # not "&": it is part of publisher names
+
+
+def author_names(author):
+    """
+    Normalized names of the people credited as authors in an Amazon author cell, e.g.
+    "Erik Larson (Author, Narrator), John Lee (Narrator), Random House Audio (Publisher) & 0 more"
+    -> ["erik larson"]. Names without a role count as authors.
+    """
+    if not isinstance(author, str):
+        return []
+    # Commas inside "(Author, Narrator)" don't separate names
+    author = _ROLE.sub(lambda role: "(" + role.group(1).replace(",", "/") + ")", _MORE.sub("", author))
+    names = []
+    for part in _NAME_SEPARATORS.split(author):
+        role = _ROLE.search(part)
+        if role and "author" not in role.group(1).lower():
+            continue
+        name = normalize_text(_ROLE.sub("", part))
+        name = name[3:] if name.startswith("by ") else name
+        if name:
+            names.append(name)
+    return names
+
+
+def _review_counts(values):
+    return pd.to_numeric(pd.Series(values, dtype=object).astype(str).str.replace(",", ""), errors="coerce").to_numpy()
+
+
+class ContentModel:
+    """
+    Every catalog book as a sparse feature vector (genres, author names, rating bucket, review-count
+    bucket), one row per Vocabulary book ID in a single CSR matrix, rows scaled to unit length.
+    Scoring a user is one sparse matrix x profile product plus an argpartition, whatever their
+    history: users with no or few ratings still get recommendations from their preferred genres.
+    """
+
+    def __init__(self, vocabulary, features, feature_names):
+        self.vocabulary = vocabulary
+        self.features = features
+        self.feature_names = feature_names  # Interner: "genre:...", "author:...", "rating:N", "reviews:N"
+        self._pending = []  # (book ID, columns, values) added since the matrix was last rebuilt
+        self._genre_columns = None  # [(column, genre)], for matching preferences
+
+    @classmethod
+    def build(cls, book_df, vocabulary):
+        """Feature matrix for the books of a cleaned catalog, as interned by vocabulary."""
+        names = Interner(key=str)
+        book_ids = vocabulary.catalog_ids(book_df["title"])
+        rows = np.flatnonzero(book_ids >= 0)
+        _, first = np.unique(book_ids[rows], return_index=True)
+        rows = rows[first]
+        books = book_ids[rows]
+
+        genre_books, genre_ids = vocabulary.genre_pairs()
+        genre_columns = names.intern_many(["genre:" + genre for genre in vocabulary.genres.names])
+        genre_per_book = np.bincount(genre_books, minlength=len(vocabulary.books))
+        blocks = [(genre_books, genre_columns[genre_ids], GENRE_WEIGHT / np.sqrt(genre_per_book[genre_books]))]
+
+        # Author cells repeat a lot; each distinct one is split into names once
+        author_codes, authors = pd.factorize(pd.Series(book_df["author"].to_numpy(object)[rows], dtype=object))
+        split = [author_names(author) for author in authors]
+        name_columns = [names.intern_many(["author:" + name for name in people]) for people in split]
+        per_book = [name_columns[code] if code >= 0 else () for code in author_codes.tolist()]
+        counts = np.array([len(columns) for columns in per_book], dtype=np.int64)
+        author_books = np.repeat(books, counts)
+        author_columns = np.array([c for columns in per_book for c in columns], dtype=np.int64)
+        blocks.append((author_books, author_columns, np.repeat(AUTHOR_WEIGHT / np.sqrt(np.maximum(counts, 1)), counts)))
+
+        for prefix, buckets, weight in (
+                ("rating", cls._rating_buckets(book_df["rating"].to_numpy(object)[rows]), RATING_WEIGHT),
+                ("reviews", cls._review_buckets(book_df["reviews_count"].to_numpy(object)[rows]
+                                                if "reviews_count" in book_df else np.full(len(rows), np.nan)),
+                 REVIEWS_WEIGHT)):
+            known = buckets >= 0
+            columns = names.intern_many([f"{prefix}:{b}" for b in buckets[known].tolist()])
+            blocks.append((books[known], columns, np.full(int(known.sum()), weight)))
+
+        row, col, val = (np.concatenate(parts) for parts in zip(*blocks))
+        features = sparse.csr_matrix((val, (row, col)), shape=(len(vocabulary.books), len(names)))
+        return cls(vocabulary, _unit_rows(features), names)
+
+    @staticmethod
+    def _rating_buckets(ratings):
+        """Half-star buckets 0-10, -1 for a missing rating."""
+        ratings = pd.to_numeric(pd.Series(ratings, dtype=object), errors="coerce").to_numpy(np.float64)
+        return np.where(np.isfinite(ratings), np.floor(np.clip(np.nan_to_num(ratings), 0, 5) * 2), -1).astype(np.int64)
+
+    @staticmethod
+    def _review_buckets(reviews):
+        """Order of magnitude of the review count, -1 if missing."""
+        reviews = _review_counts(reviews)
+        buckets = np.floor(np.log10(np.maximum(np.nan_to_num(reviews), 0) + 1))
+        return np.where(np.isfinite(reviews), np.minimum(buckets, REVIEW_BUCKETS - 1), -1).astype(np.int64)
+
+    def add_book(self, book_id, author, rating, genres, reviews_count=None):
+        """
+        Features of a book appended to the catalog, folded into the matrix on the next query.
+        A book that already has features keeps them (its first catalog row wins, as in the Vocabulary).
+        """
+        if book_id < self.features.shape[0] and self.features.indptr[book_id + 1] > self.features.indptr[book_id]:
+            return
+        if any(pending_id == book_id for pending_id, _, _ in self._pending):
+            return
+        genres = [genre for genre in dict.fromkeys(genres) if isinstance(genre, str)]
+        people = author_names(author)
+        columns = [self.feature_names.intern("genre:" + genre) for genre in genres]
+        values = [GENRE_WEIGHT / np.sqrt(max(len(genres), 1))] * len(genres)
+        columns += [self.feature_names.intern("author:" + name) for name in people]
+        values += [AUTHOR_WEIGHT / np.sqrt(max(len(people), 1))] * len(people)
+        for prefix, buckets, weight in (("rating", self._rating_buckets([rating]), RATING_WEIGHT),
+                                        ("reviews", self._review_buckets([reviews_count]), REVIEWS_WEIGHT)):
+            if buckets[0] >= 0:
+                columns.append(self.feature_names.intern(f"{prefix}:{buckets[0]}"))
+                values.append(weight)
+        self._pending.append((book_id, columns, values))
+        self._genre_columns = None
+
+    def _fold_pending(self):
+        if not self._pending:
+            return
+        shape = (max(len(self.vocabulary.books), self.features.shape[0]), len(self.feature_names))
+        rows = np.concatenate([np.full(len(columns), book_id) for book_id, columns, _ in self._pending])
+        cols = np.concatenate([np.asarray(columns, dtype=np.int64) for _, columns, _ in self._pending])
+        vals = np.concatenate([np.asarray(values, dtype=np.float64) for _, _, values in self._pending])
+        added = _unit_rows(sparse.csr_matrix((vals, (rows, cols)), shape=shape))
+        features = self.features.copy()
+        features.resize(shape)
+        self.features = (features + added).tocsr()
+        self._pending = []
+
+    def frozen(self):
+        """
+        A copy of the model as it is now (pending books folded in) that later add_book calls don't
+        touch, so it can score outside a lock: folding replaces the feature matrix, never modifies it.
+        """
+        self._fold_pending()
+        frozen = copy.copy(self)
+        frozen._pending = []
+        frozen._genre_columns = self._genre_column_list()
+        return frozen
+
+    def _genre_column_list(self):
+        if self._genre_columns is None:
+            self._genre_columns = [(i, name[len("genre:"):]) for i, name in enumerate(self.feature_names.names)
+                                   if name.startswith("genre:")]
+        return self._genre_columns
+
+    def profile(self, preferences, titles=(), ratings=()):
+        """
+        A user's profile as a 1 x features CSR row: their preferred genres (matched as substrings, as
+        GenreIndex.matching_genres does) plus the feature rows of the rated books, weighted by rating.
+        Each half is scaled to unit length first so neither drowns the other.
+        """
+        self._fold_pending()
+        columns = [i for i, genre in self._genre_column_list() if any(pref in genre for pref in preferences)]
+        liked = sparse.csr_matrix((np.ones(len(columns)), (np.zeros(len(columns), dtype=np.int64), columns)),
+                                  shape=(1, self.features.shape[1]))
+        profile = PREFERENCE_WEIGHT * _unit_rows(liked)
+
+        book_ids = self.vocabulary.books.lookup(list(titles))
+        known = (book_ids >= 0) & (book_ids < self.features.shape[0])
+        if known.any():
+            weights = np.asarray(ratings, dtype=np.float64)[known] - NEUTRAL_RATING
+            rated = sparse.csr_matrix(weights[None, :]) @ self.features[book_ids[known]]
+            profile = profile + HISTORY_WEIGHT * _unit_rows(rated)
+        return profile.tocsr()
+
+    def recommend(self, profile, exclude_titles=(), n=5):
+        """[(book ID, score), ...] best first: one sparse product over the whole catalog plus an argpartition."""
+        self._fold_pending()
+        # CSR x dense vector: one pass over the matrix's non-zeros, no sparse result to assemble
+        scores = self.features @ profile.toarray().ravel()
+        scores[scores <= 0] = -np.inf
+        exclude = self.vocabulary.books.lookup(list(exclude_titles))
+        exclude = exclude[(exclude >= 0) & (exclude < len(scores))]
+        top, top_scores = top_k_neighbors(scores, n, exclude=exclude)
+        return list(zip(top.tolist(), top_scores.tolist()))
+
+
+def _unit_rows(matrix):
+    """matrix with every non-empty row scaled to unit L2 norm."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (sparse.diags(1.0 / norms) @ matrix).tocsr()
+
@@ -0,0 +1,130 @@
+import csv
+import os
+
+
+def normalize(text):
+    """Lowercase + strip, the comparison book_exists_in_db has always used."""
+    return text.strip().lower() if isinstance(text, str) else None
+
+
+def _file_stamp(file_path):
+    """(size, mtime_ns) of a file, or None if it doesn't exist."""
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _max_int(current, value):
+    try:
+        return max(current, int(value))
+    except (TypeError, ValueError):
+        return current
+
+
+class BookIndex:
+    """
+    In-memory index over Amazon_books_cleaned.csv: normalized (title, author) -> book id, plus the max id.
+    The file is read once; books added through add_book_to_db are recorded with add().
+    """
+
+    def __init__(self, books_file):
+        self.books_file = books_file
+        self.keys = {}
+        self.max_id = 0
+        self.stamp = _file_stamp(books_file)
+        if self.stamp is None:
+            return
+        with open(books_file, mode='r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                self._index(row.get("id"), row.get("title"), row.get("author"))
+
+    def _index(self, book_id, title, author):
+        title, author = normalize(title), normalize(author)
+        # pandas read empty authors as NaN, which never matched anything
+        if title is not None and author:
+            self.keys[(title, author)] = book_id
+        self.max_id = _max_int(self.max_id, book_id)
+
+    def contains(self, title, author):
+        return (normalize(title), normalize(author)) in self.keys
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def add(self, book_id, title, author):
+        """Record a book that was just appended to the file."""
+        self._index(book_id, title, author)
+        self.stamp = _file_stamp(self.books_file)
+
+
+class UserIndex:
+    """
+    In-memory index over users.csv: ID -> row, plus the max 'ID' and '0' values.
+    The file is read once; rows written by create_user / overwrite_user_row are recorded with add().
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.rows = {}
+        self.fieldnames = None
+        self.max_id = 0
+        self.max_zero = 0
+        self.stamp = _file_stamp(file_path)
+        if self.stamp is None:
+            return
+        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            self.fieldnames = reader.fieldnames
+            for row in reader:
+                self._index(row)
+
+    def _index(self, row):
+        user_id = str(row.get("ID"))
+        # The first match wins, as the old linear scans did
+        self.rows.setdefault(user_id, row)
+        self.max_id = _max_int(self.max_id, row.get("ID"))
+        self.max_zero = _max_int(self.max_zero, row.get("0"))
+
+    def get(self, user_id):
+        return self.rows.get(str(user_id))
+
+    def exists(self, user_id, user_name):
+        row = self.get(user_id)
+        return row is not None and row["name"].strip().lower() == user_name.strip().lower()
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def next_zero(self):
+        return self.max_zero + 1
+
+    def add(self, row):
+        """Record a row that was just appended to the file."""
+        self._index({key: str(value) for key, value in row.items()})
+        self.stamp = _file_stamp(self.file_path)
+
+    def replace(self, row):
+        """Record a row that was just rewritten in place."""
+        self.rows[str(row["ID"])] = row
+        self.stamp = _file_stamp(self.file_path)
+
+
+_indexes = {}
+
+def _get_index(cls, file_path):
+    """
+    Return the cached index for file_path, (re)loading it if this session hasn't loaded it yet
+    or the file was changed by someone else since.
+    """
+    key = (cls, os.path.abspath(file_path))
+    index = _indexes.get(key)
+    if index is None or index.stamp != _file_stamp(file_path):
+        index = _indexes[key] = cls(file_path)
+    return index
+
+def book_index(books_file="Amazon_books_cleaned.csv"):
+    return _get_index(BookIndex, books_file)
+
+def user_index(file_path="users.csv"):
+    return _get_index(UserIndex, file_path)
@@ -0,0 +1,241 @@
+"""
+Offline evaluation: accuracy and speed of every recommendation source in one run.
+
+    python evaluate.py [--engines users rating ...] [--holdout 2] [--users 500] [--workers 4] [--output FILE]
+
+Leave-N-out: for each evaluated user, N of their rated catalog books (chosen at random, seeded) are
+hidden, every engine is built from the remaining ratings only, and a hidden book among an engine's
+top k counts as a hit. Each engine reports precision@k, recall@k and NDCG@k, the share of users it
+answered at all, per-request latency (p50 / p95) and throughput.
+
+Engines are built once in the main process and warmed with one request; users are then split over a
+pool of forked workers that share all of it read-only (copy-on-write), one engine at a time so each
+engine's throughput is its own. New engines are one entry in ENGINES.
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+import storage
+from interning import Vocabulary
+from rating_log import LOG_FILE
+from recommendations_engine import clean_book_df
+
+HOLDOUT = 2  # ratings hidden per evaluated user
+N_USERS = 500  # users evaluated (sampled among those with more than HOLDOUT catalog ratings)
+K = 5  # every engine returns its top 5
+CHUNK = 16  # users per task sent to a worker
+
+
+###############################################################################
+# SPLIT AND METRICS
+###############################################################################
+
+def leave_n_out(user_df, vocabulary, holdout=HOLDOUT, n_users=N_USERS, seed=0):
+    """
+    (train_df, hidden): user_df with holdout random catalog books removed from the history of up to
+    n_users users, and {user_id: [hidden book IDs]}. Only users left with at least one rating are picked.
+    A hidden book must be a catalog book, since no engine can recommend anything else.
+    """
+    rng = np.random.default_rng(seed)
+    histories = [history if isinstance(history, list) else [] for history in user_df["book_history"]]
+    # Every history's titles are matched to the catalog in one pass
+    lengths = np.array([len(history) for history in histories], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)])
+    book_ids = vocabulary.catalog_ids([entry.get("book") if isinstance(entry, dict) else None
+                                       for history in histories for entry in history])
+    in_catalog = np.add.reduceat(np.append(book_ids >= 0, False), starts[:-1]) * (lengths > 0)
+    eligible = np.flatnonzero((in_catalog >= holdout) & (lengths > holdout))
+    rows = np.sort(rng.choice(eligible, size=min(n_users, len(eligible)), replace=False))
+
+    histories = list(histories)
+    user_ids = user_df["ID"].to_numpy()
+    hidden = {}
+    for row in rows.tolist():
+        ids = book_ids[starts[row]:starts[row + 1]]
+        positions = set(rng.choice(np.flatnonzero(ids >= 0), size=holdout, replace=False).tolist())
+        hidden[int(user_ids[row])] = ids[sorted(positions)].tolist()
+        histories[row] = [entry for i, entry in enumerate(histories[row]) if i not in positions]
+    train_df = user_df.copy()
+    train_df["book_history"] = histories
+    return train_df, hidden
+
+
+def ranking_metrics(recommended, relevant, k=K):
+    """(precision@k, recall@k, NDCG@k) of a ranked list of book IDs against the relevant ones."""
+    relevant = set(relevant)
+    gains = np.array([book in relevant for book in recommended[:k]], dtype=np.float64)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(k, len(relevant))].sum()
+    hits = gains.sum()
+    return hits / k, hits / len(relevant) if relevant else 0.0, \
+        float(gains @ discounts[:len(gains)] / ideal) if ideal else 0.0
+
+
+###############################################################################
+# ENGINES: name -> builder(data) returning recommend(user_id) -> (titles, authors)
+###############################################################################
+
+def _ratings_store(data):
+    if "store" not in data:
+        from ratings_store import RatingsStore
+        ratings = pd.DataFrame([(user_id, entry["book"], entry["rating"])
+                                for user_id, history in zip(data["train_df"]["ID"].tolist(), data["train_df"]["book_history"])
+                                for entry in history if isinstance(entry, dict) and "book" in entry and "rating" in entry],
+                               columns=["user_id", "book", "rating"])
+        ratings["book"] = data["vocabulary"].canonical_titles(ratings["book"])
+        data["store"] = RatingsStore.from_ratings_df(ratings)
+        data["store"].compute_neighbors()
+    return data["store"]
+
+
+def build_users(data):
+    from recommendations_engine import recommend_books_by_users
+    store = _ratings_store(data)
+    return lambda user_id: recommend_books_by_users(data["book_df"], None, user_id, store=store,
+                                                    vocabulary=data["vocabulary"])
+
+
+def build_rating(data):
+    from genre_index import GenreIndex
+    from recommendations_engine import recommend_by_total_rating
+    index = GenreIndex(data["book_df"])
+    return lambda user_id: recommend_by_total_rating(data["book_df"], data["train_df"], user_id, index=index)
+
+
+def build_popularity(data):
+    from popularity import PopularityAggregates
+    from recommendations_engine import recommend_by_popularity
+    aggregates = PopularityAggregates.from_store(_ratings_store(data), data["vocabulary"])
+    return lambda user_id: recommend_by_popularity(data["train_df"], user_id, aggregates)
+
+
+def build_content(data):
+    from content_based import ContentModel
+    from recommendations_engine import recommend_by_content
+    model = ContentModel.build(data["book_df"], data["vocabulary"])
+    return lambda user_id: recommend_by_content(data["train_df"], user_id, model)
+
+
+def build_items(data):
+    from item_based import ItemNeighborTable
+    from recommendations_engine import recommend_books_by_items
+    store = _ratings_store(data)
+    matrix, _, books = store.matrix()
+    table = ItemNeighborTable.build(matrix, books)
+    return lambda user_id: recommend_books_by_items(data["book_df"], None, user_id, table=table, store=store,
+                                                    vocabulary=data["vocabulary"])
+
+
+def build_als(data):
+    from als import ALSModel
+    from recommendations_engine import recommend_books_by_als
+    store = _ratings_store(data)
+    model = ALSModel.train(*store.matrix())
+    return lambda user_id: recommend_books_by_als(data["book_df"], None, user_id, model=model, store=store,
+                                                  vocabulary=data["vocabulary"])
+
+
+ENGINES = {
+    "users": build_users,
+    "rating": build_rating,
+    "popularity": build_popularity,
+    "content": build_content,
+    "items": build_items,
+    "als": build_als,
+}
+
+###############################################################################
+# RUNNING
+###############################################################################
+
+# Set in the main process before the pool forks, so workers read them without copying
+_data = None
+_recommenders = {}
+
+
+def _evaluate_users(args):
+    """Worker task: (latency, precision, recall, ndcg, answered) per user, for one engine."""
+    engine, user_ids, k = args
+    recommend, vocabulary, hidden = _recommenders[engine], _data["vocabulary"], _data["hidden"]
+    results = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        titles, _ = recommend(user_id)
+        latency = time.perf_counter() - start
+        recommended = vocabulary.books.lookup(list(titles)).tolist()
+        results.append((latency,) + ranking_metrics(recommended, hidden[user_id], k) + (bool(len(titles)),))
+    return results
+
+
+def _summary(results, wall_time):
+    latency, precision, recall, ndcg, answered = (np.array(column, dtype=np.float64) for column in zip(*results))
+    return {"users": len(results), "precision": float(precision.mean()), "recall": float(recall.mean()),
+            "ndcg": float(ndcg.mean()), "answered": float(answered.mean()),
+            "latency_p50_ms": float(np.percentile(latency, 50) * 1000),
+            "latency_p95_ms": float(np.percentile(latency, 95) * 1000),
+            "throughput_per_s": len(results) / wall_time if wall_time > 0 else float("inf")}
+
+
+def evaluate(engines=tuple(ENGINES), holdout=HOLDOUT, n_users=N_USERS, k=K, workers=1, seed=0,
+             log_file=LOG_FILE):
+    """{engine: {"precision", "recall", "ndcg", "answered", "latency_p50_ms", "latency_p95_ms", ...}} for one split."""
+    global _data
+    book_df = clean_book_df(storage.load_books(clean=False))
+    vocabulary = Vocabulary(book_df)
+    train_df, hidden = leave_n_out(storage.load_users(log_file=log_file), vocabulary, holdout, n_users, seed)
+    if not hidden:
+        return {}
+    _data = {"book_df": book_df, "vocabulary": vocabulary, "train_df": train_df, "hidden": hidden}
+    user_ids = sorted(hidden)
+
+    for engine in engines:
+        _recommenders[engine] = ENGINES[engine](_data)
+        _recommenders[engine](user_ids[0])  # load whatever is built on first use before workers fork
+
+    tasks = [user_ids[i:i + CHUNK] for i in range(0, len(user_ids), CHUNK)]
+    # Workers inherit the built engines by forking; without fork (Windows) everything runs here
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            return _run_engines(engines, tasks, k, pool.map)
+    return _run_engines(engines, tasks, k, map)
+
+
+def _run_engines(engines, tasks, k, map_function):
+    summaries = {}
+    for engine in engines:
+        start = time.perf_counter()
+        chunks = map_function(_evaluate_users, [(engine, chunk, k) for chunk in tasks])
+        results = [result for chunk in chunks for result in chunk]
+        summaries[engine] = _summary(results, time.perf_counter() - start)
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leave-N-out accuracy and latency of the recommendation engines.")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--holdout", type=int, default=HOLDOUT, help="ratings hidden per user")
+    parser.add_argument("--users", type=int, default=N_USERS, help="users evaluated")
+    parser.add_argument("--k", type=int, default=K, help="cutoff for the metrics (engines return 5)")
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread users over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    summaries = evaluate(args.engines, args.holdout, args.users, args.k, args.workers, args.seed)
+    if not summaries:
+        print(f"No user has more than {args.holdout} rated catalog books to hold out.")
+    else:
+        print(f"{next(iter(summaries.values()))['users']} users, {args.holdout} held out each, k={args.k}, "
+              f"{args.workers} worker(s)")
+        print(f"  {'engine':<12}{'P@k':>8}{'R@k':>8}{'NDCG@k':>8}{'answered':>10}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>10}")
+        for engine, s in summaries.items():
+            print(f"  {engine:<12}{s['precision']:8.4f}{s['recall']:8.4f}{s['ndcg']:8.4f}{s['answered']:10.1%}"
+                  f"{s['latency_p50_ms']:10.2f}{s['latency_p95_ms']:10.2f}{s['throughput_per_s']:10.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"holdout": args.holdout, "k": args.k, "seed": args.seed, "engines": summaries}, f, indent=2)
@@ -0,0 +1,81 @@
+import bisect
+import heapq
+import math
+
+from interning import Interner, title_key
+
+
+def _sort_key(rating, position):
+    """Highest rating first, missing ratings last, ties in catalog order."""
+    try:
+        rating = float(rating)
+    except (TypeError, ValueError):
+        rating = math.nan
+    if math.isnan(rating):
+        return (1, 0.0, position)
+    return (0, -rating, position)
+
+
+class GenreIndex:
+    """
+    Inverted index genre -> posting list of books, each list kept sorted by rating (best first).
+    A preference query merges the few matching lists lazily and stops after the top-N unread titles,
+    instead of exploding and sorting the whole catalog. Books are interned (interning.title_key), so
+    exclusion and de-duplication compare integer IDs and catch spelling variants of a title.
+    """
+
+    def __init__(self, book_df=None):
+        self.books = Interner(title_key)
+        self.postings = {}
+        self._next_position = 0
+        if book_df is not None:
+            self.add_books(book_df)
+
+    def add_books(self, book_df):
+        """Index every row of a cleaned book DataFrame (genre column holding lists, as clean_book_df returns)."""
+        for title, author, rating, genres in zip(book_df["title"], book_df["author"], book_df["rating"], book_df["genre"]):
+            self._insert(title, author, rating, genres, keep_sorted=False)
+        for posting in self.postings.values():
+            posting.sort()
+
+    def add_book(self, title, author, rating, genres):
+        """Index one new book, e.g. right after add_book_to_db appended it to the catalog."""
+        self._insert(title, author, rating, genres, keep_sorted=True)
+
+    def _insert(self, title, author, rating, genres, keep_sorted):
+        if not isinstance(genres, list):
+            genres = [genres]
+        entry_key = _sort_key(rating, self._next_position)
+        self._next_position += 1
+        entry = (entry_key, self.books.intern(title), title, author)
+        for genre in dict.fromkeys(genres):
+            posting = self.postings.setdefault(genre, [])
+            if keep_sorted:
+                bisect.insort(posting, entry)
+            else:
+                posting.append(entry)
+
+    def matching_genres(self, preferences):
+        """Genres that contain any of the preferences as a substring (same test recommend_by_total_rating used)."""
+        return [genre for genre in self.postings
+                if isinstance(genre, str) and any(pref in genre for pref in preferences)]
+
+    def top_books(self, preferences, exclude_titles=(), n=5):
+        """
+        Return (titles, authors) of the n best rated books in the preferred genres,
+        skipping exclude_titles and duplicates. Only as much of each posting list is read as needed.
+        """
+        seen = {self.books.get(title) for title in exclude_titles} - {-1}  # -1: not a title
+        postings = [self.postings[genre] for genre in self.matching_genres(preferences)]
+
+        books, authors = [], []
+        for _, book_id, title, author in heapq.merge(*postings):
+            if book_id in seen:
+                continue
+            if book_id >= 0:
+                seen.add(book_id)
+            books.append(title)
+            authors.append(author)
+            if len(books) == n:
+                break
+        return books, authors
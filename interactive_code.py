@@ -2,146 +2,143 @@ import csv
 import os
 import random
 
-# Import the function from recommendations_engine.py
-from recommendations_engine import recommend_by_total_rating
+# The recommendation engine (pandas, scipy, the datasets) is only imported and loaded on first use,
+# so the menu comes up immediately; see get_recommender()
+from db_index import book_index, user_index
+from rating_log import LogTail, append_rating, locked, maybe_compact
+from tracing import profiled, traced, tracer
+
+# Ratings logged since the last compaction, merged into rows returned by get_user_row
+_log_tail = LogTail("users.csv")
+
+###############################################################################
+# RECOMMENDER: loaded lazily (or warmed in the background after login)
+###############################################################################
+
+_recommender = None
+
+def get_recommender():
+    """
+    Return the session's Recommender. Its data, ratings store and genre index load on first use.
+    """
+    global _recommender
+    if _recommender is None:
+        from recommendations_engine import get_recommender as engine_recommender
+        _recommender = engine_recommender()
+    return _recommender
+
+def record_rating(user_id, book_title, rating_val, author=None, genre=None):
+    """
+    Apply a new rating to the recommender as a delta. Nothing is loaded just for this: parts
+    that were never loaded will be read from the updated files on next use.
+    """
+    if _recommender is not None:
+        _recommender.add_rating(user_id, book_title, rating_val, author, genre)
+
+###############################################################################
+# SERVER MODE: with --server URL the actions below go to a running server.py
+###############################################################################
+
+_client = None
+_profile_mode = None  # "cpu" / "memory": profile every recommendation request (--profile)
+
+def use_server(url):
+    """
+    Run as a thin client: recommendations, ratings, surprises and new accounts are handled by the
+    server at url, which keeps everything loaded. Nothing is read locally.
+    """
+    global _client
+    from client import BiblioClient
+    _client = BiblioClient(url)
 
 ###############################################################################
 # HELPER FUNCTIONS: users.csv
 ###############################################################################
 
+@traced("io.get_next_zero")
 def get_next_zero(file_path="users.csv"):
     """
-    Auto-increment the '0' column by scanning existing rows for the max value in '0'.
+    Auto-increment the '0' column: max value in '0' + 1, taken from the session's user index.
     """
-    if not os.path.isfile(file_path):
-        return 1
-    max_val = 0
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                zero_int = int(row["0"])
-                if zero_int > max_val:
-                    max_val = zero_int
-            except (ValueError, KeyError):
-                continue
-    return max_val + 1
+    return user_index(file_path).next_zero()
 
+@traced("io.get_next_id")
 def get_next_id(file_path="users.csv"):
     """
-    Determine the next user's ID by scanning existing rows in users.csv.
+    Determine the next user's ID from the session's user index.
     """
-    if not os.path.isfile(file_path):
-        return 1
-    max_id = 0
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                current_id = int(row["ID"])
-                if current_id > max_id:
-                    max_id = current_id
-            except (ValueError, KeyError):
-                continue
-    return max_id + 1
+    return user_index(file_path).next_id()
 
+@traced("io.user_exists")
 def user_exists(user_id, user_name, file_path="users.csv"):
     """
     Return True if there's a row in 'users.csv' with ID == user_id and name == user_name (case-insensitive).
     """
-    if not os.path.isfile(file_path):
-        return False
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["ID"] == str(user_id) and row["name"].strip().lower() == user_name.strip().lower():
-                return True
-    return False
+    if _client is not None:
+        return _client.user_exists(user_id, user_name)
+    return user_index(file_path).exists(user_id, user_name)
 
+@traced("io.get_user_row")
 def get_user_row(user_id, file_path="users.csv"):
     """
     Return the entire row (dict) for the user with ID == user_id, or None if not found.
+    The row's book_history includes ratings still waiting in the rating log.
     """
-    if not os.path.isfile(file_path):
-        return None
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["ID"] == str(user_id):
-                return row
-    return None
+    row = user_index(file_path).get(user_id)
+    if file_path == _log_tail.users_file:
+        row = _log_tail.merged_row(row)
+    return row
 
+@traced("io.overwrite_user_row")
 def overwrite_user_row(updated_row, file_path="users.csv"):
     """
     Rewrite the CSV, replacing the row that has the same 'ID' as updated_row['ID'].
+    New ratings go through the rating log instead; this is only for edits of other columns.
     """
     if not os.path.isfile(file_path):
         return
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        fieldnames = reader.fieldnames
-        all_rows = list(reader)
-
-    # find & replace
-    for i, row in enumerate(all_rows):
-        if row["ID"] == updated_row["ID"]:
-            all_rows[i] = updated_row
-            break
+    with locked():
+        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            fieldnames = reader.fieldnames
+            all_rows = list(reader)
+
+        # find & replace
+        for i, row in enumerate(all_rows):
+            if row["ID"] == updated_row["ID"]:
+                all_rows[i] = updated_row
+                break
 
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(all_rows)
+        with open(file_path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(all_rows)
+    user_index(file_path).replace(updated_row)
 
 ###############################################################################
 # HELPER FUNCTIONS: Amazon_books_cleaned.csv
 ###############################################################################
 
+@traced("io.book_exists_in_db")
 def book_exists_in_db(title, author, books_file="Amazon_books_cleaned.csv"):
     """
     Check if a book with the same title & author (case-insensitive) exists in books_file.
     """
-    if not os.path.isfile(books_file):
-        return False
-    import pandas as pd
-    df = pd.read_csv(books_file)
-    # If there's no 'title' or 'author' column, this will KeyError
-    # We assume 'title' and 'author' exist
-    df["title_lower"] = df["title"].str.lower().str.strip()
-    df["author_lower"] = df["author"].str.lower().str.strip()
-
-    match = df[
-        (df["title_lower"] == title.strip().lower()) &
-        (df["author_lower"] == author.strip().lower())
-    ]
-    return not match.empty
+    return book_index(books_file).contains(title, author)
 
+@traced("io.get_next_book_id")
 def get_next_book_id(books_file="Amazon_books_cleaned.csv"):
     """
-    Return the next integer 'id' for a new book, scanning existing rows in 'Amazon_books_cleaned.csv'.
-    """
-    if not os.path.isfile(books_file):
-        return 1
-    import pandas as pd
-    df = pd.read_csv(books_file)
-    if "id" not in df.columns:
-        return 1
-    max_id = 0
-    for val in df["id"]:
-        try:
-            val_int = int(val)
-            if val_int > max_id:
-                max_id = val_int
-        except:
-            continue
-    return max_id + 1
+    Return the next integer 'id' for a new book (max existing 'id' + 1), from the session's book index.
+    """
+    return book_index(books_file).next_id()
 
+@traced("io.add_book_to_db")
 def add_book_to_db(title, author, user_rating, user_genre, books_file="Amazon_books_cleaned.csv"):
     """
     Append a new book to 'Amazon_books_cleaned.csv' with an auto-incremented 'id'.
     Initialize 'reviews_count' to 1 and store 'rating' = user_rating, 'genre' as a list string.
     """
-    import pandas as pd
     new_id = get_next_book_id(books_file)
     reviews_count_val = 1
     genre_list_str = str([user_genre])  # e.g. "['Fantasy','Adventure']"
@@ -160,61 +157,79 @@ def add_book_to_db(title, author, user_rating, user_genre, books_file="Amazon_bo
             "reviews_count": reviews_count_val,
             "genre": genre_list_str
         })
+    book_index(books_file).add(new_id, title, author)
+    if _recommender is not None:
+        _recommender.add_book(title, author, user_rating, [user_genre],
+                              catalog_id=new_id, reviews_count=reviews_count_val)
     return new_id
 
 ###############################################################################
 # MENU ACTIONS: (1) Recommend, (2) Rate, (3) Surprise, (4) Log out
 ###############################################################################
 
+def get_recommendations(user_id):
+    """
+    {"users": ..., "rating": ..., "als": ..., "content": ...}, each a (titles, authors) pair, for an integer user_id:
+    from the server in client mode, else from the local recommender's cache.
+    Raises KeyError for users the engine doesn't know.
+    """
+    if _client is not None:
+        return _client.recommendations(user_id)
+    if _profile_mode is not None:
+        # Computed afresh (not from the cache) so there is something to profile
+        with profiled(_profile_mode) as profile:
+            result = get_recommender().compute_recommendations(user_id)
+        print(profile.report)
+        return result
+    return get_recommender().recommendations(user_id)
+
 def recommend_books_for_user(user_id):
     """
     Call the 'recommend_by_total_rating' function from recommendations_engine.py.
     NOTE: This code uses 'target_user_ID' as a row index in user_df, so if user_id doesn't
     match the row index, you can get KeyError. This is a known limitation.
     """
-    import pandas as pd
-    import ast
-    from recommendations_engine import recommend_by_total_rating
-    from recommendations_engine import recommend_books_by_users
-
-    # Read up-to-date user and book data
-    if not os.path.isfile("users.csv"):
+    # The recommender reads both files (through the columnar store) on first use
+    if _client is None and not os.path.isfile("users.csv"):
         print("No users.csv found, cannot recommend.")
         return
-    user_df = pd.read_csv("users.csv")
 
-    if not os.path.isfile("Amazon_books_cleaned.csv"):
+    if _client is None and not os.path.isfile("Amazon_books_cleaned.csv"):
         print("No Amazon_books_cleaned.csv found, cannot recommend.")
         return
-    book_data = pd.read_csv("Amazon_books_cleaned.csv")
 
     # The existing function expects 'target_user_ID' to be the row index in user_df
     # So let's parse user_id as int, but that won't help if user_id=500 but the row is actually at index=0
     user_id_int = int(user_id)
 
+    # Served from the recommender's cache unless this user's history or the catalog changed since
     try:
-        titles, authors = recommend_books_by_users(book_data, user_df, user_id_int)
+        recommendations = get_recommendations(user_id_int)
     except KeyError as e:
         print(f"KeyError: {e}. Possibly your user ID is larger than user_df has rows.")
         print("In your engine code, you used .iloc[target_user_ID], so user_id must match row index!")
         return
 
-    if not titles:
+    titles, authors = recommendations["users"]
+    content_titles, content_authors = recommendations["content"]
+    if not titles and not content_titles:
         print("No recommendations found (maybe user has read everything or no matching genres).")
         return
 
-    print("\nOther users similar to you liked these titles:\n")
-    for t, a in zip(titles, authors):
-        print(f" - {t} by {a}")
-    print()
+    if titles:
+        print("\nOther users similar to you liked these titles:\n")
+        for t, a in zip(titles, authors):
+            print(f" - {t} by {a}")
+        print()
 
-    try:
-        titles, authors = recommend_by_total_rating(book_data, user_df, user_id_int)
-    except KeyError as e:
-        print(f"KeyError: {e}. Possibly your user ID is larger than user_df has rows.")
-        print("In your engine code, you used .iloc[target_user_ID], so user_id must match row index!")
-        return
+    # Content matches need no similar readers, so new users with short histories get these too
+    if content_titles:
+        print("\nBooks like the ones you rated, in the genres you enjoy:\n")
+        for t, a in zip(content_titles, content_authors):
+            print(f" - {t} by {a}")
+        print()
 
+    titles, authors = recommendations["rating"]
     if not titles:
         print("No recommendations found (maybe user has read everything or no matching genres).")
         return
@@ -224,14 +239,44 @@ def recommend_books_for_user(user_id):
         print(f" - {t} by {a}")
     print()
 
+    titles, authors = recommendations["als"]
+    if titles:
+        print("\nReaders with tastes like yours (matrix factorization) would rate these highly:\n")
+        for t, a in zip(titles, authors):
+            print(f" - {t} by {a}")
+        print()
+
+def save_rating(user_id, book_title, author, book_genre, rating_val):
+    """
+    Record a rating: add the book to the catalog if it is new, append the rating to the log
+    and apply it to the recommender. Returns the new book's ID, or None if the book was known.
+    Raises KeyError if the user doesn't exist.
+    """
+    if _client is not None:
+        return _client.rate(user_id, book_title, author, book_genre, rating_val)
+
+    row = get_user_row(user_id)
+    if not row:
+        from recommendations_engine import UnknownUser
+        raise UnknownUser(user_id)
+
+    new_book_id = None
+    if not book_exists_in_db(book_title, author):
+        new_book_id = add_book_to_db(book_title, author, rating_val, book_genre)
+
+    # Append the rating to the log; compaction folds it into users.csv later
+    append_rating(row["ID"], book_title, author, book_genre, rating_val)
+    record_rating(user_id, book_title, rating_val, author, book_genre)
+    maybe_compact("users.csv")
+    return new_book_id
+
 def rate_a_book(user_id):
     """
     Let the logged-in user add (rate) a single book. 
     If the book doesn't exist in DB, add it. 
     Then update their 'book_history' in users.csv.
     """
-    row = get_user_row(user_id)
-    if not row:
+    if _client is None and not get_user_row(user_id):
         print("User not found in CSV. Can't rate a book.")
         return
 
@@ -250,51 +295,43 @@ def rate_a_book(user_id):
 
     book_genre = input("Enter genre for this book: ").strip()
 
-    # If not in DB, add it
-    if not book_exists_in_db(book_title, author):
-        new_book_id = add_book_to_db(book_title, author, rating_val, book_genre)
+    try:
+        new_book_id = save_rating(user_id, book_title, author, book_genre, rating_val)
+    except KeyError:
+        print("User not found in CSV. Can't rate a book.")
+        return
+
+    if new_book_id is not None:
         print(f"Added new book '{book_title}' by {author} (ID={new_book_id}).")
     else:
         print("Book already exists in DB; we'll just record your rating in your read history.")
-
-    import ast
-    history_str = row["book_history"]
-    try:
-        history_list = ast.literal_eval(history_str) if history_str else []
-    except:
-        history_list = []
-
-    # Append new rating
-    new_rating_dict = {
-        "book": book_title,
-        "author": author,
-        "genre": book_genre,
-        "rating": rating_val
-    }
-    history_list.append(new_rating_dict)
-    row["book_history"] = str(history_list)
-
-    overwrite_user_row(row)
     print(f"'{book_title}' added to your read history with a rating of {rating_val}.")
 
-def surprise_me():
+def pick_surprise_books(n=3, user_id=None, weighting="rating"):
+    """
+    n random catalog books the user hasn't read, as {"title", "author", "id", "rating", "genres", ...}
+    records (see BookMetadata.record), weighted as surprise.WEIGHTINGS describes.
+    """
+    if _client is not None:
+        return _client.surprise(n, user_id, weighting)
+    return get_recommender().surprise(n, int(user_id) if user_id is not None else None, weighting)
+
+def surprise_me(user_id=None):
     """
-    Print 3 random books from 'Amazon_books_cleaned.csv'.
+    Print 3 random books from 'Amazon_books_cleaned.csv', from genres the user hasn't explored yet.
     """
-    if not os.path.isfile("Amazon_books_cleaned.csv"):
+    if _client is None and not os.path.isfile("Amazon_books_cleaned.csv"):
         print("No Amazon_books_cleaned.csv found. Cannot surprise you.")
         return
 
-    import pandas as pd
-    df = pd.read_csv("Amazon_books_cleaned.csv")
-    if df.empty:
+    picks = pick_surprise_books(3, user_id, "unexplored" if user_id is not None else "rating")
+    if not picks:
         print("No books in the DB yet.")
         return
 
-    picks = df.sample(min(3, len(df)))
     print("\nSurprise Books:\n")
-    for _, row in picks.iterrows():
-        print(f" - {row['title']} by {row['author']} (ID={row['id']})")
+    for book in picks:
+        print(f" - {book['title']} by {book['author']} (ID={book['id']})")
     print()
 
 def logged_in_menu(user_id, user_name):
@@ -318,7 +355,7 @@ def logged_in_menu(user_id, user_name):
         elif choice == "2":
             rate_a_book(user_id)
         elif choice == "3":
-            surprise_me()
+            surprise_me(user_id)
         elif choice == "4":
             print("We hope to see you soon!")
             break
@@ -329,6 +366,46 @@ def logged_in_menu(user_id, user_name):
 # CREATE USER OR LOG IN
 ###############################################################################
 
+def register_user(name, age, prefs_list, book_history_list):
+    """
+    Append a new user to users.csv, adding any books from their history that the catalog lacks.
+    Returns (new user ID, [(title, author, book ID), ...] for the books added to the catalog).
+    """
+    if _client is not None:
+        return _client.create_user(name, age, prefs_list, book_history_list)
+
+    new_books_added = []
+    for book in book_history_list:
+        if not book_exists_in_db(book["book"], book["author"]):
+            new_bk_id = add_book_to_db(book["book"], book["author"], book["rating"], book["genre"])
+            new_books_added.append((book["book"], book["author"], new_bk_id))
+
+    zero_val = get_next_zero()
+    new_id = get_next_id()
+    bh_str = str(book_history_list)
+
+    new_row = {
+        "0": zero_val,
+        "name": name,
+        "age": age,
+        "preferences": str(prefs_list),
+        "book_history": bh_str,
+        "ID": new_id
+    }
+    file_exists = os.path.isfile("users.csv")
+    with locked(), open("users.csv", mode='a', newline='', encoding='utf-8') as f:
+        fieldnames = ["0", "name", "age", "preferences", "book_history", "ID"]
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        if not file_exists:
+            writer.writeheader()
+        writer.writerow(new_row)
+    user_index("users.csv").add(new_row)
+    if _recommender is not None:
+        _recommender.add_user(new_id, name, age, prefs_list)
+    for book in book_history_list:
+        record_rating(new_id, book["book"], book["rating"], book["author"], book["genre"])
+    return new_id, new_books_added
+
 def create_user():
     """
     Create a new row in users.csv with columns:
@@ -339,10 +416,8 @@ def create_user():
     age = input("Enter your age: ").strip()
     prefs_inp = input("Enter your preferred genres (comma-separated): ")
     prefs_list = [p.strip() for p in prefs_inp.split(',') if p.strip()]
-    prefs_str = str(prefs_list)
 
     book_history_list = []
-    new_books_added = []
 
     add_books = input("Would you like to add any books you've read? (yes/no): ").strip().lower()
     if add_books in ["yes", "y"]:
@@ -360,10 +435,6 @@ def create_user():
                 r_val = 5.0
             bgenre = input("Enter genre: ").strip()
 
-            if not book_exists_in_db(btitle, bauthor):
-                new_bk_id = add_book_to_db(btitle, bauthor, r_val, bgenre)
-                new_books_added.append((btitle, bauthor, new_bk_id))
-
             book_history_list.append({
                 "book": btitle,
                 "author": bauthor,
@@ -371,24 +442,7 @@ def create_user():
                 "rating": r_val
             })
 
-    zero_val = get_next_zero()
-    new_id = get_next_id()
-    bh_str = str(book_history_list)
-
-    file_exists = os.path.isfile("users.csv")
-    with open("users.csv", mode='a', newline='', encoding='utf-8') as f:
-        fieldnames = ["0", "name", "age", "preferences", "book_history", "ID"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow({
-            "0": zero_val,
-            "name": name,
-            "age": age,
-            "preferences": prefs_str,
-            "book_history": bh_str,
-            "ID": new_id
-        })
+    new_id, new_books_added = register_user(name, age, prefs_list, book_history_list)
 
     print(f"User '{name}' created successfully!")
     print(f"Your user ID is {new_id}. You'll need it (and your name) to log in.")
@@ -403,6 +457,9 @@ def main():
             user_id = input("Enter your ID: ").strip()
             user_name = input("Enter your name: ").strip()
             if user_exists(user_id, user_name):
+                # Load the engine while the user reads the menu (the server already has it loaded)
+                if _client is None:
+                    get_recommender().warm(background=True)
                 print(f"Welcome back, {user_name}! (ID: {user_id})")
                 logged_in_menu(user_id, user_name)
                 break
@@ -415,4 +472,20 @@ def main():
             print("Invalid choice. Please enter 1 or 2.")
 
 if __name__ == "__main__":
+    # python interactive_code.py [--server http://127.0.0.1:8765] [--trace trace.json] [--profile cpu|memory]
+    import argparse
+    parser = argparse.ArgumentParser(description="The BibliOracle command-line interface.")
+    parser.add_argument("--server", help="URL of a running server.py to use instead of the local files")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="time each stage; print a summary on exit and write a Chrome trace to FILE")
+    parser.add_argument("--profile", choices=["cpu", "memory"],
+                        help="run every recommendation request under cProfile or tracemalloc")
+    args = parser.parse_args()
+    if args.server:
+        use_server(args.server)
+    if args.trace:
+        import atexit
+        tracer.enabled = True
+        atexit.register(lambda: (print(tracer.report()), tracer.export_chrome_trace(args.trace)))
+    _profile_mode = args.profile
     main()
@@ -0,0 +1,217 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+_PUNCTUATION = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-"})
+# Trailing qualifiers that name the same book: "The Goldfinch: A Novel", "Dune (Deluxe Edition)"
+_EDITIONS = (r"anniversary|deluxe|special|collector's|library|classic tales|original|uncut|illustrated|revised|"
+             r"updated|expanded|unabridged|booktrack|hardbound|paperback|hardcover|kindle|mass market|chump change")
+_GENERIC_SUFFIX = re.compile(rf"\s*[:(\[-]\s*(?:an? (?:novel|novella|memoir|thriller)|paperback|hardcover|audiobook|"
+                             rf"(?:[\w' ]* )?(?:{_EDITIONS})(?: [\w' ]*)? edition)\s*[)\]]?$")
+_SUFFIX_ENDINGS = ("novel", "novella", "memoir", "thriller", "paperback", "hardcover", "audiobook", "edition")
+
+
+def normalize_text(text):
+    """Unicode-normalized, case-folded, single-spaced form used to compare names."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text).translate(_PUNCTUATION)
+    return " ".join(text.casefold().split())
+
+
+def title_key(title):
+    """normalize_text plus generic subtitles / edition markers and trailing punctuation removed."""
+    key = normalize_text(title)
+    # Cheap test first: most titles don't end in anything the pattern could remove
+    while key.rstrip(")] .,;:!").endswith(_SUFFIX_ENDINGS):
+        stripped = _GENERIC_SUFFIX.sub("", key).rstrip(" .,;:!")
+        if stripped == key or not stripped:
+            break
+        key = stripped
+    return key
+
+
+class Interner:
+    """
+    Dense integer IDs (0, 1, 2, ...) for strings, compared by key(): spellings with the same key
+    share one ID. names[i] is the first spelling seen for ID i. Anything that isn't a string is -1.
+    """
+
+    def __init__(self, key=normalize_text):
+        self.key = key
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            return -1
+        key = self.key(value)
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.names)
+            self.names.append(value)
+        return i
+
+    def get(self, value):
+        """The ID of value, or -1 if it was never interned."""
+        return self.ids.get(self.key(value), -1) if isinstance(value, str) else -1
+
+    def _map_distinct(self, values, function):
+        # Keys are computed once per distinct spelling, however often it repeats
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        ids = np.array([function(value) for value in uniques] + [-1], dtype=np.int32)
+        return ids[codes]
+
+    def intern_many(self, values):
+        """IDs for a sequence of strings, adding the new ones."""
+        return self._map_distinct(values, self.intern)
+
+    def lookup(self, values):
+        """IDs for a sequence of strings, -1 for the unknown ones (nothing is added)."""
+        return self._map_distinct(values, self.get)
+
+
+class Vocabulary:
+    """
+    The catalog's books, authors and genres as dense integer IDs, with array lookup tables from
+    book ID to author ID, rating and genre IDs. A book is a normalized title, so spelling variants
+    ("The Goldfinch" / "The Goldfinch: A Novel") are one book, described by its first catalog row.
+    Titles interned from ratings only have no author (-1) and are not in_catalog.
+    """
+
+    def __init__(self, book_df=None):
+        self.books = Interner(title_key)
+        self.authors = Interner()
+        self.genres = Interner()
+        self.book_author = np.zeros(0, dtype=np.int32)
+        self.book_rating = np.zeros(0, dtype=np.float64)
+        self.in_catalog = np.zeros(0, dtype=bool)
+        self._pair_books = np.zeros(0, dtype=np.int32)
+        self._pair_genres = np.zeros(0, dtype=np.int32)
+        self._genre_csr = None
+        self._late_genres = {}  # book ID -> genre IDs added after the CSR was built
+        if book_df is not None:
+            self.add_books(book_df)
+
+    def _grow(self):
+        missing = len(self.books) - len(self.in_catalog)
+        if missing > 0:
+            self.book_author = np.concatenate([self.book_author, np.full(missing, -1, dtype=np.int32)])
+            self.book_rating = np.concatenate([self.book_rating, np.full(missing, np.nan)])
+            self.in_catalog = np.concatenate([self.in_catalog, np.zeros(missing, dtype=bool)])
+
+    def add_books(self, book_df):
+        """Intern the rows of a catalog DataFrame (title, author, rating, genre list); the first row of a book wins."""
+        ids = self.books.intern_many(book_df["title"])
+        self._grow()
+        rows = np.flatnonzero(ids >= 0)
+        _, first = np.unique(ids[rows], return_index=True)
+        rows = rows[first]
+        rows = rows[~self.in_catalog[ids[rows]]]
+        books = ids[rows]
+
+        self.book_author[books] = self.authors.intern_many(book_df["author"].to_numpy(object)[rows])
+        self.book_rating[books] = pd.to_numeric(pd.Series(book_df["rating"].to_numpy(object)[rows]),
+                                                errors="coerce").to_numpy(np.float64)
+        self.in_catalog[books] = True
+
+        genre_lists = book_df["genre"].to_numpy(object)[rows]
+        pair_books = [book for book, genres in zip(books.tolist(), genre_lists)
+                      for _ in (genres if isinstance(genres, list) else [genres])]
+        pair_genres = [g for genres in genre_lists for g in (genres if isinstance(genres, list) else [genres])]
+        pair_books, pair_genres = np.array(pair_books, dtype=np.int32), self.genres.intern_many(pair_genres)
+        pair_books, pair_genres = pair_books[pair_genres >= 0], pair_genres[pair_genres >= 0]
+        if self._genre_csr is None:
+            self._pair_books = np.concatenate([self._pair_books, pair_books])
+            self._pair_genres = np.concatenate([self._pair_genres, pair_genres])
+        else:
+            # A few books added to a loaded catalog: don't re-sort every pair for them
+            for book, genre in zip(pair_books.tolist(), pair_genres.tolist()):
+                self._late_genres.setdefault(book, []).append(genre)
+        return ids
+
+    def add_book(self, title, author, rating, genres):
+        """Intern one book appended to the catalog; returns its ID."""
+        frame = pd.DataFrame({"title": [title], "author": [author], "rating": [rating], "genre": [list(genres)]})
+        return int(self.add_books(frame)[0])
+
+    def intern_titles(self, titles):
+        """Book IDs of titles, interning the unknown ones (as books outside the catalog)."""
+        ids = self.books.intern_many(titles)
+        self._grow()
+        return ids
+
+    def intern_title(self, title):
+        """intern_titles for one title, without the per-call overhead of factorizing."""
+        book_id = self.books.intern(title)
+        self._grow()
+        return book_id
+
+    def canonical_titles(self, titles):
+        """
+        Each title replaced by the first spelling of its book (the catalog's, if the catalog has it),
+        so ratings of spelling variants land on one matrix column. Unknown titles are interned.
+        """
+        ids = self.intern_titles(titles)
+        names = np.array(self.books.names, dtype=object)
+        return np.where(ids >= 0, names[np.maximum(ids, 0)], np.asarray(titles, dtype=object))
+
+    def title(self, book_id):
+        return self.books.names[book_id]
+
+    def author(self, book_id):
+        author_id = self.book_author[book_id]
+        return self.authors.names[author_id] if author_id >= 0 else None
+
+    def _genre_index(self):
+        """(book -> genres, genre -> books) CSR pairs over the distinct (book, genre) pairs, built on first use."""
+        if self._genre_csr is None:
+            pairs = np.unique(self._pair_books.astype(np.int64) * (len(self.genres) + 1) + self._pair_genres)
+            books, genres = pairs // (len(self.genres) + 1), pairs % (len(self.genres) + 1)
+            by_book = (np.searchsorted(books, np.arange(len(self.books) + 1)), genres.astype(np.int32))
+            order = np.argsort(genres, kind="stable")
+            by_genre = (np.searchsorted(genres[order], np.arange(len(self.genres) + 1)), books[order].astype(np.int32))
+            self._genre_csr = (by_book, by_genre)
+        return self._genre_csr
+
+    def genres_of(self, book_id):
+        """Genre IDs of a book."""
+        (offsets, genre_ids), _ = self._genre_index()
+        genres = genre_ids[offsets[book_id]:offsets[book_id + 1]] if book_id + 1 < len(offsets) else genre_ids[:0]
+        if book_id in self._late_genres:
+            genres = np.concatenate([genres, np.array(self._late_genres[book_id], dtype=genre_ids.dtype)])
+        return genres
+
+    def genre_pairs(self):
+        """Every distinct (book ID, genre ID) pair, as two arrays ordered by book."""
+        (offsets, genre_ids), _ = self._genre_index()
+        books = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+        late = [(book, genre) for book, genres in self._late_genres.items() for genre in genres]
+        if late:
+            late_books, late_genres = (np.array(column, dtype=np.int32) for column in zip(*late))
+            books, genre_ids = np.concatenate([books, late_books]), np.concatenate([genre_ids, late_genres])
+        return books, genre_ids
+
+    def genre_books(self, genre_id):
+        """Book IDs in a genre."""
+        _, (offsets, book_ids) = self._genre_index()
+        books = book_ids[offsets[genre_id]:offsets[genre_id + 1]] if genre_id + 1 < len(offsets) else book_ids[:0]
+        late = [book for book, genres in self._late_genres.items() if genre_id in genres]
+        return np.concatenate([books, np.array(late, dtype=book_ids.dtype)]) if late else books
+
+    def catalog_ids(self, titles):
+        """Book IDs of titles (e.g. a ratings matrix's columns), -1 for titles that aren't catalog books."""
+        ids = self.books.lookup(titles)
+        known = ids >= 0
+        known[known] = self.in_catalog[ids[known]]
+        return np.where(known, ids, -1)
+
+    def describe(self, titles):
+        """(titles, authors) of the given titles that are catalog books, in the catalog's spelling and order given."""
+        ids = self.catalog_ids(titles)
+        ids = ids[ids >= 0].tolist()
+        return [self.title(i) for i in ids], [self.author(i) for i in ids]
@@ -0,0 +1,199 @@
+import atexit
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+import storage
+from rating_log import LOG_FILE
+from ratings_store import file_stamp
+from similarity import block_rows, top_k_neighbors
+
+ITEM_TABLE_DIR = "item_neighbors"
+ITEM_NEIGHBORS_K = 30
+
+
+def item_vectors(matrix):
+    """
+    Book x user matrix for adjusted-cosine similarity: each user's ratings are centred on
+    that user's mean rating, then every book's vector is scaled to unit length.
+    """
+    centred = sparse.csr_matrix(matrix, dtype=np.float64, copy=True)
+    per_user = np.diff(centred.indptr)
+    means = np.asarray(centred.sum(axis=1)).ravel() / np.maximum(per_user, 1)
+    centred.data -= np.repeat(means, per_user)
+
+    items = centred.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ items
+
+
+def _top_k_rows(items, rows, k):
+    """Top-k positively similar books for the given book rows; one sparse product per block."""
+    products = (items[rows] @ items.T).tocsr()
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+    for i, row in enumerate(rows):
+        start, end = products.indptr[i], products.indptr[i + 1]
+        columns, values = products.indices[start:end], products.data[start:end].copy()
+        values[(columns == row) | (values <= 0)] = -np.inf
+        order = np.argsort(columns)
+        top, top_scores = top_k_neighbors(values[order], k)
+        neighbors[i, :len(top)] = columns[order][top]
+        scores[i, :len(top)] = top_scores
+    return neighbors, scores
+
+
+class ItemNeighborTable:
+    """
+    Precomputed top-K most similar books (adjusted cosine) for every book in the ratings matrix,
+    stored as two compact (n_books, K) arrays. Recommending is then a weighted sum over the
+    neighbors of the user's rated books: O(history x K), independent of the number of users.
+    Books touched by new ratings are marked stale and only their rows are recomputed by update().
+    """
+
+    def __init__(self, neighbors, scores, books):
+        self.neighbors = neighbors
+        self.scores = scores
+        self.books = list(books)
+        self.stale_users = set()
+        self.stale_books = set()
+        self.dirty = False
+
+    @classmethod
+    def build(cls, matrix, books, k=ITEM_NEIGHBORS_K, block_size=1024):
+        items = item_vectors(matrix)
+        n_books = items.shape[0]
+        neighbors = np.full((n_books, k), -1, dtype=np.int32)
+        scores = np.zeros((n_books, k), dtype=np.float32)
+        for rows in block_rows(n_books, n_books, block_size):
+            neighbors[rows], scores[rows] = _top_k_rows(items, rows, k)
+        return cls(neighbors, scores, books)
+
+    @classmethod
+    def load(cls, table_dir=ITEM_TABLE_DIR, mmap_mode=None):
+        neighbors = np.load(os.path.join(table_dir, "neighbors.npy"), mmap_mode=mmap_mode)
+        scores = np.load(os.path.join(table_dir, "scores.npy"), mmap_mode=mmap_mode)
+        return cls(neighbors, scores, storage.load_strings(os.path.join(table_dir, "books")))
+
+    def save(self, table_dir=ITEM_TABLE_DIR, source_stamp=None):
+        tmp_dir = table_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "neighbors.npy"), self.neighbors)
+        np.save(os.path.join(tmp_dir, "scores.npy"), self.scores)
+        storage.save_strings(os.path.join(tmp_dir, "books"), self.books)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"source_stamp": source_stamp}, f)
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.replace(tmp_dir, table_dir)
+        self.dirty = False
+
+    def mark_stale(self, user_id, book):
+        """
+        Remember a new rating. It moves the user's mean, so the rated book and every book the user
+        rated before go stale; they are resolved to rows by the next update().
+        """
+        self.stale_users.add(user_id)
+        self.stale_books.add(book)
+
+    def update(self, matrix, user_ids, books):
+        """
+        Recompute the rows of stale books against the current matrix (user_ids / books are its Indexes,
+        as RatingsStore.matrix returns them), grow the table for new books, and offer each recomputed
+        pair to the other book's list so it can enter it too.
+        """
+        self.books = list(books)
+        k = self.neighbors.shape[1]
+        n_books = matrix.shape[1]
+        if n_books > len(self.neighbors):
+            grow = n_books - len(self.neighbors)
+            self.neighbors = np.vstack([self.neighbors, np.full((grow, k), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.zeros((grow, k), dtype=np.float32)])
+        elif not self.neighbors.flags.writeable:
+            self.neighbors, self.scores = np.array(self.neighbors), np.array(self.scores)
+        if not self.stale_books:
+            return
+
+        user_rows = user_ids.get_indexer(list(self.stale_users))
+        rows = [books.get_indexer(list(self.stale_books))]
+        rows += [matrix.indices[matrix.indptr[u]:matrix.indptr[u + 1]] for u in user_rows if u >= 0]
+        rows = np.unique(np.concatenate(rows))
+        rows = rows[rows >= 0]
+        self.stale_users, self.stale_books = set(), set()
+        self.dirty = True
+        neighbors, scores = _top_k_rows(item_vectors(matrix), rows, k)
+        self.neighbors[rows], self.scores[rows] = neighbors, scores
+
+        for row, row_neighbors, row_scores in zip(rows, neighbors, scores):
+            for other, score in zip(row_neighbors, row_scores):
+                if other < 0:
+                    break
+                self._offer(other, row, score)
+
+    def _offer(self, book, candidate, score):
+        """
+        Insert candidate into book's neighbor list if it beats the weakest entry.
+        Pairs that dropped out of a recomputed row are not removed elsewhere until the next full build.
+        """
+        current = self.neighbors[book]
+        if candidate in current:
+            slot = int(np.flatnonzero(current == candidate)[0])
+            self.scores[book, slot] = score
+        elif score > self.scores[book, -1] or current[-1] < 0:
+            self.neighbors[book, -1], self.scores[book, -1] = candidate, score
+        else:
+            return
+        order = np.argsort(-self.scores[book], kind="stable")
+        self.neighbors[book], self.scores[book] = self.neighbors[book][order], self.scores[book][order]
+
+    def score_user(self, rated_columns, ratings, top_n=5):
+        """
+        Score books for a user who rated rated_columns with ratings:
+            score(j) = sum over rated h of similarity(h, j) * rating(h)
+        Returns [(book_column, score), ...], best first, never including rated books.
+        """
+        rated_columns = np.asarray(rated_columns, dtype=np.int64)
+        known = rated_columns < len(self.neighbors)
+        rated_columns, ratings = rated_columns[known], np.asarray(ratings, dtype=np.float64)[known]
+        if len(rated_columns) == 0:
+            return []
+        candidates = np.asarray(self.neighbors[rated_columns])
+        weights = np.asarray(self.scores[rated_columns], dtype=np.float64) * ratings[:, None]
+        valid = candidates >= 0
+
+        # float even when no rated book has a neighbor (bincount of nothing is an integer array)
+        totals = np.bincount(candidates[valid], weights=weights[valid], minlength=len(self.neighbors)).astype(np.float64)
+        totals[totals <= 0] = -np.inf
+        totals[rated_columns] = -np.inf
+        top, top_scores = top_k_neighbors(totals, top_n)
+        return list(zip(top.tolist(), top_scores.tolist()))
+
+
+def open_item_table(store, users_file="users.csv", log_file=LOG_FILE, table_dir=ITEM_TABLE_DIR, mmap_mode=None):
+    """
+    Load the saved item neighbor table if it was built from the current users.csv and rating log,
+    otherwise build it from the ratings store's matrix and save it.
+    Like the ratings store, it is saved again at interpreter exit if update() changed it.
+    """
+    source_files = (users_file, log_file)
+    meta_file = os.path.join(table_dir, "meta.json")
+    table = None
+    if os.path.isfile(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            if json.load(f)["source_stamp"] == file_stamp(*source_files):
+                table = ItemNeighborTable.load(table_dir, mmap_mode)
+    if table is None:
+        matrix, _, books = store.matrix()
+        table = ItemNeighborTable.build(matrix, books)
+        table.save(table_dir, file_stamp(*source_files))
+
+    def save_at_exit():
+        if table.dirty or table.stale_books:
+            table.update(*store.matrix())
+            table.save(table_dir, file_stamp(*source_files))
+    atexit.register(save_at_exit)
+    return table
@@ -0,0 +1,193 @@
+import bisect
+import heapq
+import itertools
+
+import numpy as np
+
+PRIOR_WEIGHT = 10  # ratings' worth of the global mean every book's Bayesian average starts from
+SCORES = ("bayesian", "mean", "count")
+BUCKET_SIZE = 512  # keys per bucket of a RankedBooks; a bucket is split once it holds twice as many
+
+
+class RankedBooks:
+    """
+    Book IDs kept sorted best first as (-score, book_id) keys, so ties go to the lower ID.
+    The keys are split into sorted buckets of up to 2 * BUCKET_SIZE entries, with each bucket's
+    first key kept apart: re-scoring a book bisects those to find its bucket and then only shifts
+    that bucket, O(log n + BUCKET_SIZE) however many books are ranked.
+    """
+
+    def __init__(self, book_ids=(), scores=()):
+        self.keys = {book: (-score, book) for book, score in zip(book_ids, scores)}
+        entries = sorted(self.keys.values())
+        self.buckets = [entries[i:i + BUCKET_SIZE] for i in range(0, len(entries), BUCKET_SIZE)]
+        self.firsts = [bucket[0] for bucket in self.buckets]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.buckets)
+
+    def _bucket(self, key):
+        """Index of the bucket key is or belongs in."""
+        return max(bisect.bisect_right(self.firsts, key) - 1, 0)
+
+    def _remove(self, key):
+        i = self._bucket(key)
+        bucket = self.buckets[i]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if bucket:
+            self.firsts[i] = bucket[0]
+        else:
+            del self.buckets[i], self.firsts[i]
+
+    def _insert(self, key):
+        if not self.buckets:
+            self.buckets.append([key])
+            self.firsts.append(key)
+            return
+        i = self._bucket(key)
+        bucket = self.buckets[i]
+        bisect.insort(bucket, key)
+        self.firsts[i] = bucket[0]
+        if len(bucket) > 2 * BUCKET_SIZE:
+            self.buckets[i:i + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self.firsts[i:i + 1] = [bucket[0], bucket[BUCKET_SIZE]]
+
+    def set(self, book_id, score):
+        old = self.keys.get(book_id)
+        if old is not None:
+            self._remove(old)
+        key = self.keys[book_id] = (-score, book_id)
+        self._insert(key)
+
+    def top(self, n):
+        return [(book, -score) for score, book in itertools.islice(self, n)]
+
+
+class PopularityAggregates:
+    """
+    Rolling per-book rating counts and sums over all users, with rankings built on them:
+    a global one and one per catalog genre, for each score in SCORES. Rankings are only built
+    the first time they are asked for; after that add_rating keeps them up to date, so
+    top-N queries never rescan the ratings.
+
+    "bayesian" is (prior_weight * prior_mean + sum) / (prior_weight + count). A book with a
+    few ratings stays close to the global mean instead of topping the list with one 5.0.
+    prior_mean is the mean of all ratings at construction. It stays fixed afterwards, because
+    moving it would reorder every ranking; a rebuild picks up the new mean.
+    """
+
+    def __init__(self, vocabulary, prior_weight=PRIOR_WEIGHT, prior_mean=None):
+        self.vocabulary = vocabulary
+        self.prior_weight = prior_weight
+        self.prior_mean = prior_mean
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros(0, dtype=np.float64)
+        self._rankings = {}  # (genre ID or None, score) -> RankedBooks
+
+    @classmethod
+    def from_store(cls, store, vocabulary, prior_weight=PRIOR_WEIGHT):
+        """Aggregate a RatingsStore's sum / count matrices column by column."""
+        _, _, books = store.matrix()
+        aggregates = cls(vocabulary, prior_weight)
+        book_ids = vocabulary.intern_titles(books)
+        aggregates._grow()
+        known = book_ids >= 0
+        counts = np.asarray(store.counts.sum(axis=0)).ravel()[known]
+        sums = np.asarray(store.sums.sum(axis=0)).ravel()[known]
+        np.add.at(aggregates.counts, book_ids[known], counts.astype(np.int64))
+        np.add.at(aggregates.sums, book_ids[known], sums)
+        total = aggregates.counts.sum()
+        aggregates.prior_mean = float(aggregates.sums.sum() / total) if total else 0.0
+        return aggregates
+
+    def _grow(self):
+        missing = len(self.vocabulary.books) - len(self.counts)
+        if missing > 0:
+            self.counts = np.concatenate([self.counts, np.zeros(missing, dtype=np.int64)])
+            self.sums = np.concatenate([self.sums, np.zeros(missing)])
+
+    def scores(self, book_ids, score="bayesian"):
+        """Score of each book; books without ratings score the prior mean (bayesian) or 0."""
+        counts, sums = self.counts[book_ids], self.sums[book_ids]
+        if score == "count":
+            return counts.astype(np.float64)
+        if score == "mean":
+            return np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0)
+        if score == "bayesian":
+            return (self.prior_weight * self.prior_mean + sums) / (self.prior_weight + counts)
+        raise ValueError(f"unknown score {score!r} (expected one of {', '.join(SCORES)})")
+
+    def _ranking(self, genre_id, score):
+        """The ranking of rated books in one genre (all books for None), built on first use."""
+        key = (genre_id, score)
+        ranking = self._rankings.get(key)
+        if ranking is None:
+            self.scores([], score)  # reject an unknown score before building anything
+            if genre_id is None:
+                rated = np.flatnonzero(self.counts > 0)
+            else:
+                rated = self.vocabulary.genre_books(genre_id)
+                rated = rated[self.counts[rated] > 0]
+            ranking = self._rankings[key] = RankedBooks(rated.tolist(), self.scores(rated, score).tolist())
+        return ranking
+
+    def add_rating(self, book, rating):
+        """Count one new rating of a title; every ranking built so far is updated in place. Returns the book ID."""
+        book_id = self.vocabulary.intern_title(book)
+        if book_id < 0:
+            return book_id
+        self._grow()
+        self.counts[book_id] += 1
+        self.sums[book_id] += float(rating)
+        genres = set(self.vocabulary.genres_of(book_id).tolist())
+        for (genre_id, score), ranking in self._rankings.items():
+            if genre_id is None or genre_id in genres:
+                ranking.set(book_id, float(self.scores([book_id], score)[0]))
+        return book_id
+
+    def top(self, n=10, score="bayesian", genre=None):
+        """
+        The n best books overall, or in one genre, as dicts with title, author, ratings (count),
+        mean and score.
+        """
+        genre_id = None
+        if genre is not None:
+            genre_id = self.vocabulary.genres.get(genre)
+            if genre_id < 0:
+                return []
+        return [self._describe(book_id, value) for book_id, value in self._ranking(genre_id, score).top(n)]
+
+    def _describe(self, book_id, value):
+        count = int(self.counts[book_id])
+        return {"title": self.vocabulary.title(book_id), "author": self.vocabulary.author(book_id),
+                "ratings": count, "mean": float(self.sums[book_id] / count) if count else None, "score": value}
+
+    def top_books(self, preferences, exclude_titles=(), n=5, score="bayesian"):
+        """
+        (titles, authors) of the n best books in the preferred genres, skipping exclude_titles,
+        like GenreIndex.top_books but ranked by what users rated. Preferences match genres by substring,
+        as in GenreIndex.matching_genres.
+        """
+        genre_ids = [i for i, genre in enumerate(self.vocabulary.genres.names)
+                     if isinstance(genre, str) and any(pref in genre for pref in preferences)]
+        seen = set(self.vocabulary.books.lookup(list(exclude_titles)).tolist()) - {-1}
+        titles, authors = [], []
+        for _, book_id in heapq.merge(*(self._ranking(genre_id, score) for genre_id in genre_ids)):
+            if book_id in seen:
+                continue
+            seen.add(book_id)
+            titles.append(self.vocabulary.title(book_id))
+            authors.append(self.vocabulary.author(book_id))
+            if len(titles) == n:
+                break
+        return titles, authors
+
+    def genre_counts(self):
+        """{genre: number of ratings of books in that genre}, most rated first."""
+        totals = np.array([self.counts[self.vocabulary.genre_books(g)].sum() for g in range(len(self.vocabulary.genres))],
+                          dtype=np.int64)
+        order = np.argsort(-totals, kind="stable")
+        return {self.vocabulary.genres.names[g]: int(totals[g]) for g in order.tolist() if totals[g] > 0}
@@ -0,0 +1,207 @@
+import ast
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, appends are still atomic enough for a single session
+    fcntl = None
+
+LOG_FILE = "ratings_log.jsonl"
+COMPACT_EVERY = 200  # fold the log back into users.csv once it holds this many events
+
+
+@contextlib.contextmanager
+def locked(log_file=LOG_FILE, exclusive=True):
+    """
+    Hold an advisory lock on log_file. Appends and compaction take it exclusively, readers shared.
+    Anything else that rewrites users.csv should hold it too, so compaction can't lose its write.
+    """
+    with open(log_file, mode='a+', encoding='utf-8') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def append_rating(user_id, book, author, genre, rating, log_file=LOG_FILE):
+    """Append one rating event to the log and fsync it before returning."""
+    event = {"user_id": str(user_id), "book": book, "author": author, "genre": genre,
+             "rating": rating, "ts": time.time()}
+    with locked(log_file) as f:
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return event
+
+
+def _parse_lines(lines):
+    """Decode event lines, ignoring a torn last line left by a crash mid-write."""
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events
+
+
+def read_events(log_file=LOG_FILE):
+    """All events currently in the log, oldest first."""
+    if not os.path.isfile(log_file):
+        return []
+    with locked(log_file, exclusive=False) as f:
+        f.seek(0)
+        return _parse_lines(f)
+
+
+def history_entry(event):
+    """The book_history dict that a rating event stands for."""
+    return {"book": event["book"], "author": event["author"], "genre": event["genre"], "rating": event["rating"]}
+
+
+def merge_history(history_str, events):
+    """Return history_str (a book_history list repr) with the given events appended."""
+    try:
+        history_list = ast.literal_eval(history_str) if history_str else []
+    except (ValueError, SyntaxError):
+        history_list = []
+    history_list.extend(history_entry(event) for event in events)
+    return str(history_list)
+
+
+def events_by_user(events):
+    grouped = {}
+    for event in events:
+        grouped.setdefault(event["user_id"], []).append(event)
+    return grouped
+
+
+def _file_stamp(file_path):
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class LogTail:
+    """
+    Incremental reader over the rating log: only bytes appended since the last call are parsed.
+    Compaction always replaces users_file, so a change there means the log was folded and is re-read from the start.
+    """
+
+    def __init__(self, users_file="users.csv", log_file=LOG_FILE):
+        self.users_file = users_file
+        self.log_file = log_file
+        self.base_stamp = None
+        self.offset = 0
+        self.by_user = {}
+
+    def refresh(self):
+        if not os.path.isfile(self.log_file):
+            self.offset, self.by_user = 0, {}
+            return
+        with locked(self.log_file, exclusive=False), open(self.log_file, mode='rb') as f:
+            base_stamp = _file_stamp(self.users_file)
+            if base_stamp != self.base_stamp:
+                self.base_stamp, self.offset, self.by_user = base_stamp, 0, {}
+            f.seek(self.offset)
+            chunk = f.read()
+        # Leave an unfinished last line for the next refresh
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        lines = complete.decode("utf-8").splitlines()
+        for user_id, events in events_by_user(_parse_lines(lines)).items():
+            self.by_user.setdefault(user_id, []).extend(events)
+
+    def events_for(self, user_id):
+        self.refresh()
+        return self.by_user.get(str(user_id), [])
+
+    def merged_row(self, row):
+        """Copy of a users.csv row with this user's logged ratings folded into book_history."""
+        if row is None:
+            return None
+        events = self.events_for(row["ID"])
+        if not events:
+            return row
+        row = dict(row)
+        row["book_history"] = merge_history(row.get("book_history"), events)
+        return row
+
+
+def load_users(users_file="users.csv", log_file=LOG_FILE):
+    """users.csv as a DataFrame, with every logged rating merged into book_history (base table + log tail)."""
+    import pandas as pd
+    user_df = pd.read_csv(users_file)
+    grouped = events_by_user(read_events(log_file))
+    if grouped:
+        ids = user_df["ID"].astype(str)
+        for user_id, events in grouped.items():
+            for i in user_df.index[ids == user_id]:
+                user_df.at[i, "book_history"] = merge_history(user_df.at[i, "book_history"], events)
+    return user_df
+
+
+def compact(users_file="users.csv", log_file=LOG_FILE):
+    """
+    Fold the log into users.csv and empty it. The new users.csv is written to a temp file and
+    swapped in atomically; the log lock is held throughout so no rating can slip in between.
+    Returns the number of events folded.
+    """
+    if not os.path.isfile(log_file) or not os.path.isfile(users_file):
+        return 0
+    with locked(log_file) as log:
+        log.seek(0)
+        grouped = events_by_user(_parse_lines(log))
+        if not grouped:
+            return 0
+
+        with open(users_file, mode='r', newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            fieldnames = reader.fieldnames
+            all_rows = list(reader)
+        folded = 0
+        for row in all_rows:
+            user_events = grouped.pop(row["ID"], None)
+            if user_events:
+                row["book_history"] = merge_history(row["book_history"], user_events)
+                folded += len(user_events)
+
+        tmp_file = users_file + ".tmp"
+        with open(tmp_file, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(all_rows)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, users_file)
+
+        # Events for unknown users are kept rather than dropped
+        log.seek(0)
+        log.truncate()
+        for user_events in grouped.values():
+            for event in user_events:
+                log.write(json.dumps(event, ensure_ascii=False) + "\n")
+        log.flush()
+        os.fsync(log.fileno())
+    return folded
+
+
+def maybe_compact(users_file="users.csv", log_file=LOG_FILE, threshold=COMPACT_EVERY):
+    """Compact once the log has grown past threshold events."""
+    if len(read_events(log_file)) >= threshold:
+        compact(users_file, log_file)
+
+
+if __name__ == "__main__":
+    # python rating_log.py [users.csv] [ratings_log.jsonl]
+    compact(*sys.argv[1:3])
+    print("Rating log compacted.")
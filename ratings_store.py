@@ -0,0 +1,312 @@
+import atexit
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import storage
+from interning import Vocabulary, title_key
+from rating_log import LOG_FILE
+from similarity import all_top_k_neighbors
+
+STORE_DIR = "ratings_store"
+NEIGHBORS_K = 20  # neighbors precomputed per user; requests for up to this many skip the similarity product
+LAYOUT_VERSION = 2  # bumped when the saved column layout changes (2: one column per interned book)
+
+
+def file_stamp(*file_paths):
+    """
+    LAYOUT_VERSION plus (size, mtime_ns) of each file, used to tell whether a saved store
+    (or an item table / ALS model built from it) is still up to date.
+    """
+    stamp = [LAYOUT_VERSION]
+    for file_path in file_paths:
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            stamp += [stat.st_size, stat.st_mtime_ns]
+        else:
+            stamp += [-1, -1]
+    return stamp
+
+
+def _save_csr(store_dir, name, matrix):
+    np.save(os.path.join(store_dir, f"{name}.data.npy"), matrix.data)
+    np.save(os.path.join(store_dir, f"{name}.indices.npy"), matrix.indices)
+    np.save(os.path.join(store_dir, f"{name}.indptr.npy"), matrix.indptr)
+
+
+def _load_csr(store_dir, name, shape, mmap_mode):
+    data, indices, indptr = (np.load(os.path.join(store_dir, f"{name}.{part}.npy"), mmap_mode=mmap_mode)
+                             for part in ("data", "indices", "indptr"))
+    # copy=False keeps memory-mapped arrays shared instead of pulling them into this process
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def _read_meta(store_dir):
+    meta_file = os.path.join(store_dir, "meta.json")
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RatingsStore:
+    """
+    User x book ratings matrix that is built once, saved to disk and reloaded on startup.
+    Per-cell sums and counts are kept so duplicate ratings average the same way as ratings_matrix.
+    New ratings are recorded as O(1) deltas and only folded into the CSR arrays when the matrix is read.
+    The saved arrays (including the mean matrix and top-k neighbor lists) can be opened as read-only
+    memory maps, so any number of worker processes share one copy in the page cache.
+    """
+
+    def __init__(self, sums, counts, user_ids, books, means=None, neighbors=None, neighbor_scores=None):
+        self.sums = sums
+        self.counts = counts
+        self.user_ids = list(user_ids)
+        self.books = list(books)
+        self._user_pos = None
+        self._book_pos = None
+        self._pending = {}
+        self._matrix = means
+        self._index = None
+        self.neighbors = neighbors
+        self.neighbor_scores = neighbor_scores
+        self.neighbors_stale = False  # ratings were added after the neighbor lists were computed
+        self.source_stamp = None  # file_stamp of the files the ratings were read from
+        self.dirty = False
+
+    @classmethod
+    def from_ratings_df(cls, ratings_df):
+        """Build the store from a (user_id, book, rating) DataFrame such as user_book_rating_df returns."""
+        if ratings_df.empty:
+            empty = sparse.csr_matrix((0, 0))
+            return cls(empty, empty, [], [])
+
+        grouped = ratings_df.groupby(["user_id", "book"], as_index=False).agg(
+            rating_sum=("rating", "sum"), rating_count=("rating", "count"))
+        user_codes, user_ids = pd.factorize(grouped["user_id"], sort=True)
+        book_codes, books = pd.factorize(grouped["book"], sort=True)
+        shape = (len(user_ids), len(books))
+
+        sums = sparse.csr_matrix((grouped["rating_sum"].to_numpy(np.float64), (user_codes, book_codes)), shape=shape)
+        counts = sparse.csr_matrix((grouped["rating_count"].to_numpy(np.float64), (user_codes, book_codes)), shape=shape)
+        return cls(sums, counts, user_ids.tolist(), books.tolist())
+
+    @classmethod
+    def from_user_df(cls, user_df):
+        """Build the store by parsing every user's book_history (the slow path, done once)."""
+        from recommendations_engine import user_book_rating_df
+        return cls.from_ratings_df(user_book_rating_df(user_df))
+
+    @classmethod
+    def load(cls, store_dir=STORE_DIR, mmap_mode=None):
+        """
+        Load a store written by save(). With mmap_mode='r' nothing is copied into the process:
+        the CSR arrays, means and neighbor lists stay memory-mapped until a new rating is folded in.
+        """
+        meta = _read_meta(store_dir)
+        shape = tuple(meta["shape"])
+        sums = _load_csr(store_dir, "sums", shape, mmap_mode)
+        counts = _load_csr(store_dir, "counts", shape, mmap_mode)
+        means = _load_csr(store_dir, "means", shape, mmap_mode)
+        user_ids = np.load(os.path.join(store_dir, "user_ids.npy"), mmap_mode=mmap_mode)
+        books = storage.load_strings(os.path.join(store_dir, "books"))
+
+        neighbors = neighbor_scores = None
+        if meta.get("neighbors_k"):
+            neighbors = np.load(os.path.join(store_dir, "neighbors.npy"), mmap_mode=mmap_mode)
+            neighbor_scores = np.load(os.path.join(store_dir, "neighbor_scores.npy"), mmap_mode=mmap_mode)
+        store = cls(sums, counts, user_ids.tolist(), books, means, neighbors, neighbor_scores)
+        store.neighbors_stale = meta.get("neighbors_stale", False)
+        store.source_stamp = meta.get("source_stamp")
+        return store
+
+    def save(self, store_dir=STORE_DIR):
+        """
+        Write the store as a directory of .npy files (memory-mappable), replacing any previous one.
+        Its source_stamp is stored with it so stale stores can be detected, and whether its neighbor
+        lists are stale. Processes that still have the old files mapped keep reading them undisturbed.
+        """
+        matrix, _, _ = self.matrix()
+        tmp_dir, old_dir = store_dir + ".tmp", store_dir + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        _save_csr(tmp_dir, "sums", self.sums)
+        _save_csr(tmp_dir, "counts", self.counts)
+        _save_csr(tmp_dir, "means", matrix)
+        np.save(os.path.join(tmp_dir, "user_ids.npy"), np.array(self.user_ids, dtype=np.int64))
+        storage.save_strings(os.path.join(tmp_dir, "books"), self.books)
+        neighbors_k = 0
+        if self.neighbors is not None:
+            np.save(os.path.join(tmp_dir, "neighbors.npy"), self.neighbors)
+            np.save(os.path.join(tmp_dir, "neighbor_scores.npy"), self.neighbor_scores)
+            neighbors_k = self.neighbors.shape[1]
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"shape": list(matrix.shape), "neighbors_k": neighbors_k,
+                       "neighbors_stale": self.neighbors_stale, "source_stamp": self.source_stamp}, f)
+
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(store_dir):
+            os.replace(store_dir, old_dir)
+        os.replace(tmp_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self.dirty = False
+
+    def compute_neighbors(self, k=NEIGHBORS_K, method="pearson"):
+        """Precompute every user's top-k most similar users (blocked, see similarity.all_top_k_neighbors)."""
+        matrix, _, _ = self.matrix()
+        self.neighbors, self.neighbor_scores = all_top_k_neighbors(matrix, k, method)
+        self.neighbors_stale = False
+        self.dirty = True
+
+    def similar_users(self, user_id, k):
+        """
+        [(user_id, similarity), ...] from the precomputed neighbor lists,
+        or None if they are missing, stale or shorter than k.
+        """
+        _, user_ids, _ = self.matrix()
+        return _neighbor_list(self.neighbors, self.neighbor_scores, user_ids, user_id, k)
+
+    def snapshot(self):
+        """The matrix, indexes and neighbor lists as they are now, as a RatingsSnapshot."""
+        matrix, user_ids, books = self.matrix()
+        return RatingsSnapshot(matrix, user_ids, books, self.neighbors, self.neighbor_scores)
+
+    def add_rating(self, user_id, book, rating):
+        """
+        Record one rating as a delta; the CSR arrays are not touched until the matrix is read.
+        Books are matched by title_key, so a spelling variant lands on the existing column.
+        Returns the title of the column the rating went to.
+        """
+        if self._user_pos is None:
+            self._user_pos = {u: i for i, u in enumerate(self.user_ids)}
+            self._book_pos = {title_key(b): i for i, b in reversed(list(enumerate(self.books)))}
+        if user_id not in self._user_pos:
+            self._user_pos[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        book_key = title_key(book)
+        if book_key not in self._book_pos:
+            self._book_pos[book_key] = len(self.books)
+            self.books.append(book)
+
+        key = (self._user_pos[user_id], self._book_pos[book_key])
+        total, count = self._pending.get(key, (0.0, 0))
+        self._pending[key] = (total + float(rating), count + 1)
+        self._matrix = None
+        self._index = None
+        # Neighbor lists can't be patched cheaply; they are recomputed when the saved store is next opened
+        self.neighbors = self.neighbor_scores = None
+        self.neighbors_stale = True
+        self.dirty = True
+        return self.books[key[1]]
+
+    def _fold_pending(self):
+        """Merge pending deltas into the CSR sum/count arrays."""
+        if not self._pending:
+            return
+        shape = (len(self.user_ids), len(self.books))
+        rows, cols = (np.array(axis, dtype=np.int64) for axis in zip(*self._pending))
+        totals, counts = (np.array(values, dtype=np.float64) for values in zip(*self._pending.values()))
+
+        self.sums = resized(self.sums, shape) + sparse.csr_matrix((totals, (rows, cols)), shape=shape)
+        self.counts = resized(self.counts, shape) + sparse.csr_matrix((counts, (rows, cols)), shape=shape)
+        self._pending = {}
+
+    def matrix(self):
+        """
+        Return (matrix, user_ids, books) like similarity.sparse_ratings_matrix,
+        where matrix holds the mean rating of every (user, book) pair.
+        """
+        if self._matrix is None:
+            self._fold_pending()
+            inverse_counts = self.counts.copy()
+            inverse_counts.data = 1.0 / inverse_counts.data
+            self._matrix = self.sums.multiply(inverse_counts).tocsr()
+        if self._index is None:
+            self._index = (pd.Index(self.user_ids), pd.Index(self.books))
+        return (self._matrix,) + self._index
+
+
+class RatingsSnapshot:
+    """
+    Read-only view of a RatingsStore at one moment, with the store's matrix() and similar_users().
+    New ratings replace the store's matrix, indexes and neighbor lists instead of modifying them,
+    so a snapshot taken under a lock stays consistent after the lock is released.
+    """
+
+    def __init__(self, matrix, user_ids, books, neighbors=None, neighbor_scores=None):
+        self._matrix = matrix
+        self.user_ids = user_ids
+        self.books = books
+        self.neighbors = neighbors
+        self.neighbor_scores = neighbor_scores
+
+    def matrix(self):
+        return self._matrix, self.user_ids, self.books
+
+    def similar_users(self, user_id, k):
+        return _neighbor_list(self.neighbors, self.neighbor_scores, self.user_ids, user_id, k)
+
+
+def _neighbor_list(neighbors, neighbor_scores, user_ids, user_id, k):
+    if neighbors is None or k > neighbors.shape[1]:
+        return None
+    row = user_ids.get_loc(user_id)
+    found = neighbors[row] >= 0
+    return list(zip(user_ids[np.asarray(neighbors[row][found][:k])].tolist(),
+                    np.asarray(neighbor_scores[row][found][:k]).tolist()))
+
+
+def resized(matrix, shape):
+    """Grow a CSR matrix to shape, keeping its entries."""
+    if matrix.shape == shape:
+        return matrix
+    matrix = matrix.tocoo()
+    return sparse.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=shape)
+
+
+def open_ratings_store(users_file="users.csv", store_dir=STORE_DIR, log_file=LOG_FILE, mmap_mode=None,
+                       tables_dir=storage.STORE_DIR):
+    """
+    Load the saved store, or rebuild it (with neighbor lists) from the columnar ratings table in
+    tables_dir (imported from users_file) plus the rating log if it is missing or either file changed
+    since it was read. On a rebuild, ratings of spelling variants of a catalog title are merged into
+    one column named as in the catalog.
+    The store is saved again at interpreter exit if ratings were added to it, keeping the stamp of the
+    files it was read from, and its neighbor lists are recomputed the next time it is opened.
+    """
+    source_files = (users_file, log_file)
+    meta = _read_meta(store_dir)
+    if meta is not None and meta["source_stamp"] == file_stamp(*source_files):
+        store = RatingsStore.load(store_dir, mmap_mode)
+        if store.neighbors_stale:
+            store.compute_neighbors()
+            store.save(store_dir)
+    else:
+        # Stamped before reading, so a file changing meanwhile makes the next open rebuild again
+        stamp = file_stamp(*source_files)
+        ratings = storage.load_ratings(tables_dir, log_file, users_file)
+        vocabulary = Vocabulary(storage.load_books(tables_dir, users_file=users_file))
+        ratings["book"] = vocabulary.canonical_titles(ratings["book"])
+        store = RatingsStore.from_ratings_df(ratings)
+        store.source_stamp = stamp
+        store.compute_neighbors()
+        store.save(store_dir)
+
+    def save_at_exit():
+        if store.dirty:
+            store.save(store_dir)
+    atexit.register(save_at_exit)
+    return store
+
+
+def open_shared(store_dir=STORE_DIR):
+    """
+    Open the saved store read-only via memory maps, for worker processes: resident memory per worker
+    stays flat because every worker maps the same page-cache copy. Nothing is rebuilt or saved.
+    """
+    return RatingsStore.load(store_dir, mmap_mode='r')
@@ -0,0 +1,86 @@
+import collections
+import threading
+import time
+
+CACHE_SIZE = 1024  # users whose recommendations are kept
+CACHE_TTL = 300.0  # seconds; bounds how long other users' new ratings can go unnoticed
+
+
+class RecommendationCache:
+    """
+    LRU + TTL cache of recommendation results keyed by user ID.
+    Every entry remembers the version of that user's history and of the catalog it was computed
+    from; bump_user / bump_catalog make the affected entries stale, so they are recomputed on next
+    lookup. Ratings by *other* users also shift collaborative results but don't bump anything
+    (that would empty the cache on every rating); the TTL bounds that staleness instead.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._user_versions = {}
+        self._catalog_version = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.evictions = collections.Counter()
+
+    def versions(self, user_id):
+        """(user version, catalog version) right now; take it before computing a result to put()."""
+        with self._lock:
+            return self._user_versions.get(user_id, 0), self._catalog_version
+
+    def get(self, user_id):
+        """The cached result for user_id, or None if missing, expired or computed from older versions."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                versions, expires, value = entry
+                reason = None
+                if versions[0] != self._user_versions.get(user_id, 0):
+                    reason = "user"
+                elif versions[1] != self._catalog_version:
+                    reason = "catalog"
+                elif self.clock() >= expires:
+                    reason = "expired"
+                if reason is None:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return value
+                del self._entries[user_id]
+                self.evictions[reason] += 1
+            self.misses += 1
+            return None
+
+    def put(self, user_id, value, versions=None):
+        """
+        Store a result. Pass the versions() taken before computing it, so a bump that happened
+        meanwhile leaves the entry stale instead of hiding the change.
+        """
+        with self._lock:
+            if versions is None:
+                versions = (self._user_versions.get(user_id, 0), self._catalog_version)
+            self._entries[user_id] = (versions, self.clock() + self.ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions["lru"] += 1
+
+    def bump_user(self, user_id):
+        """The user's history changed (new rating, new account)."""
+        with self._lock:
+            self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+
+    def bump_catalog(self):
+        """A book was added: every entry is stale."""
+        with self._lock:
+            self._catalog_version += 1
+
+    def stats(self):
+        """Hit / miss counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "size": len(self._entries), "evictions": dict(self.evictions)}
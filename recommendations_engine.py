@@ -1,11 +1,16 @@
-from scipy.stats import pearsonr
-import numpy as np
-import pandas as pd
 import ast
+import threading
 
-# Load datasets
-user_df = pd.read_csv(r"users.csv")
-book_data = pd.read_csv(r"Amazon_books_cleaned.csv")
+from rec_cache import RecommendationCache
+from tracing import span, traced
+
+# Nothing is loaded at import time: numpy, pandas and scipy (and storage / interning, which need
+# them) are imported by the functions that use them, and data is read on first use by a Recommender.
+# The module-level user_df / book_data / book_df names still work and resolve lazily to the
+# default Recommender's data.
+
+USERS_FILE = "users.csv"  # storage.USERS_FILE, without importing storage
+STORE_DIR = "biblio_store"  # storage.STORE_DIR
 
 def clean_book_df(book_data):
     """Cleans the book dataset and ensures the genre column is properly formatted."""
@@ -13,11 +18,21 @@ def clean_book_df(book_data):
     book_df = book_df.dropna(subset=['genre'])
 
     # Convert genre column from string representation to list
-    book_df['genre'] = book_df['genre'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') else x)
+    book_df['genre'] = book_df['genre'].apply(lambda x: _parse_genres(x) if isinstance(x, str) and x.startswith('[') else x)
     
     return book_df
 
-book_df = clean_book_df(book_data)
+def _parse_genres(cell):
+    """storage.parse_genre_list, raising like literal_eval on a cell that isn't a list."""
+    import storage
+    genres = storage.parse_genre_list(cell)
+    return genres if genres is not None else ast.literal_eval(cell)
+
+def parse_list_cell(value):
+    """Returns a preferences/book_history cell as a list, parsing it if it is still the CSV string form."""
+    if isinstance(value, list):
+        return value
+    return ast.literal_eval(value)
 
 def explode_df(book_df):
     """Explodes the genre column to facilitate filtering."""
@@ -25,11 +40,12 @@ def explode_df(book_df):
 
 def book_hist_to_df(user_df, target_user_ID):
     """Converts a user's book history into a DataFrame."""
+    import pandas as pd
     book_ratings = []
     
     book_history = user_df.iloc[target_user_ID]["book_history"]
 
-    if pd.isna(book_history):
+    if not isinstance(book_history, list) and pd.isna(book_history):
         return pd.DataFrame(book_ratings)  # Return empty DataFrame if missing
 
     if isinstance(book_history, str):
@@ -45,81 +61,595 @@ def book_hist_to_df(user_df, target_user_ID):
 
     return pd.DataFrame(book_ratings)
 
+@traced("parse.user_book_ratings")
 def user_book_rating_df(user_df):
     """Creates a DataFrame of all users' book ratings."""
+    import pandas as pd
     ratings_df_list = [book_hist_to_df(user_df, i) for i in user_df.index]
     return pd.concat(ratings_df_list, ignore_index=True)
 
-def ratings_matrix(user_df):
-    """Generates a user-item ratings matrix with books as columns and users as rows."""
-    ratings_df = user_book_rating_df(user_df).groupby(["user_id", "book"], as_index=False).agg({"rating": "mean"})
-    return ratings_df.pivot(index="user_id", columns="book", values="rating").fillna(0)
-
-def find_similar_users(user_id, user_df):
-    """Finds the most similar users to a given user using Pearson correlation."""
-    rating_matrix = ratings_matrix(user_df)
-    similarities = {}
-    target_user_ratings = rating_matrix.loc[user_id]
-
-    for other_user in rating_matrix.index:
-        if other_user != user_id:
-            corr, _ = pearsonr(target_user_ratings, rating_matrix.loc[other_user])
-            similarities[other_user] = corr
-
-    return sorted(similarities.items(), key=lambda x: x[1], reverse=True)
-
-def recommend_books_by_users(book_df, user_df, user_id):
-    """Recommends books based on similar users' preferences."""
-    book_df_2 = explode_df(book_df)
-    rating_matrix = ratings_matrix(user_df)
-
-    similar_users = find_similar_users(user_id, user_df)[:5]
-    similar_users_ids = [user[0] for user in similar_users]
-
-    similar_users_ratings = rating_matrix.loc[similar_users_ids]
-    avg_ratings = similar_users_ratings.mean().sort_values(ascending=False)
-
-    user_rated_books = set(rating_matrix.loc[user_id][rating_matrix.loc[user_id] > 0].index)
-    recommendations = avg_ratings.drop(user_rated_books).head()
-    recommendations = recommendations[recommendations > 0] 
-
-    if recommendations.empty:
+def ratings_matrix(user_df, vocabulary=None):
+    """
+    Generates a user-item ratings matrix with books as columns and users as rows.
+    Given the catalog's Vocabulary, titles are canonicalized through it so spelling variants share one
+    column named as in the RatingsStore; without one they are used as written. They are then interned
+    so grouping and pivoting compare integers instead of title strings.
+    """
+    import numpy as np
+    import pandas as pd
+    from interning import Interner, title_key
+    ratings_df = user_book_rating_df(user_df)
+    books = Interner(title_key)
+    titles = ratings_df["book"] if vocabulary is None else vocabulary.canonical_titles(ratings_df["book"])
+    ratings_df["book"] = books.intern_many(titles)
+    ratings_df = ratings_df.groupby(["user_id", "book"], as_index=False).agg({"rating": "mean"})
+    matrix = ratings_df.pivot(index="user_id", columns="book", values="rating").fillna(0)
+    matrix.columns = pd.Index(np.array(books.names, dtype=object)[matrix.columns.to_numpy()], name="book")
+    return matrix.sort_index(axis=1)
+
+def _ratings(user_df, store, vocabulary):
+    """
+    (matrix, user_ids, books) from the RatingsStore if given, else parsed from user_df
+    with spelling variants of a title merged into one column as the store does (given a Vocabulary).
+    """
+    if store is not None:
+        return store.matrix()
+    from similarity import sparse_ratings_matrix
+    ratings_df = user_book_rating_df(user_df)
+    if not ratings_df.empty and vocabulary is not None:
+        ratings_df["book"] = vocabulary.canonical_titles(ratings_df["book"])
+    return sparse_ratings_matrix(ratings_df)
+
+def find_similar_users(user_id, user_df, k=None, method="pearson", ann=None, vocabulary=None):
+    """
+    Finds the most similar users to a given user (Pearson correlation by default, or "cosine").
+    Similarity against every user is one sparse product; only the top k are sorted (all users if k is None).
+    Given the catalog's Vocabulary, titles are canonicalized as in _ratings, so the columns match the
+    RatingsStore's and an AnnIndex built on the store can be passed to only score the users it returns
+    as candidates.
+    """
+    matrix, user_ids, _ = _ratings(user_df, None, vocabulary)
+    return _similar_users(matrix, user_ids, user_id, k, method, ann)
+
+def _similar_users(matrix, user_ids, user_id, k=None, method="pearson", ann=None):
+    """Ranks the rows of an already built sparse ratings matrix by similarity to user_id."""
+    from similarity import SIMILARITY_METHODS, top_k_neighbors
+    row = user_ids.get_loc(user_id)
+    k = len(user_ids) - 1 if k is None else k
+
+    if ann is not None and ann.method == method and row < ann.n_users:
+        neighbors, scores = ann.query(matrix, row, k)
+    else:
+        similarities = SIMILARITY_METHODS[method](matrix, row)[0]
+        neighbors, scores = top_k_neighbors(similarities, k, exclude=row)
+    return list(zip(user_ids[neighbors].tolist(), scores.tolist()))
+
+def recommend_books_by_users(book_df, user_df, user_id, store=None, vocabulary=None):
+    """
+    Recommends books based on similar users' preferences.
+    If a RatingsStore is given its precomputed matrix (and neighbor lists) are used instead of re-parsing user_df.
+    Pass the catalog's Vocabulary to reuse it instead of interning book_df on every call.
+    """
+    import numpy as np
+    from interning import Vocabulary
+    from similarity import top_k_neighbors
+    if vocabulary is None:
+        with span("users.vocabulary"):
+            vocabulary = Vocabulary(book_df)
+    with span("users.ratings_matrix"):
+        matrix, user_ids, books = _ratings(user_df, store, vocabulary)
+    if user_id not in user_ids:
+        return [], []  # No ratings yet (e.g. a new account): no one to compare with, see recommend_by_content
+
+    with span("users.similar_users"):
+        similar_users = store.similar_users(user_id, 5) if store is not None else None
+        if similar_users is None:
+            similar_users = _similar_users(matrix, user_ids, user_id, k=5)
+        similar_rows = user_ids.get_indexer([user[0] for user in similar_users])
+
+    with span("users.average_ratings"):
+        avg_ratings = np.asarray(matrix[similar_rows].mean(axis=0)).ravel()
+
+    with span("users.exclude_read"):
+        # Ranked by column: books already rated and scores that aren't positive can never be picked
+        user_row = matrix[user_ids.get_loc(user_id)]
+        avg_ratings[user_row.indices[user_row.data > 0]] = -np.inf
+        avg_ratings[~(avg_ratings > 0)] = -np.inf
+        top, _ = top_k_neighbors(avg_ratings, 5)
+
+    with span("users.author_lookup"):
+        return vocabulary.describe(books[top])
+
+def recommend_books_by_items(book_df, user_df, user_id, table=None, store=None, vocabulary=None):
+    """
+    Recommends books similar to the ones the user already rated (item-based collaborative filtering).
+    Each candidate scores the sum of similarity x rating over the user's rated books, read from a
+    precomputed ItemNeighborTable, so the cost depends on the history length, not the number of users.
+    """
+    from interning import Vocabulary
+    from item_based import ItemNeighborTable
+    vocabulary = Vocabulary(book_df) if vocabulary is None else vocabulary
+    matrix, user_ids, books = _ratings(user_df, store, vocabulary)
+    if user_id not in user_ids:
         return [], []
 
-    books, authors = [], []
-    for book_title in recommendations.index:
-        matching_books = book_df_2[book_df_2['title'] == book_title]
-        if not matching_books.empty:
-            books.append(book_title)
-            authors.append(matching_books['author'].iloc[0])
+    if table is None:
+        table = ItemNeighborTable.build(matrix, books)
+    elif table.stale_books or len(table.neighbors) < len(books):
+        table.update(matrix, user_ids, books)
+
+    user_row = matrix[user_ids.get_loc(user_id)]
+    rated = user_row.data > 0
+    picks = table.score_user(user_row.indices[rated], user_row.data[rated], top_n=5)
+    return vocabulary.describe(books[[col for col, _ in picks]])
+
+def recommend_books_by_als(book_df, user_df, user_id, model=None, store=None, vocabulary=None):
+    """
+    Recommends the unread books with the highest predicted rating under a matrix-factorization (ALS) model.
+    Serving is one dot product of the user's factors with every book's factors plus an argpartition.
+    Nothing for a user without ratings of books the model was trained on: their factors would be zero.
+    """
+    from als import ALSModel
+    from interning import Vocabulary
+    vocabulary = Vocabulary(book_df) if vocabulary is None else vocabulary
+    matrix, user_ids, books = _ratings(user_df, store, vocabulary)
+    if user_id not in user_ids:
+        return [], []
 
-    return books, authors
+    if model is None:
+        model = ALSModel.train(matrix, user_ids, books)
 
-def recommend_by_total_rating(book_df, user_df, target_user_ID):
-    """Recommends books based on the highest overall rating in the user's preferred genres."""
-    book_df_2 = explode_df(book_df)
-    
+    user_row = matrix[user_ids.get_loc(user_id)]
+    if not model.knows(user_row.indices):
+        return [], []
+    picks = model.recommend(model.user_vector(matrix, user_ids, user_id), exclude=user_row.indices, n=5)
+    return vocabulary.describe(books[[col for col, _ in picks]])
+
+def recommend_by_total_rating(book_df, user_df, target_user_ID, index=None):
+    """
+    Recommends books based on the highest overall rating in the user's preferred genres.
+    Pass a prebuilt GenreIndex to avoid indexing the catalog on every call.
+    """
+    if index is None:
+        from genre_index import GenreIndex
+        with span("rating.genre_index"):
+            index = GenreIndex(clean_book_df(book_df))
+
+    with span("rating.parse_user"):
+        taste = _preferences_and_read(user_df, target_user_ID)
+        if taste is None:
+            return [], []
+        user_preferences, reader_book_list, _ = taste
+
+    with span("rating.top_books"):
+        return index.top_books(user_preferences, exclude_titles=reader_book_list, n=5)
+
+def _preferences_and_read(user_df, target_user_ID):
+    """
+    (preferred genres, titles already read, their ratings) of a user,
+    or None if the preferences can't be parsed.
+    """
     try:
-        user_preferences = ast.literal_eval(user_df.iloc[target_user_ID]["preferences"])
+        user_preferences = parse_list_cell(user_df.iloc[target_user_ID]["preferences"])
     except (ValueError, SyntaxError):
-        return [], []  # Return empty lists if preferences cannot be parsed
-
-    filtered_books = book_df_2[book_df_2['genre'].apply(lambda x: any(g in x for g in user_preferences))]
-    filtered_books = filtered_books.sort_values(by='rating', ascending=False)
+        return None
 
     try:
-        reader_book_list = [i['book'] for i in ast.literal_eval(user_df.iloc[target_user_ID]["book_history"])]
+        history = parse_list_cell(user_df.iloc[target_user_ID]["book_history"])
     except (ValueError, SyntaxError):
-        reader_book_list = []  # Default to empty list if parsing fails
-
-    recommended_books = filtered_books[~filtered_books['title'].isin(reader_book_list)].drop_duplicates(subset='title')
-
-    books, authors = [], []
-    for _, row in recommended_books.head(5).iterrows():
-        books.append(row["title"])
-        authors.append(row["author"])
-
-    return books, authors
+        history = []  # Default to empty list if parsing fails
+    return user_preferences, [i['book'] for i in history], [i.get('rating') for i in history]
+
+def recommend_by_popularity(user_df, target_user_ID, popularity, score="bayesian"):
+    """
+    Recommends the books users rated best (or most, with score="count") in the user's preferred genres,
+    from rolling PopularityAggregates instead of the catalog's static rating column.
+    """
+    taste = _preferences_and_read(user_df, target_user_ID)
+    if taste is None:
+        return [], []
+    user_preferences, reader_book_list, _ = taste
+    with span("popularity.top_books"):
+        return popularity.top_books(user_preferences, exclude_titles=reader_book_list, n=5, score=score)
+
+def recommend_by_content(user_df, target_user_ID, model):
+    """
+    Recommends the unread books whose genres, authors, rating and popularity best match the user's
+    preferred genres and rated books (a ContentModel), so even users without ratings get results.
+    """
+    import numpy as np
+    import pandas as pd
+    from content_based import NEUTRAL_RATING
+    taste = _preferences_and_read(user_df, target_user_ID)
+    if taste is None:
+        return [], []
+    user_preferences, reader_book_list, ratings = taste
+    # An entry without a usable rating counts as read but says nothing about taste
+    ratings = pd.to_numeric(pd.Series(ratings, dtype=object), errors="coerce").fillna(NEUTRAL_RATING)
+    with span("content.profile"):
+        profile = model.profile(user_preferences, reader_book_list, ratings.to_numpy(np.float64))
+    with span("content.score"):
+        picks = model.recommend(profile, exclude_titles=reader_book_list, n=5)
+    vocabulary = model.vocabulary
+    return [vocabulary.title(book_id) for book_id, _ in picks], [vocabulary.author(book_id) for book_id, _ in picks]
+
+class UnknownUser(KeyError):
+    """A user ID that isn't in the users table; a KeyError, so callers catching that still work."""
+
+def check_user(user_df, target_user_ID):
+    """Raise UnknownUser unless target_user_ID is a user of user_df (IDs are row positions)."""
+    if not 0 <= target_user_ID < len(user_df):
+        raise UnknownUser(target_user_ID)
+
+def surprise_books(user_df, target_user_ID, sampler, n=3, weighting="rating"):
+    """
+    Book IDs of n random unread catalog books for a user (any n random books for None), drawn by a
+    SurpriseSampler. With weighting="unexplored" they come from genres the user neither prefers
+    (matched as substrings, as in GenreIndex.matching_genres) nor has read.
+    """
+    if target_user_ID is not None:
+        check_user(user_df, target_user_ID)
+    read, explored = [], set()
+    taste = _preferences_and_read(user_df, target_user_ID) if target_user_ID is not None else None
+    if taste is not None:
+        user_preferences, read, _ = taste
+        vocabulary = sampler.vocabulary
+        if weighting == "unexplored":
+            read_ids = vocabulary.books.lookup(read)
+            for book_id in read_ids[(read_ids >= 0) & (read_ids < len(vocabulary.in_catalog))].tolist():
+                explored.update(vocabulary.genres_of(book_id).tolist())
+            explored.update(g for g, genre in enumerate(vocabulary.genres.names)
+                            if isinstance(genre, str) and any(pref in genre for pref in user_preferences))
+    return sampler.sample(n, weighting, exclude_titles=read, explored_genres=explored)
+
+class Recommender:
+    """
+    Explicitly constructed engine state. Users, catalog, ratings store and genre index are each loaded
+    on first use (thread-safe), so constructing one is free; warm() loads everything, optionally in
+    a background thread while the user is still logging in. Users come from users_file, imported
+    into the columnar store at store_dir.
+    """
+
+    def __init__(self, users_file=USERS_FILE, store_dir=STORE_DIR):
+        self.users_file = users_file
+        self.store_dir = store_dir  # the columnar store (storage.py) users_file is imported into
+        self._lock = threading.RLock()
+        self._user_df = None
+        self._book_data = None
+        self._book_df = None
+        self._ratings_store = None
+        self._genre_index = None
+        self._vocabulary = None
+        self._popularity = None
+        self._content_model = None
+        self._metadata = None
+        self._surprise_sampler = None
+        self._item_table = None
+        self._ann_index = None
+        self._als_model = None
+        self._warm_thread = None
+        self.cache = RecommendationCache()
+
+    def _loaded(self, attribute, loader):
+        """getattr(self, attribute), set to loader() under the lock on first use."""
+        with self._lock:
+            if getattr(self, attribute) is None:
+                setattr(self, attribute, loader())
+            return getattr(self, attribute)
+
+    @property
+    def user_df(self):
+        """Users with parsed preferences / book_history, logged ratings included."""
+        return self._loaded("_user_df", self._load_user_df)
+
+    def _load_user_df(self):
+        import storage
+        with span("load.users"):
+            return storage.load_users(self.store_dir, users_file=self.users_file)
+
+    @property
+    def book_data(self):
+        """The full catalog (every column and row)."""
+        return self._loaded("_book_data", self._load_book_data)
+
+    def _load_book_data(self):
+        import storage
+        with span("load.catalog"):
+            return storage.load_books(self.store_dir, clean=False, users_file=self.users_file)
+
+    @property
+    def book_df(self):
+        """The catalog as clean_book_df returns it."""
+        return self._loaded("_book_df", self._load_book_df)
+
+    def _load_book_df(self):
+        with span("load.clean_catalog"):
+            return clean_book_df(self.book_data)
+
+    @property
+    def ratings_store(self):
+        return self._loaded("_ratings_store", self._load_ratings_store)
+
+    def _load_ratings_store(self):
+        from ratings_store import open_ratings_store
+        with span("load.ratings_store"):
+            return open_ratings_store(self.users_file, tables_dir=self.store_dir)
+
+    @property
+    def genre_index(self):
+        return self._loaded("_genre_index", self._load_genre_index)
+
+    def _load_genre_index(self):
+        from genre_index import GenreIndex
+        with span("load.genre_index"):
+            return GenreIndex(self.book_df)
+
+    @property
+    def vocabulary(self):
+        """Integer IDs for the catalog's books, authors and genres (see interning.Vocabulary)."""
+        return self._loaded("_vocabulary", self._load_vocabulary)
+
+    def _load_vocabulary(self):
+        from interning import Vocabulary
+        with span("load.vocabulary"):
+            return Vocabulary(self.book_df)
+
+    @property
+    def popularity(self):
+        """Rolling per-book rating counts / sums and the rankings built on them (see popularity.py)."""
+        return self._loaded("_popularity", self._load_popularity)
+
+    def _load_popularity(self):
+        from popularity import PopularityAggregates
+        with span("load.popularity"):
+            return PopularityAggregates.from_store(self.ratings_store, self.vocabulary)
+
+    @property
+    def content_model(self):
+        """Sparse genre / author / rating / review-count features of every catalog book (see content_based.py)."""
+        return self._loaded("_content_model", self._load_content_model)
+
+    def _load_content_model(self):
+        from content_based import ContentModel
+        with span("load.content_model"):
+            return ContentModel.build(self.book_df, self.vocabulary)
+
+    @property
+    def metadata(self):
+        """Author, rating, genres, id, image and URL of every catalog book, by book ID or title (see book_metadata.py)."""
+        return self._loaded("_metadata", self._load_metadata)
+
+    def _load_metadata(self):
+        from book_metadata import BookMetadata
+        with span("load.metadata"):
+            return BookMetadata(self.vocabulary, self.book_data)
+
+    @property
+    def surprise_sampler(self):
+        """Alias-method sampler of catalog books for "Surprise me" (see surprise.py)."""
+        return self._loaded("_surprise_sampler", self._load_surprise_sampler)
+
+    def _load_surprise_sampler(self):
+        from surprise import SurpriseSampler
+        return SurpriseSampler(self.metadata)
+
+    @property
+    def item_table(self):
+        return self._loaded("_item_table", self._load_item_table)
+
+    def _load_item_table(self):
+        from item_based import open_item_table
+        return open_item_table(self.ratings_store, self.users_file)
+
+    @property
+    def ann_index(self):
+        """Approximate similar-user index over the ratings store (Pearson), built in memory on first use."""
+        return self._loaded("_ann_index", self._load_ann_index)
+
+    def _load_ann_index(self):
+        from ann_index import AnnIndex
+        return AnnIndex(self.ratings_store.matrix()[0])
+
+    @property
+    def als_model(self):
+        return self._loaded("_als_model", self._load_als_model)
+
+    def _load_als_model(self):
+        from als import open_als_model
+        with span("load.als_model"):
+            return open_als_model(self.ratings_store, self.users_file)
+
+    def warm(self, background=True):
+        """Load everything now; with background=True this returns at once and loading happens in a daemon thread."""
+        loaders = (("_user_df", self._load_user_df), ("_book_df", self._load_book_df),
+                   ("_vocabulary", self._load_vocabulary), ("_ratings_store", self._load_ratings_store),
+                   ("_genre_index", self._load_genre_index), ("_content_model", self._load_content_model),
+                   ("_metadata", self._load_metadata))
+
+        def load():
+            for attribute, loader in loaders:
+                self._loaded(attribute, loader)
+        if not background:
+            load()
+        elif self._warm_thread is None:
+            self._warm_thread = threading.Thread(target=load, name="recommender-warmup", daemon=True)
+            self._warm_thread.start()
+        return self
+
+    # The heavy sources read snapshots taken under the lock and compute without it, so requests run
+    # concurrently (numpy / scipy release the GIL). Writers replace the matrices, models and history
+    # lists these hold instead of modifying them, and the interners they share only ever grow.
+
+    def recommend_by_users(self, user_id):
+        with self._lock:
+            book_df, user_df, vocabulary = self.book_df, self.user_df, self.vocabulary
+            store = self.ratings_store.snapshot()
+        return recommend_books_by_users(book_df, user_df, user_id, store=store, vocabulary=vocabulary)
+
+    def recommend_by_rating(self, user_id):
+        with self._lock:
+            book_df, user_df, index = self.book_df, self.user_df, self.genre_index
+        return recommend_by_total_rating(book_df, user_df, user_id, index=index)
+
+    def recommend_by_popularity(self, user_id, score="bayesian"):
+        with self._lock:
+            return recommend_by_popularity(self.user_df, user_id, self.popularity, score)
+
+    def top_books(self, n=10, score="bayesian", genre=None):
+        """The n best rated (score="bayesian" / "mean") or most rated ("count") books, overall or in one genre."""
+        with self._lock:
+            return self.popularity.top(n, score, genre)
+
+    def recommend_by_content(self, user_id):
+        with self._lock:
+            user_df, model = self.user_df, self.content_model.frozen()
+        return recommend_by_content(user_df, user_id, model)
+
+    def surprise(self, n=3, user_id=None, weighting="rating"):
+        """Records (see BookMetadata.record) of n random catalog books the user hasn't read."""
+        with self._lock:
+            book_ids = surprise_books(self.user_df if user_id is not None else None, user_id,
+                                      self.surprise_sampler, n, weighting)
+            return self.metadata.records(book_ids)
+
+    def recommend_by_items(self, user_id):
+        with self._lock:
+            return recommend_books_by_items(self.book_df, self.user_df, user_id,
+                                            table=self.item_table, store=self.ratings_store,
+                                            vocabulary=self.vocabulary)
+
+    def recommend_by_als(self, user_id):
+        with self._lock:
+            book_df, user_df, vocabulary = self.book_df, self.user_df, self.vocabulary
+            model, store = self.als_model, self.ratings_store.snapshot()
+        return recommend_books_by_als(book_df, user_df, user_id, model=model, store=store, vocabulary=vocabulary)
+
+    def recommendations(self, user_id):
+        """
+        All the menu's recommendation sources for a user, as {"users": ..., "rating": ..., "als": ..., "content": ...}
+        (each a (titles, authors) pair). Served from the cache while nothing relevant changed.
+        """
+        result = self.cache.get(user_id)
+        return result if result is not None else self.compute_recommendations(user_id)
+
+    def compute_recommendations(self, user_id):
+        """recommendations() without the cache lookup: compute them and store them in the cache. UnknownUser for an unknown user."""
+        check_user(self.user_df, user_id)
+        versions = self.cache.versions(user_id)
+        # Each source snapshots what it reads; a rating arriving meanwhile bumps the versions, so the
+        # result is never served as current
+        with span("recommend.request"):
+            with span("recommend.users"):
+                users = self.recommend_by_users(user_id)
+            with span("recommend.rating"):
+                rating = self.recommend_by_rating(user_id)
+            with span("recommend.als"):
+                als = self.recommend_by_als(user_id)
+            with span("recommend.content"):
+                content = self.recommend_by_content(user_id)
+            result = {"users": users, "rating": rating, "als": als, "content": content}
+        self.cache.put(user_id, result, versions)
+        return result
+
+    def recommendation_records(self, recommendations):
+        """
+        recommendations() with each (titles, authors) pair turned into a list of book records
+        (see BookMetadata.record); a title the catalog doesn't describe keeps just its title and author.
+        """
+        # The loaded index is read without the lock, so cache hits answered on server.py's event loop
+        # never wait for a writer; it only grows
+        metadata = self._metadata if self._metadata is not None else self.metadata
+        return {source: [record if record is not None else {"title": title, "author": author}
+                         for record, title, author in zip(metadata.lookup(titles), titles, authors)]
+                for source, (titles, authors) in recommendations.items()}
+
+    def find_similar_users(self, user_id, k=None, method="pearson", approximate=False):
+        """With approximate=True only candidates from the ANN index are scored (sub-linear in the number of users)."""
+        with self._lock:
+            matrix, user_ids, _ = self.ratings_store.snapshot().matrix()
+            ann = self.ann_index if approximate else None
+        return _similar_users(matrix, user_ids, user_id, k, method, ann)
+
+    def add_rating(self, user_id, book, rating, author=None, genre=None):
+        """Apply a new rating to whatever is already loaded, the user's history included."""
+        with self._lock:
+            self._add_history_entry(int(user_id), {"book": book, "author": author, "genre": genre, "rating": rating})
+            if self._ratings_store is not None:
+                # The store files the rating under its column for the book, whatever the spelling
+                book = self._ratings_store.add_rating(int(user_id), book, rating)
+            if self._item_table is not None:
+                self._item_table.mark_stale(int(user_id), book)
+            if self._popularity is not None:
+                self._popularity.add_rating(book, rating)
+            if self._als_model is not None:
+                self._als_model.mark_stale(int(user_id))
+        self.cache.bump_user(int(user_id))
+
+    def _add_history_entry(self, user_id, entry):
+        """Append a rating to the user's row of the loaded users (a user it doesn't have makes them re-read)."""
+        user_df = self._user_df
+        if user_df is None:
+            return
+        if not (0 <= user_id < len(user_df) and user_df["ID"].iat[user_id] == user_id):
+            self._user_df = None
+            return
+        column = user_df.columns.get_loc("book_history")
+        history = user_df.iat[user_id, column]
+        if isinstance(history, list):  # else unparseable in users.csv, and storage.load_users leaves it so
+            # A new list rather than append(): requests running outside the lock may hold the old one
+            user_df.iat[user_id, column] = history + [entry]
+
+    def add_user(self, user_id=None, name=None, age=None, preferences=()):
+        """
+        A user was created: add their row, with an empty history that add_rating then fills, to the
+        loaded users. Without a user_id (or one that isn't the next row) users are re-read on next use.
+        """
+        with self._lock:
+            user_df = self._user_df
+            if user_df is not None and user_id is not None and int(user_id) == len(user_df):
+                import pandas as pd
+                row = dict.fromkeys(user_df.columns)
+                row.update({"name": name, "age": age, "preferences": list(preferences), "book_history": [],
+                            "ID": int(user_id)})
+                # A new frame rather than an in-place append, for the same reason as in _add_history_entry
+                self._user_df = pd.concat([user_df, pd.DataFrame([row], columns=user_df.columns)], ignore_index=True)
+            else:
+                self._user_df = None
+        if user_id is not None:
+            self.cache.bump_user(int(user_id))
+
+    def add_book(self, title, author, rating, genres, catalog_id=None, reviews_count=None):
+        """A book was appended to the catalog: index it if the index is loaded, re-read the catalog on next use."""
+        with self._lock:
+            if self._genre_index is not None:
+                self._genre_index.add_book(title, author, rating, genres)
+            if self._vocabulary is not None:
+                new = self._vocabulary.catalog_ids([title])[0] < 0
+                book_id = self._vocabulary.add_book(title, author, rating, genres)
+                if self._content_model is not None:
+                    self._content_model.add_book(book_id, author, rating, genres, reviews_count)
+                if self._metadata is not None:
+                    self._metadata.add_book(book_id, id=catalog_id, reviews_count=reviews_count)
+                if self._surprise_sampler is not None and new:
+                    self._surprise_sampler.add_book(book_id)
+            self._book_data = self._book_df = None
+        self.cache.bump_catalog()
+
+
+_default_recommender = None
+
+def get_recommender():
+    """The process-wide default Recommender (constructed, not loaded, on first call)."""
+    global _default_recommender
+    if _default_recommender is None:
+        _default_recommender = Recommender()
+    return _default_recommender
+
+def __getattr__(name):
+    # Lazy module attributes: keep `recommendations_engine.user_df` etc. working without import-time loading
+    if name in ("user_df", "book_data", "book_df"):
+        return getattr(get_recommender(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 """ # Example usage
 user_id = 500
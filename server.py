@@ -0,0 +1,255 @@
+"""
+Long-running recommendation server: loads the data once and serves the CLI's actions over HTTP.
+
+    python server.py [--host 127.0.0.1] [--port 8765] [--workers 4]
+
+Endpoints (JSON in and out):
+    GET  /recommend?user_id=N        {"users": [book, ...], "rating": [...], "als": [...], "content": [...]}
+    POST /rate      {"user_id", "title", "author", "genre", "rating"}     -> {"new_book_id"}
+    GET  /surprise?n=3[&user_id=N][&weighting=rating]   {"books": [book, ...]}, unread books if user_id is given
+    GET  /popular?n=10&score=bayesian[&genre=G]   {"books": [{"title", "author", "ratings", "mean", "score"}, ...]}
+    POST /users     {"name", "age", "preferences", "book_history"}        -> {"id", "new_books"}
+    GET  /login?user_id=N&name=X     {"exists"}
+    GET  /stats                      request counts and recommendation cache hit rate
+    GET  /trace[?format=chrome]      per-stage timing histograms (or Trace Event JSON); needs --trace
+    GET  /profile?user_id=N&mode=cpu one uncached recommendation under cProfile (or mode=memory)
+
+A book is {"title", "author", "rating", "genres", "id", "reviews_count", "image_url", "url"} (see book_metadata.py).
+
+The event loop only parses requests and answers recommendation cache hits. Cache misses run on a
+thread pool (numpy / scipy release the GIL in the heavy kernels), and everything that writes files
+runs on a single writer thread, so writes never interleave. Run `python interactive_code.py --server URL` for the CLI as a client.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import urllib.parse
+
+import interactive_code
+import popularity
+import surprise
+import tracing
+from recommendations_engine import UnknownUser
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 4
+MAX_SURPRISE = 50  # books per /surprise request; sampling holds the Recommender lock
+
+MIN_RATING, MAX_RATING = 1.0, 5.0  # the CLI's range
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    # numpy scalars from the catalog (ids, ratings)
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _int_param(params, name):
+    try:
+        return int(params[name])
+    except (KeyError, ValueError):
+        raise HTTPError(400, f"'{name}' must be an integer") from None
+
+
+def _rating(value):
+    """A rating from a request body: a finite number from MIN_RATING to MAX_RATING, else 400."""
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        rating = math.nan
+    if not (math.isfinite(rating) and MIN_RATING <= rating <= MAX_RATING):
+        raise HTTPError(400, f"rating must be a number from {MIN_RATING:g} to {MAX_RATING:g}, got {value!r}")
+    return rating
+
+
+def _books(titles_authors):
+    titles, authors = titles_authors
+    return [{"title": title, "author": author} for title, author in zip(titles, authors)]
+
+
+class BiblioServer:
+    def __init__(self, workers=WORKERS):
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="recommend")
+        self.writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="writer")
+        self.requests = collections.Counter()
+        self.routes = {
+            ("GET", "/recommend"): self.recommend,
+            ("POST", "/rate"): self.rate,
+            ("GET", "/surprise"): self.surprise,
+            ("GET", "/popular"): self.popular,
+            ("POST", "/users"): self.create_user,
+            ("GET", "/login"): self.login,
+            ("GET", "/stats"): self.stats,
+            ("GET", "/trace"): self.trace,
+            ("GET", "/profile"): self.profile,
+        }
+
+    def warm(self):
+        """Load users, catalog, ratings store, genre index, content features, book metadata and ALS model before accepting requests."""
+        recommender = interactive_code.get_recommender().warm(background=False)
+        recommender.als_model
+
+    async def run(self, executor, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+    async def recommend(self, params, body):
+        user_id = _int_param(params, "user_id")
+        # Cache hits are answered on the loop; only misses queue for the pool
+        recommender = interactive_code.get_recommender()
+        recommendations = recommender.cache.get(user_id)
+        if recommendations is None:
+            recommendations = await self.run(self.pool, recommender.compute_recommendations, user_id)
+        return recommender.recommendation_records(recommendations)
+
+    async def rate(self, params, body):
+        try:
+            args = (body["user_id"], body["title"].strip(), body["author"].strip(), body.get("genre", "").strip())
+            rating = body["rating"]
+        except (KeyError, TypeError, AttributeError):
+            raise HTTPError(400, "expected user_id, title, author, genre and a numeric rating") from None
+        new_book_id = await self.run(self.writer, interactive_code.save_rating, *args, _rating(rating))
+        return {"new_book_id": new_book_id}
+
+    async def surprise(self, params, body):
+        n = _int_param(params, "n") if "n" in params else 3
+        if not 0 < n <= MAX_SURPRISE:
+            raise HTTPError(400, f"n must be from 1 to {MAX_SURPRISE}")
+        user_id = _int_param(params, "user_id") if "user_id" in params else None
+        weighting = params.get("weighting", "rating")
+        if weighting not in surprise.WEIGHTINGS:
+            raise HTTPError(400, f"weighting must be one of {', '.join(surprise.WEIGHTINGS)}")
+        books = await self.run(self.pool, interactive_code.pick_surprise_books, n, user_id, weighting)
+        return {"books": books}
+
+    async def popular(self, params, body):
+        n = _int_param(params, "n") if "n" in params else 10
+        score = params.get("score", "bayesian")
+        if score not in popularity.SCORES:
+            raise HTTPError(400, f"score must be one of {', '.join(popularity.SCORES)}")
+        recommender = interactive_code.get_recommender()
+        return {"books": await self.run(self.pool, recommender.top_books, n, score, params.get("genre"))}
+
+    async def create_user(self, params, body):
+        try:
+            history = [{"book": book["book"].strip(), "author": book["author"].strip(),
+                        "genre": book.get("genre", "").strip(), "rating": _rating(book["rating"])}
+                       for book in body.get("book_history", [])]
+            args = (body["name"].strip(), str(body.get("age", "")), list(body.get("preferences", [])), history)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise HTTPError(400, "expected name, age, preferences and book_history entries "
+                                 "with book, author, genre and rating") from None
+        new_id, new_books = await self.run(self.writer, interactive_code.register_user, *args)
+        return {"id": new_id, "new_books": new_books}
+
+    async def login(self, params, body):
+        user_id, name = params.get("user_id", ""), params.get("name", "")
+        # A stat of users.csv and possibly a reload: off the loop like everything else that touches files
+        return {"exists": await self.run(self.pool, interactive_code.user_exists, user_id, name)}
+
+    async def stats(self, params, body):
+        return {"requests": dict(self.requests), "cache": interactive_code.get_recommender().cache.stats()}
+
+    async def trace(self, params, body):
+        if params.get("format") == "chrome":
+            return tracing.tracer.chrome_trace()
+        return {"enabled": tracing.tracer.enabled, "spans": tracing.tracer.summary()}
+
+    async def profile(self, params, body):
+        user_id = _int_param(params, "user_id")
+        mode = params.get("mode", "cpu")
+        if mode not in ("cpu", "memory"):
+            raise HTTPError(400, "mode must be 'cpu' or 'memory'")
+
+        def profiled_request():
+            with tracing.profiled(mode) as profile:
+                recommendations = interactive_code.get_recommender().compute_recommendations(user_id)
+            return recommendations, profile.report
+        recommendations, report = await self.run(self.pool, profiled_request)
+        return {"recommendations": {source: _books(result) for source, result in recommendations.items()},
+                "profile": report}
+
+    async def dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            known = any(path == url.path for _, path in self.routes)
+            return (405 if known else 404), {"error": f"{method} {url.path}"}
+        self.requests[url.path] += 1
+        try:
+            body = json.loads(body) if body else {}
+            return 200, await handler(params, body)
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except UnknownUser as e:
+            return 404, {"error": f"unknown user {e}"}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        """One connection: HTTP/1.1 requests with keep-alive, until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+                status, payload = await self.dispatch(method, target, body)
+                data = json.dumps(payload, default=_json_default, ensure_ascii=False).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        await self.run(self.pool, self.warm)
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recommendations over HTTP with everything loaded once.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads computing recommendations")
+    parser.add_argument("--trace", action="store_true", help="record per-stage timings, served at /trace")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable()
+    try:
+        asyncio.run(BiblioServer(args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
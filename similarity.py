@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def sparse_ratings_matrix(ratings_df):
+    """
+    Build a CSR user x book matrix from a (user_id, book, rating) DataFrame.
+    Duplicate (user, book) pairs are averaged, like ratings_matrix does.
+    Returns (matrix, user_ids, books); rows and columns are sorted the same way as the dense pivot.
+    """
+    if ratings_df.empty:
+        return sparse.csr_matrix((0, 0)), pd.Index([]), pd.Index([])
+
+    ratings_df = ratings_df.groupby(["user_id", "book"], as_index=False).agg({"rating": "mean"})
+    user_codes, user_ids = pd.factorize(ratings_df["user_id"], sort=True)
+    book_codes, books = pd.factorize(ratings_df["book"], sort=True)
+
+    matrix = sparse.csr_matrix(
+        (ratings_df["rating"].to_numpy(dtype=np.float64), (user_codes, book_codes)),
+        shape=(len(user_ids), len(books)),
+    )
+    return matrix, pd.Index(user_ids), pd.Index(books)
+
+
+def _row_stats(matrix):
+    """Per-row sum and sum of squares of a sparse matrix."""
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    squares = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    return sums, squares
+
+
+def pearson_similarity(matrix, rows):
+    """
+    Pearson correlation of the given rows against every row of matrix.
+    Unrated books count as 0, exactly like pearsonr on the zero-filled pivot,
+    but the centring is folded into one sparse product:
+        cov(x, y) = x.y - n * mean(x) * mean(y)
+    Returns a dense (len(rows), n_users) array; constant rows give NaN.
+    """
+    rows = np.atleast_1d(rows)
+    n_books = matrix.shape[1]
+    sums, squares = _row_stats(matrix)
+    means = sums / n_books
+    norms = np.sqrt(np.maximum(squares - n_books * means ** 2, 0.0))
+
+    dots = np.asarray((matrix[rows] @ matrix.T).todense())
+    cov = dots - n_books * np.outer(means[rows], means)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cov / np.outer(norms[rows], norms)
+
+
+def cosine_similarity(matrix, rows):
+    """Cosine similarity of the given rows against every row of matrix (no centring)."""
+    rows = np.atleast_1d(rows)
+    _, squares = _row_stats(matrix)
+    norms = np.sqrt(squares)
+
+    dots = np.asarray((matrix[rows] @ matrix.T).todense())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return dots / np.outer(norms[rows], norms)
+
+
+TIE_DECIMALS = 12
+
+SIMILARITY_METHODS = {
+    "pearson": pearson_similarity,
+    "cosine": cosine_similarity,
+}
+
+
+def top_k_neighbors(similarities, k, exclude=None):
+    """
+    Return (indices, scores) of the k highest similarities, best first.
+    Uses argpartition so only the k winners get sorted. NaN and excluded scores never make the cut.
+    Scores equal up to float noise are ranked by index, so results are deterministic.
+    """
+    scores = np.array(similarities, dtype=np.float64)
+    scores[np.isnan(scores)] = -np.inf
+    if exclude is not None:
+        scores[exclude] = -np.inf
+
+    k = min(k, np.count_nonzero(scores > -np.inf))
+    if k <= 0:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.float64)
+
+    ranked = np.round(scores, TIE_DECIMALS)
+    kth = ranked[np.argpartition(-ranked, k - 1)[k - 1]]
+    top = np.flatnonzero(ranked >= kth)
+    top = top[np.lexsort((top, -ranked[top]))][:k]
+    return top, scores[top]
+
+
+def block_top_k_neighbors(block, rows, k):
+    """
+    Top-k neighbors for each row of a (len(rows), n_users) similarity block, excluding the row itself.
+    Returns (neighbors, scores) of shape (len(rows), k); missing slots are -1 / NaN.
+    """
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), np.nan, dtype=np.float64)
+    for i, row in enumerate(rows):
+        top, top_scores = top_k_neighbors(block[i], k, exclude=row)
+        neighbors[i, :len(top)] = top
+        scores[i, :len(top)] = top_scores
+    return neighbors, scores
+
+
+def block_rows(n_rows, n_columns, block_size=1024, max_cells=2 ** 24):
+    """Split range(n_rows) into blocks whose dense (rows, n_columns) slice stays under max_cells."""
+    block_size = max(1, min(block_size, max_cells // max(n_columns, 1)))
+    return [np.arange(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+
+def all_top_k_neighbors(matrix, k, method="pearson", block_size=1024):
+    """
+    Top-k neighbors of every row, computed a block of rows at a time so only a
+    (block, n_users) slice of the similarity matrix is ever in memory.
+    Returns (neighbors, scores) arrays of shape (n_users, k); missing slots are -1 / NaN.
+    """
+    similarity = SIMILARITY_METHODS[method]
+    n_users = matrix.shape[0]
+    neighbors = np.full((n_users, k), -1, dtype=np.int32)
+    scores = np.full((n_users, k), np.nan, dtype=np.float64)
+
+    for rows in block_rows(n_users, n_users, block_size):
+        neighbors[rows], scores[rows] = block_top_k_neighbors(similarity(matrix, rows), rows, k)
+    return neighbors, scores
@@ -1,81 +1,185 @@
+"""
+Generates fake users (name, age, favourite genres and a rated book history) and writes them to
+users.csv and the columnar store, in the layout the rest of the project reads.
+
+    python simulate_users.py [n_users] [--max-books 100] [--workers 4] [--chunk 20000] [--seed 0]
+
+Users are made in chunks of vectorized NumPy draws against per-genre book arrays built once, each
+chunk from its own seeded generator, so the output depends only on --seed and --chunk (not on
+--workers). Chunks are streamed to disk as they are made, so millions of users never sit in memory.
+"""
+import argparse
+import multiprocessing
 
-import pandas as pd
 import numpy as np
-import faker
-fake = faker.Faker()
-import random
-import ast
-
-# Fist I load the Database
-book_data = pd.read_csv(r"Cleaned Data/Amazon_books_cleaned.csv")
-
-# Convert to DataFrame and clean
-book_df = pd.DataFrame(book_data)
-book_df = book_df.dropna(axis=1, thresh=len(book_df)*2/3)
-book_df = book_df.dropna(subset=['genre'])
-
-# I need this line to read the genre column as a list
-book_df['genre'] = book_df['genre'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') else x)
-
-# Now I can explode by genre. This way I get a new row for every genre listed per book.
-exploded_df = book_df.explode('genre')
-exploded_df = exploded_df.reset_index(drop=True)
-
-#
-
-##### NOW WE CAN CREATE SOME FAKE PEOPLE ###
-
-
-def random_book(df, genre):
-    """Given a dataframe and a genre, returns: title, ID. """
-    genre_books = df[df["genre"] == genre]
-    if genre_books.empty:
-        return None, None  # In case no books are found for the genre
-    
-    selected_book = genre_books.sample(1).iloc[0]  # Get a random book
-    return selected_book["title"], selected_book["id"]
-
-
-def random_person(df, max_book_amount = 5):
-    """"Given a database that has to have these columns: 'genre', 'id', 'rating', 'book', returns a fake user history data."""
-    #We need to create a list of all unique genres:
-
-    # Creates a set of unique genres
-    unique_genres = set()
-    for genres in book_df['genre']:
-        unique_genres.update(genres)
-
-    
-    # Creates a random list of a person's favorites genres
-    preferences = random.sample(list(unique_genres), random.randint(1,4))
-    
-    # "book_history": [{"book": "Harry Potter", "author": 'J.K. Rowling' ,"genre": "Adventure", "rating": 5}]
-    book_history = []
-    seen_books = set()
-    for i in range(random.randint(1,max_book_amount)):
-        genre = random.choice(preferences) # Chooses one of the favorite genres
-        book_title, book_id= random_book(df, genre) # Returns book title and ID of a book that genre
-        if book_title in seen_books:  # Skip if book is already in history
-            continue      
-        seen_books.add(book_title)
-    
-        extract_rating = float(df.loc[df['id'] == book_id, 'rating'].values[0])
-        rating =max(0, min(np.random.normal(extract_rating, 0.2), 5)) # Returns a rating of the book from a normal dist. centered on the book's rating.
-        author = df.loc[df['id'] == book_id, 'author'].values[0]
-
-        book_history.append({"book": book_title, "author": author,"genre": genre, "rating": round(rating,1), "genre": genre})
-        
-    # One fake user data
-    dictionary ={"name": fake.name(), "age": np.random.randint(12,85), "preferences": preferences, "book_history": book_history}
-    return dictionary
-
-def user_data(n, max_book_amount = 5):
-    """Creates a dataframe of length n."""
-    df =  pd.DataFrame({i: random_person(exploded_df, max_book_amount) for i in range(n)}).T
-    df["ID"] = df.index
-    return df
-
-
-# This creates users and saves them in a file
-users = user_data(500, 100)
-users.to_csv('users.csv')
\ No newline at end of file
+import pandas as pd
+
+import storage
+
+N_USERS = 500
+MAX_BOOKS = 100
+CHUNK_SIZE = 20000
+MAX_PREFERENCES = 4
+RATING_SPREAD = 0.2  # std. dev. of a user's rating around the book's catalog rating
+NAME_POOL = 1000  # first and last names drawn from faker once, then combined at random
+AGES = (12, 85)
+
+
+def name_pool(size=NAME_POOL, seed=0):
+    """First and last names to combine; faker is slow per call, so it's only asked for these once."""
+    import faker
+    fake = faker.Faker()
+    fake.seed_instance(seed)
+    return (np.array([fake.first_name() for _ in range(size)], dtype=object),
+            np.array([fake.last_name() for _ in range(size)], dtype=object))
+
+
+class Catalog:
+    """
+    The cleaned catalog laid out for sampling: the books of every genre as one array with offsets
+    (genre g's books are genre_books[genre_offsets[g]:genre_offsets[g + 1]]), and each book's
+    title, author and rating, with the reprs the history strings need computed once.
+    Books whose rating isn't a number can't be given a simulated rating and are left out.
+    """
+
+    def __init__(self, book_df):
+        rating = pd.to_numeric(book_df["rating"], errors="coerce").to_numpy(np.float64)
+        self.titles = book_df["title"].to_numpy(object)
+        self.authors = book_df["author"].to_numpy(object)
+        self.ratings = rating
+        self.title_codes, _ = pd.factorize(book_df["title"])
+
+        exploded = pd.DataFrame({"book": np.arange(len(book_df)), "genre": book_df["genre"].to_numpy(object)})
+        exploded = exploded.explode("genre")
+        exploded = exploded[exploded["genre"].notna() & np.isfinite(rating[exploded["book"].to_numpy(np.int64)])]
+        genre_codes, genres = pd.factorize(exploded["genre"])
+        self.genres = np.asarray(genres, dtype=object)
+        order = np.argsort(genre_codes, kind="stable")
+        self.genre_books = exploded["book"].to_numpy(np.int64)[order]
+        self.genre_offsets = np.zeros(len(self.genres) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(genre_codes, minlength=len(self.genres)), out=self.genre_offsets[1:])
+
+        # A missing author is written as None: repr(nan) would make the whole history unparseable
+        self.title_reprs = np.array([repr(t) if isinstance(t, str) else "None" for t in self.titles], dtype=object)
+        self.author_reprs = np.array([repr(a) if isinstance(a, str) else "None" for a in self.authors], dtype=object)
+        self.genre_reprs = np.array([repr(g) for g in self.genres], dtype=object)
+        self.rating_reprs = np.array([repr(i / 10) for i in range(51)], dtype=object)
+
+
+def _preferences(rng, n_users, n_genres):
+    """1-4 distinct genre codes per user, as an (n_users, 4) array plus how many of each row count."""
+    counts = rng.integers(1, MAX_PREFERENCES + 1, n_users)
+    prefs = rng.integers(0, n_genres, (n_users, MAX_PREFERENCES))
+    for col in range(1, MAX_PREFERENCES):
+        while True:
+            duplicate = (prefs[:, [col]] == prefs[:, :col]).any(axis=1)
+            if not duplicate.any():
+                break
+            prefs[duplicate, col] = rng.integers(0, n_genres, int(duplicate.sum()))
+    return prefs, counts
+
+
+def _join_rows(pieces, starts, ends):
+    """One string per row from the pieces belonging to it: pieces[starts[i]:ends[i]] joined."""
+    return ["[" + ", ".join(pieces[start:end]) + "]" for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+def generate_chunk(catalog, names, first_user, n_users, max_books=MAX_BOOKS, seed=0):
+    """
+    Users first_user .. first_user + n_users - 1, as the chunk dict storage.stream_users takes.
+    Each user picks 1-4 favourite genres and tries 1..max_books times to read a random book of one
+    of them (repeats are skipped), rating it around the book's own rating.
+    """
+    rng = np.random.default_rng([seed, first_user])
+    prefs, pref_counts = _preferences(rng, n_users, len(catalog.genres))
+
+    # One row per attempt: the user, one of their genres, then a book of that genre
+    attempts = rng.integers(1, max_books + 1, n_users)
+    user = np.repeat(np.arange(n_users), attempts)
+    genre = prefs[user, (rng.random(len(user)) * pref_counts[user]).astype(np.int64)]
+    sizes = catalog.genre_offsets[genre + 1] - catalog.genre_offsets[genre]
+    book = catalog.genre_books[catalog.genre_offsets[genre] + (rng.random(len(user)) * sizes).astype(np.int64)]
+
+    # Keep each user's first attempt at every title, in attempt order
+    _, first = np.unique(user * (catalog.title_codes.max() + 1) + catalog.title_codes[book], return_index=True)
+    first.sort()
+    user, genre, book = user[first], genre[first], book[first]
+    tenths = np.rint(np.clip(rng.normal(catalog.ratings[book], RATING_SPREAD), 0, 5) * 10).astype(np.int64)
+
+    read = np.bincount(user, minlength=n_users)
+    starts = np.concatenate([[0], np.cumsum(read)[:-1]])
+    position = np.arange(len(user)) - starts[user]
+
+    entries = ("{'book': " + catalog.title_reprs[book] + ", 'author': " + catalog.author_reprs[book]
+               + ", 'genre': " + catalog.genre_reprs[genre] + ", 'rating': " + catalog.rating_reprs[tenths] + "}")
+    pref_mask = np.arange(MAX_PREFERENCES) < pref_counts[:, None]
+    pref_genres = prefs[pref_mask]  # row-major, so grouped by user in order
+    pref_starts = np.concatenate([[0], np.cumsum(pref_counts)[:-1]])
+
+    ids = np.arange(first_user, first_user + n_users)
+    first_names, last_names = names
+    users = pd.DataFrame({
+        "Unnamed: 0": ids,
+        "name": first_names[rng.integers(0, len(first_names), n_users)] + " "
+                + last_names[rng.integers(0, len(last_names), n_users)],
+        "age": rng.integers(*AGES, n_users),
+        "preferences": _join_rows(catalog.genre_reprs[pref_genres].tolist(), pref_starts, pref_starts + pref_counts),
+        "book_history": _join_rows(entries.tolist(), starts, starts + read),
+        "ID": ids,
+    })
+    preferences = pd.DataFrame({"user_idx": np.repeat(ids, pref_counts), "genre": catalog.genres[pref_genres]})
+    ratings = pd.DataFrame({"user_idx": ids[user], "position": position, "book": catalog.titles[book],
+                            "author": catalog.authors[book], "genre": catalog.genres[genre],
+                            "rating": tenths / 10})
+    return {"users": users, "preferences": preferences, "ratings": ratings}
+
+
+# Worker processes load the catalog and name pool once, then make chunks on request
+_worker = {}
+
+
+def _init_worker(store_dir, seed):
+    _worker["catalog"] = Catalog(storage.load_books(store_dir))
+    _worker["names"] = name_pool(seed=seed)
+
+
+def _worker_chunk(args):
+    first_user, n_users, max_books, seed = args
+    return generate_chunk(_worker["catalog"], _worker["names"], first_user, n_users, max_books, seed)
+
+
+def generate_chunks(n_users, max_books=MAX_BOOKS, chunk_size=CHUNK_SIZE, workers=1, seed=0,
+                    store_dir=storage.STORE_DIR):
+    """Yield generate_chunk results in user order, made by `workers` processes when more than one."""
+    jobs = [(first, min(chunk_size, n_users - first), max_books, seed) for first in range(0, n_users, chunk_size)]
+    if workers <= 1:
+        _init_worker(store_dir, seed)
+        yield from map(_worker_chunk, jobs)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(store_dir, seed)) as pool:
+        # imap keeps chunk order, so the files come out the same whatever the worker count
+        yield from pool.imap(_worker_chunk, jobs)
+
+
+def user_data(n, max_book_amount=5, seed=0):
+    """Creates a DataFrame of n users, laid out like users.csv."""
+    chunks = list(generate_chunks(n, max_book_amount, seed=seed))
+    return pd.concat([chunk["users"] for chunk in chunks]).set_index("Unnamed: 0").rename_axis(None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate fake users into users.csv and the columnar store.")
+    parser.add_argument("n_users", type=int, nargs="?", default=N_USERS)
+    parser.add_argument("--max-books", type=int, default=MAX_BOOKS, help="most books one user tries to read")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="users per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="processes generating chunks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=storage.USERS_FILE)
+    parser.add_argument("--store", default=storage.STORE_DIR)
+    args = parser.parse_args()
+
+    # Import the catalog (and whatever users file is there now) before users.csv is replaced
+    storage.ensure_store(store_dir=args.store)
+    storage.stream_users(generate_chunks(args.n_users, args.max_books, args.chunk, args.workers, args.seed, args.store),
+                         users_file=args.output, store_dir=args.store)
+    print(f"Wrote {args.n_users} users to {args.output} and {args.store}/")
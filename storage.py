@@ -0,0 +1,723 @@
+import ast
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = "biblio_store"
+USERS_FILE = "users.csv"
+BOOKS_FILE = "Amazon_books_cleaned.csv"
+CHUNK_ROWS = 50000  # catalog rows read per chunk on import
+
+###############################################################################
+# COLUMNS AND TABLES: one .npy file per column, strings dictionary-encoded
+###############################################################################
+
+def save_strings(path, strings):
+    """Write a list of strings as one UTF-8 byte blob plus offsets (path.blob.npy / path.offsets.npy)."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(path + ".blob.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(path + ".offsets.npy", offsets)
+
+def load_strings(path):
+    """Read back a list written by save_strings."""
+    blob = np.load(path + ".blob.npy").tobytes()
+    offsets = np.load(path + ".offsets.npy").tolist()
+    return [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+class StringTable:
+    """
+    Read-only, memory-mapped view of a string list written by save_strings.
+    Strings are decoded one at a time on access, so processes sharing the files don't each hold a copy.
+    """
+
+    def __init__(self, path):
+        self.blob = np.load(path + ".blob.npy", mmap_mode='r')
+        self.offsets = np.load(path + ".offsets.npy", mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+class StringColumn:
+    """Memory-mapped dictionary-encoded string column: value i is table[codes[i]] (None where codes[i] == -1)."""
+
+    def __init__(self, codes, table):
+        self.codes = codes
+        self.table = table
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        return None if code < 0 else self.table[code]
+
+def _empty_dir(path):
+    """
+    Create path as an empty directory, removing what was there. Tables are rewritten this way, never
+    file by file in place, since a staged store's files may be hard links into the live one (see _replacing).
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def save_table(table_dir, df):
+    """
+    Save a DataFrame column by column. Numeric columns are stored as-is; anything else is
+    dictionary-encoded as int32 codes (-1 = missing) plus a string table of the distinct values.
+    The schema records each column's non-null count, so sparse columns can be pruned unread.
+    """
+    _empty_dir(table_dir)
+    schema = {}
+    for i, column in enumerate(df.columns):
+        path = os.path.join(table_dir, f"c{i}")
+        values = df[column]
+        non_null = int(values.notna().sum())
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            np.save(path + ".npy", values.to_numpy())
+            schema[column] = {"file": f"c{i}", "kind": "numeric", "non_null": non_null}
+        else:
+            codes, categories = pd.factorize(values)
+            np.save(path + ".codes.npy", codes.astype(np.int32))
+            save_strings(path, [str(c) for c in categories])
+            schema[column] = {"file": f"c{i}", "kind": "strings", "non_null": non_null}
+    with open(os.path.join(table_dir, "schema.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": len(df), "columns": schema}, f, ensure_ascii=False)
+
+class _StringDictionary:
+    """
+    The distinct strings of a column being written, without keeping them in memory: each is known by
+    a 128-bit digest, kept sorted in a NumPy array beside its code, and its bytes go straight to disk.
+    About 24 bytes per distinct string, however long the strings are.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = np.zeros(0, dtype="S16")
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.lengths = []
+        self.size = 0
+        self.blob = open(path + ".blob.raw", "wb")
+
+    def encode(self, strings):
+        """Codes for a list of distinct strings; the ones not seen before get the next codes."""
+        encoded = [s.encode("utf-8") for s in strings]
+        digests = np.array([hashlib.blake2b(b, digest_size=16).digest() for b in encoded], dtype="S16")
+        positions = np.searchsorted(self.keys, digests)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == digests[found]
+
+        codes = np.empty(len(encoded), dtype=np.int32)
+        codes[found] = self.codes[positions[found]]
+        new = np.flatnonzero(~found)
+        codes[new] = np.arange(self.size, self.size + len(new))
+        self.blob.write(b"".join(encoded[i] for i in new))
+        self.lengths.append(np.array([len(encoded[i]) for i in new], dtype=np.int64))
+        self.size += len(new)
+
+        order = new[np.argsort(digests[new], kind="stable")]
+        at = np.searchsorted(self.keys, digests[order])
+        self.keys = np.insert(self.keys, at, digests[order])
+        self.codes = np.insert(self.codes, at, codes[order])
+        return codes
+
+    def close(self):
+        """Write path.blob.npy / path.offsets.npy, as save_strings does."""
+        self.blob.close()
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(self.lengths) if self.lengths else [], out=offsets[1:])
+        blob = np.memmap(self.path + ".blob.raw", dtype=np.uint8, mode='r') if offsets[-1] else np.zeros(0, np.uint8)
+        np.save(self.path + ".blob.npy", blob)
+        del blob
+        np.save(self.path + ".offsets.npy", offsets)
+        os.remove(self.path + ".blob.raw")
+
+class TableWriter:
+    """
+    Write a table in save_table's layout a chunk of rows at a time, for tables too big to build as one
+    DataFrame. Numeric columns are appended to raw files and string columns are dictionary-encoded as
+    they arrive (distinct strings go to disk too); close() converts the raw files to .npy and writes
+    the schema. Memory is bounded by the chunk plus a few bytes per distinct string.
+    """
+
+    def __init__(self, table_dir, columns):
+        _empty_dir(table_dir)
+        self.table_dir = table_dir
+        self.columns = list(columns)
+        self.rows = 0
+        self.non_null = dict.fromkeys(self.columns, 0)
+        self._kinds, self._dtypes, self._files = {}, {}, {}
+        self._dictionaries = {}
+
+    def _path(self, column):
+        return os.path.join(self.table_dir, f"c{self.columns.index(column)}")
+
+    def append(self, df):
+        for column in self.columns:
+            values = df[column]
+            if column not in self._kinds:
+                numeric = pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)
+                self._kinds[column] = "numeric" if numeric else "strings"
+                self._dtypes[column] = values.to_numpy().dtype if numeric else np.dtype(np.int32)
+                self._files[column] = open(self._path(column) + ".raw", "wb")
+                if not numeric:
+                    self._dictionaries[column] = _StringDictionary(self._path(column))
+            if self._kinds[column] == "numeric":
+                data = values.to_numpy().astype(self._dtypes[column], copy=False)
+            else:
+                # Factorize the chunk, then map its few distinct values onto the table-wide codes
+                codes, uniques = pd.factorize(values)
+                mapping = np.append(self._dictionaries[column].encode([str(u) for u in uniques]), np.int32(-1))
+                data = mapping[codes]
+            self._files[column].write(np.ascontiguousarray(data).tobytes())
+            self.non_null[column] += int(values.notna().sum())
+        self.rows += len(df)
+
+    def close(self):
+        schema = {}
+        for column in self.columns:
+            path = self._path(column)
+            kind = self._kinds.get(column, "numeric")
+            dtype = self._dtypes.get(column, np.dtype(np.float64))
+            target = path + (".npy" if kind == "numeric" else ".codes.npy")
+            if column in self._files:
+                self._files[column].close()
+                data = np.memmap(path + ".raw", dtype=dtype, mode='r') if self.rows else np.zeros(0, dtype)
+                np.save(target, data)
+                del data
+                os.remove(path + ".raw")
+            else:
+                np.save(target, np.zeros(0, dtype))
+            if kind == "strings":
+                self._dictionaries[column].close()
+            schema[column] = {"file": f"c{self.columns.index(column)}", "kind": kind,
+                              "non_null": self.non_null[column]}
+        with open(os.path.join(self.table_dir, "schema.json"), "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "columns": schema}, f, ensure_ascii=False)
+
+def table_schema(table_dir):
+    with open(os.path.join(table_dir, "schema.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def load_column(table_dir, column, mmap_mode=None, decode=True):
+    """
+    Load one column. String columns come back as a pandas Categorical-backed object array,
+    or as (codes, categories) when decode is False.
+    """
+    info = table_schema(table_dir)["columns"][column]
+    path = os.path.join(table_dir, info["file"])
+    if info["kind"] == "numeric":
+        return np.load(path + ".npy", mmap_mode=mmap_mode)
+    codes = np.load(path + ".codes.npy", mmap_mode=mmap_mode)
+    categories = load_strings(path)
+    if not decode:
+        return codes, categories
+    return pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object)).astype(object)
+
+def open_columns(table_dir, columns=None):
+    """
+    Open a table read-only without copying it into this process: numeric columns as memory-mapped
+    arrays, string columns as StringColumn views. Meant for worker processes sharing one copy.
+    """
+    schema = table_schema(table_dir)["columns"]
+    opened = {}
+    for column in (list(schema) if columns is None else columns):
+        path = os.path.join(table_dir, schema[column]["file"])
+        if schema[column]["kind"] == "numeric":
+            opened[column] = np.load(path + ".npy", mmap_mode='r')
+        else:
+            opened[column] = StringColumn(np.load(path + ".codes.npy", mmap_mode='r'), StringTable(path))
+    return opened
+
+def load_table(table_dir, columns=None, mmap_mode=None):
+    """Load a table saved with save_table (all columns, or just the requested ones)."""
+    schema = table_schema(table_dir)
+    columns = list(schema["columns"]) if columns is None else columns
+    return pd.DataFrame({c: load_column(table_dir, c, mmap_mode) for c in columns})
+
+###############################################################################
+# IMPORT: users.csv + Amazon_books_cleaned.csv -> normalized tables
+###############################################################################
+
+def _parse_list(value):
+    """Parse a Python-repr list cell; None if it is missing or malformed."""
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+def parse_genre_list(text):
+    """
+    Parse a list-of-strings cell such as ['Fiction', "Children's Books"] without ast, by splitting on
+    the quotes directly. Cells it can't take apart that way (escapes, non-string items) go through
+    literal_eval; None if the cell isn't a list at all.
+    """
+    if not (text.startswith('[') and text.endswith(']')):
+        return _parse_list(text)
+    body, items, i = text[1:-1], [], 0
+    n = len(body)
+    while i < n and body[i] == ' ':
+        i += 1
+    while i < n:
+        quote = body[i]
+        end = body.find(quote, i + 1) if quote in ("'", '"') else -1
+        if end < 0 or '\\' in body[i + 1:end]:
+            return _parse_list(text)
+        items.append(body[i + 1:end])
+        i = end + 1
+        while i < n and body[i] == ' ':
+            i += 1
+        if i < n:
+            if body[i] != ',':
+                return _parse_list(text)
+            i += 1
+            while i < n and body[i] == ' ':
+                i += 1
+    return items
+
+def _file_stamp(file_path):
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _csv_dtypes(file_path, chunk_size=CHUNK_ROWS):
+    """
+    First pass over a CSV, one chunk at a time: the dtype pandas would infer for each column when reading
+    the whole file (int64 only if every chunk is integer, float64 if every chunk is numeric, else str).
+    """
+    kinds = {}
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        for column, dtype in chunk.dtypes.items():
+            kind = ("bool" if pd.api.types.is_bool_dtype(dtype) else "int" if pd.api.types.is_integer_dtype(dtype)
+                    else "float" if pd.api.types.is_numeric_dtype(dtype) else "str")
+            previous = kinds.get(column, kind)
+            kinds[column] = kind if previous == kind else "float" if {previous, kind} <= {"int", "float"} else "str"
+    types = {"bool": bool, "int": np.int64, "float": np.float64, "str": str}
+    return {column: types[kind] for column, kind in kinds.items()}
+
+def import_books(books_file=BOOKS_FILE, store_dir=STORE_DIR, chunk_size=CHUNK_ROWS):
+    """
+    Convert the catalog into: books (catalog columns without genre), genres (names)
+    and book_genres (book_idx, genre_idx). This and import_users are the only places literal_eval runs.
+    The file is streamed in chunks of chunk_size rows (one pass to settle column types, one to write),
+    so memory stays bounded by the chunk plus the distinct strings, whatever the catalog size.
+    """
+    with _replacing(store_dir) as tmp_dir:
+        _import_books(books_file, tmp_dir, chunk_size)
+
+def _import_books(books_file, store_dir, chunk_size=CHUNK_ROWS):
+    stamp = _file_stamp(books_file)
+    dtypes = _csv_dtypes(books_file, chunk_size)
+    books_writer = None
+    book_genres = TableWriter(os.path.join(store_dir, "book_genres"), ["book_idx", "genre_idx"])
+    genre_codes = {}
+    first_row = 0
+    for book_data in pd.read_csv(books_file, chunksize=chunk_size, dtype=dtypes):
+        genre_lists = [parse_genre_list(g) if isinstance(g, str) and g.startswith('[') else g for g in book_data["genre"]]
+        pairs = [(first_row + i, genre_codes.setdefault(g, len(genre_codes))) for i, genres in enumerate(genre_lists)
+                 for g in (genres if isinstance(genres, list) else [genres] if isinstance(genres, str) else [])]
+
+        books = book_data.drop(columns=["genre"])
+        books["genre_missing"] = book_data["genre"].isna().to_numpy()
+        # Keep the raw genre cell only where it couldn't be parsed into a list, so export is lossless
+        books["genre_raw"] = pd.Series([raw if isinstance(raw, str) and not isinstance(parsed, list) else None
+                                        for raw, parsed in zip(book_data["genre"], genre_lists)],
+                                       index=books.index, dtype=object)
+        if books_writer is None:
+            books_writer = TableWriter(os.path.join(store_dir, "books"), books.columns)
+        books_writer.append(books)
+        book_genres.append(pd.DataFrame({"book_idx": np.array([i for i, _ in pairs], dtype=np.int32),
+                                         "genre_idx": np.array([g for _, g in pairs], dtype=np.int32)}))
+        first_row += len(book_data)
+
+    books_writer.close()
+    book_genres.close()
+    save_table(os.path.join(store_dir, "genres"), pd.DataFrame({"genre": pd.Series(list(genre_codes), dtype=object)}))
+    _write_stamps(store_dir, books=stamp)
+
+def import_users(users_file=USERS_FILE, store_dir=STORE_DIR):
+    """
+    Convert users.csv into: users (user columns without the list cells), preferences (user_idx, genre)
+    and ratings (user_idx, book_idx, rating, plus the position/title/author/genre recorded in the history).
+    book_idx is the first catalog row with that title, or -1; the catalog must be imported first.
+    """
+    with _replacing(store_dir) as tmp_dir:
+        _import_users(users_file, tmp_dir)
+
+def _import_users(users_file, store_dir):
+    stamp = _file_stamp(users_file)
+    with open(users_file, "rb") as f:
+        data = f.read()
+    users, preferences, ratings = _user_tables(pd.read_csv(io.BytesIO(data)), _title_to_book(store_dir))
+    save_table(os.path.join(store_dir, "users"), users)
+    save_table(os.path.join(store_dir, "preferences"), preferences)
+    save_table(os.path.join(store_dir, "ratings"), ratings)
+    _write_stamps(store_dir, users=stamp, users_prefix=[len(data), _digest(data)])
+
+def _append_users(users_file, store_dir, prefix):
+    """
+    Import only the rows appended to users_file since it was imported, if that is all that changed:
+    its first prefix[0] bytes must still hash to prefix[1]. False (nothing written) when they don't,
+    e.g. after rating_log.compact rewrote the histories, and the whole file has to be re-imported.
+    """
+    if prefix is None:
+        return False
+    stamp = _file_stamp(users_file)
+    with open(users_file, "rb") as f:
+        header = f.readline()
+        f.seek(0)
+        old = f.read(prefix[0])
+        if len(old) != prefix[0] or not old.endswith(b"\n") or _digest(old) != prefix[1]:
+            return False
+        tail = f.read()
+
+    if tail.strip():
+        users_dir = os.path.join(store_dir, "users")
+        user_df = pd.read_csv(io.BytesIO(header + tail))
+        tables = _user_tables(user_df, _title_to_book(store_dir), first_user=table_schema(users_dir)["rows"])
+        staged = []
+        for name, df in zip(("users", "preferences", "ratings"), tables):
+            columns = _appended_columns(os.path.join(store_dir, name), df)
+            if columns is None:
+                return False
+            staged.append((name, columns))
+        for name, columns in staged:
+            _save_columns(os.path.join(store_dir, name), *columns)
+    _write_stamps(store_dir, users=stamp, users_prefix=[len(old) + len(tail), _digest(old + tail)])
+    return True
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _title_to_book(store_dir):
+    """The first catalog row of every title."""
+    titles = load_column(os.path.join(store_dir, "books"), "title")
+    title_to_book = pd.Series(np.arange(len(titles)), index=titles)
+    return title_to_book[~title_to_book.index.duplicated()]
+
+def _user_tables(user_df, title_to_book, first_user=0):
+    """The users, preferences and ratings tables of users.csv rows, the first of them user_idx first_user."""
+    preference_rows, rating_rows, raw_histories = [], [], []
+    for user_idx, (prefs, history) in enumerate(zip(user_df["preferences"], user_df["book_history"]), first_user):
+        for pref in _parse_list(prefs) or []:
+            preference_rows.append((user_idx, pref))
+        parsed = _parse_list(history)
+        raw_histories.append(history if parsed is None and isinstance(history, str) else None)
+        for position, entry in enumerate(parsed or []):
+            if isinstance(entry, dict) and "book" in entry and "rating" in entry:
+                rating_rows.append((user_idx, position, entry["book"], entry.get("author"),
+                                    entry.get("genre"), entry["rating"]))
+
+    users = user_df.drop(columns=["preferences", "book_history"])
+    users["book_history_raw"] = raw_histories
+    preferences = pd.DataFrame(preference_rows, columns=["user_idx", "genre"])
+    ratings = pd.DataFrame(rating_rows, columns=["user_idx", "position", "book", "author", "genre", "rating"])
+    ratings["rating"] = pd.to_numeric(ratings["rating"], errors="coerce").astype(np.float64)
+    ratings.insert(1, "book_idx", title_to_book.reindex(ratings["book"]).fillna(-1).to_numpy(np.int64))
+    return users, preferences, ratings
+
+def _appended_columns(table_dir, df):
+    """
+    (rows, {column: (kind, values or (codes, categories), non_null)}) of a saved table with df's rows
+    appended, new strings getting the next codes; None if df's columns don't fit the table's.
+    """
+    schema = table_schema(table_dir)
+    if list(df.columns) != list(schema["columns"]):
+        return None
+    columns = {}
+    for column, info in schema["columns"].items():
+        values = df[column]
+        non_null = info["non_null"] + int(values.notna().sum())
+        if info["kind"] == "numeric":
+            if len(values) and not (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)):
+                return None
+            data = load_column(table_dir, column)
+            columns[column] = ("numeric", np.concatenate([data, values.to_numpy()]) if len(values) else data, non_null)
+        else:
+            codes, categories = load_column(table_dir, column, decode=False)
+            code_of = {category: code for code, category in enumerate(categories)}
+            new_codes = [code_of.setdefault(str(value), len(code_of)) if pd.notna(value) else -1
+                         for value in values.astype(object)]
+            columns[column] = ("strings", (np.concatenate([codes, np.array(new_codes, dtype=np.int32)]),
+                                           list(code_of)), non_null)
+    return schema["rows"] + len(df), columns
+
+def _save_columns(table_dir, rows, columns):
+    """Write columns as _appended_columns returns them in save_table's layout, replacing the table."""
+    _empty_dir(table_dir)
+    schema = {}
+    for i, (column, (kind, values, non_null)) in enumerate(columns.items()):
+        path = os.path.join(table_dir, f"c{i}")
+        if kind == "numeric":
+            np.save(path + ".npy", values)
+        else:
+            np.save(path + ".codes.npy", values[0])
+            save_strings(path, values[1])
+        schema[column] = {"file": f"c{i}", "kind": kind, "non_null": non_null}
+    with open(os.path.join(table_dir, "schema.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": rows, "columns": schema}, f, ensure_ascii=False)
+
+def stream_users(chunks, users_file=USERS_FILE, store_dir=STORE_DIR):
+    """
+    Write users.csv and its tables (as import_users would make them) from an iterable of chunks, so
+    generated populations never have to fit in memory. Each chunk is a dict of three DataFrames:
+    "users" (the CSV columns, list cells already as text), "preferences" (user_idx, genre) and
+    "ratings" (user_idx, position, book, author, genre, rating), with user_idx counted across chunks.
+    The catalog must be imported first. The CSV and the store are written next to users_file and
+    store_dir and swapped in at the end.
+    """
+    title_to_book = _title_to_book(store_dir)
+    with _replacing(store_dir) as tmp_dir:
+        tables = {name: None for name in ("users", "preferences", "ratings")}
+        with open(users_file + ".tmp", "w", newline="", encoding="utf-8") as f:
+            for chunk in chunks:
+                users = chunk["users"]
+                users.to_csv(f, header=tables["users"] is None and _csv_header(users.columns), index=False)
+                users = users.drop(columns=["preferences", "book_history"])
+                users["book_history_raw"] = pd.Series([None] * len(users), index=users.index, dtype=object)
+                ratings = chunk["ratings"].astype({"rating": np.float64})
+                ratings.insert(1, "book_idx", title_to_book.reindex(ratings["book"]).fillna(-1).to_numpy(np.int64))
+
+                for name, df in (("users", users), ("preferences", chunk["preferences"]), ("ratings", ratings)):
+                    if tables[name] is None:
+                        tables[name] = TableWriter(os.path.join(tmp_dir, name), df.columns)
+                    tables[name].append(df)
+        for writer in tables.values():
+            if writer is not None:
+                writer.close()
+        os.replace(users_file + ".tmp", users_file)
+        # No prefix digest: a later change to this file re-imports it whole
+        _write_stamps(tmp_dir, users=_file_stamp(users_file), users_prefix=None)
+
+def import_csv(users_file=USERS_FILE, books_file=BOOKS_FILE, store_dir=STORE_DIR):
+    """Convert both CSVs into the columnar store."""
+    with _replacing(store_dir) as tmp_dir:
+        _import_books(books_file, tmp_dir)
+        _import_users(users_file, tmp_dir)
+
+@contextlib.contextmanager
+def _replacing(store_dir):
+    """
+    A staging copy of store_dir to import into, swapped into place once the import succeeds, as
+    ratings_store.RatingsStore.save swaps its directory: readers never see a half-written table, and
+    processes that have the old files mapped keep reading them. Files are hard-linked, not copied, so
+    tables the import leaves alone cost nothing; writers replace files rather than rewrite them.
+    """
+    tmp_dir, old_dir = store_dir + ".tmp", store_dir + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    if os.path.isdir(store_dir):
+        shutil.copytree(store_dir, tmp_dir, copy_function=_link_or_copy)
+    else:
+        os.makedirs(tmp_dir)
+    try:
+        yield tmp_dir
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def _read_stamps(store_dir):
+    sources = os.path.join(store_dir, "sources.json")
+    if not os.path.isfile(sources):
+        return {}
+    with open(sources, encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_stamps(store_dir, **stamps):
+    merged = _read_stamps(store_dir)
+    merged.update(stamps)
+    sources = os.path.join(store_dir, "sources.json")
+    with open(sources + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(merged, f)
+    os.replace(sources + ".tmp", sources)
+
+def ensure_store(users_file=USERS_FILE, books_file=BOOKS_FILE, store_dir=STORE_DIR):
+    """
+    Re-import whatever CSV changed since it was last imported (the catalog change also re-imports users,
+    whose book_idx depends on it). Users appended to users_file are imported on their own; any other
+    change re-imports the file. A store whose CSVs are absent is used as it is.
+    """
+    stamps = _read_stamps(store_dir)
+    books_stale = os.path.isfile(books_file) and stamps.get("books") != _file_stamp(books_file)
+    users_stale = os.path.isfile(users_file) and stamps.get("users") != _file_stamp(users_file)
+    if books_stale or users_stale:
+        with _replacing(store_dir) as tmp_dir:
+            if books_stale:
+                _import_books(books_file, tmp_dir)
+            if books_stale or not _append_users(users_file, tmp_dir, stamps.get("users_prefix")):
+                _import_users(users_file, tmp_dir)
+    return store_dir
+
+###############################################################################
+# READERS: what the engine, the CLI and the simulator load
+###############################################################################
+# Each reader first brings store_dir up to date with users_file and the catalog (see ensure_store),
+# so a store imported from another users file must be read with that file.
+
+def _table(name, store_dir, users_file=USERS_FILE):
+    return os.path.join(ensure_store(users_file=users_file, store_dir=store_dir), name)
+
+def open_books(store_dir=STORE_DIR, columns=None, users_file=USERS_FILE):
+    """Catalog columns opened read-only via memory maps (see open_columns)."""
+    return open_columns(_table("books", store_dir, users_file), columns)
+
+def book_genre_lists(store_dir=STORE_DIR, users_file=USERS_FILE):
+    """List of genres for every catalog row, rebuilt from the (book_idx, genre_idx) table."""
+    n_books = table_schema(_table("books", store_dir, users_file))["rows"]
+    genres = np.array(load_column(_table("genres", store_dir, users_file), "genre"), dtype=object)
+    book_idx = load_column(_table("book_genres", store_dir, users_file), "book_idx")
+    genre_idx = load_column(_table("book_genres", store_dir, users_file), "genre_idx")
+
+    order = np.argsort(book_idx, kind="stable")
+    bounds = np.searchsorted(book_idx[order], np.arange(n_books + 1))
+    names = genres[genre_idx[order]]
+    return [names[bounds[i]:bounds[i + 1]].tolist() for i in range(n_books)]
+
+def load_books(store_dir=STORE_DIR, clean=True, users_file=USERS_FILE):
+    """
+    The catalog as a DataFrame with genre lists. With clean=True the result matches clean_book_df:
+    columns less than 2/3 filled are dropped, and so are books without a genre.
+    """
+    books_dir = _table("books", store_dir, users_file)
+    columns = None
+    if clean:
+        # Prune sparse columns from the non-null counts in the schema, without reading them
+        schema = table_schema(books_dir)
+        info = schema["columns"]
+        if all("non_null" in c for c in info.values()):
+            non_null = {c: v["non_null"] for c, v in info.items() if c not in ("genre_missing", "genre_raw")}
+            non_null["genre"] = schema["rows"] - int(np.count_nonzero(load_column(books_dir, "genre_missing")))
+            keep = {c for c, count in non_null.items() if count >= schema["rows"] * 2 / 3}
+            columns = [c for c in info if c in keep or c in ("genre_missing", "genre_raw")]
+    books = load_table(books_dir, columns)
+    genre_missing = books.pop("genre_missing").to_numpy(bool)
+    genre_raw = books.pop("genre_raw")
+    genre = pd.Series(book_genre_lists(store_dir, users_file), index=books.index, dtype=object)
+    # Unparseable genre cells were kept as text, as clean_book_df leaves them
+    genre[genre_raw.notna()] = genre_raw[genre_raw.notna()]
+    genre[genre_missing] = np.nan
+    books.insert(books.columns.get_loc("reviews_count") + 1 if "reviews_count" in books else len(books.columns),
+                 "genre", genre)
+    if clean:
+        books = books.dropna(axis=1, thresh=len(books) * 2 / 3)
+        books = books[~genre_missing]
+    return books
+
+def load_ratings(store_dir=STORE_DIR, log_file=None, users_file=USERS_FILE):
+    """
+    Flat (user_id, book, rating) table in the shape user_book_rating_df returns,
+    plus any ratings still waiting in the rating log.
+    """
+    from rating_log import LOG_FILE, read_events
+    users_dir = _table("users", store_dir, users_file)
+    ratings = load_table(_table("ratings", store_dir, users_file), ["user_idx", "book", "rating"])
+    ids = load_column(users_dir, "ID")
+    ratings = pd.DataFrame({"user_id": ids[ratings["user_idx"].to_numpy()],
+                            "book": ratings["book"], "rating": ratings["rating"]})
+
+    events = read_events(LOG_FILE if log_file is None else log_file)
+    if events:
+        logged = pd.DataFrame(events)[["user_id", "book", "rating"]]
+        logged["user_id"] = pd.to_numeric(logged["user_id"], errors="coerce")
+        ratings = pd.concat([ratings, logged.dropna(subset=["user_id"]).astype({"user_id": ids.dtype})],
+                            ignore_index=True)
+    return ratings
+
+def load_users(store_dir=STORE_DIR, log_file=None, users_file=USERS_FILE):
+    """
+    Users as a DataFrame laid out like users.csv, but with preferences and book_history
+    already as Python lists (logged ratings included), so no consumer has to literal_eval them.
+    """
+    from rating_log import LOG_FILE, events_by_user, history_entry, read_events
+    users = load_table(_table("users", store_dir, users_file))
+    raw_histories = users.pop("book_history_raw")
+    n_users = len(users)
+
+    preferences = [[] for _ in range(n_users)]
+    prefs = load_table(_table("preferences", store_dir, users_file))
+    for user_idx, genre in zip(prefs["user_idx"].tolist(), prefs["genre"]):
+        preferences[user_idx].append(genre)
+
+    histories = [[] for _ in range(n_users)]
+    ratings = load_table(_table("ratings", store_dir, users_file), ["user_idx", "book", "author", "genre", "rating"])
+    for user_idx, book, author, genre, rating in zip(ratings["user_idx"].tolist(), ratings["book"],
+                                                    ratings["author"], ratings["genre"], ratings["rating"].tolist()):
+        histories[user_idx].append({"book": book, "author": author, "genre": genre, "rating": rating})
+    for user_idx, raw in enumerate(raw_histories):
+        if isinstance(raw, str):
+            histories[user_idx] = raw  # unparseable in the CSV too; consumers already handle that
+
+    logged = events_by_user(read_events(LOG_FILE if log_file is None else log_file))
+    if logged:
+        for user_idx, user_id in enumerate(users["ID"].astype(str)):
+            if user_id in logged and isinstance(histories[user_idx], list):
+                histories[user_idx].extend(history_entry(e) for e in logged[user_id])
+
+    users.insert(len(users.columns) - 1 if "ID" in users else len(users.columns), "preferences", preferences)
+    users.insert(len(users.columns) - 1 if "ID" in users else len(users.columns), "book_history", histories)
+    return users
+
+###############################################################################
+# EXPORT: columnar store -> CSV
+###############################################################################
+
+def _csv_header(columns):
+    """pandas names blank CSV headers 'Unnamed: N'; write them blank again."""
+    return ["" if str(c).startswith("Unnamed: ") else c for c in columns]
+
+def export_csv(store_dir=STORE_DIR, users_file=USERS_FILE, books_file=BOOKS_FILE):
+    """Write the store back out as CSV files with the original layout."""
+    books = load_books(store_dir, clean=False)
+    genre_raw = load_column(os.path.join(store_dir, "books"), "genre_raw")
+    books["genre"] = [raw if isinstance(raw, str) else (str(g) if isinstance(g, list) else g)
+                      for raw, g in zip(genre_raw, books["genre"])]
+    books.columns = _csv_header(books.columns)
+    books.to_csv(books_file, index=False)
+
+    users = load_users(store_dir, log_file=os.devnull)
+    users["preferences"] = users["preferences"].apply(str)
+    users["book_history"] = users["book_history"].apply(lambda h: h if isinstance(h, str) else str(h))
+    users.columns = _csv_header(users.columns)
+    users.to_csv(users_file, index=False)
+
+
+if __name__ == "__main__":
+    # python storage.py import | export
+    command = sys.argv[1] if len(sys.argv) > 1 else "import"
+    if command == "import":
+        import_csv()
+        print(f"Imported {USERS_FILE} and {BOOKS_FILE} into {STORE_DIR}/")
+    elif command == "export":
+        export_csv()
+        print(f"Exported {STORE_DIR}/ to {USERS_FILE} and {BOOKS_FILE}")
+    else:
+        print("Usage: python storage.py [import|export]")
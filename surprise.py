@@ -0,0 +1,186 @@
+import numpy as np
+
+WEIGHTINGS = ("uniform", "rating", "reviews", "unexplored")
+MERGE_EVERY = 256  # books appended to an alias table are kept apart until there are this many
+_VECTOR_ROUND = 1024  # pairs per round below which the alias table is finished in plain Python
+UNEXPLORED_CACHE = 1024  # unexplored-genre tables kept, one per distinct set of explored genres
+
+
+def _alias_table(weights):
+    """
+    Vose's alias method: (prob, alias) such that picking a column i uniformly, then keeping i with
+    probability prob[i] and taking alias[i] otherwise, draws i with probability weights[i] / sum.
+    Columns are paired a whole batch at a time while there are many to pair.
+    """
+    n = len(weights)
+    prob, alias = np.ones(n), np.arange(n)
+    total = float(np.sum(weights)) if n else 0.0
+    if total <= 0:
+        return prob, alias
+    scaled = np.asarray(weights, dtype=np.float64) * (n / total)
+    small, large = np.flatnonzero(scaled < 1), np.flatnonzero(scaled >= 1)
+    while min(len(small), len(large)) >= _VECTOR_ROUND:
+        k = min(len(small), len(large))
+        s, l = small[:k], large[:k]
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1 - scaled[s]
+        drained = scaled[l] < 1
+        small = np.concatenate([small[k:], l[drained]])
+        large = np.concatenate([l[~drained], large[k:]])
+
+    small, large, values = small.tolist(), large.tolist(), scaled.tolist()
+    prob_list, alias_list = prob.tolist(), alias.tolist()
+    while small and large:
+        s, l = small.pop(), large[-1]
+        prob_list[s], alias_list[s] = values[s], l
+        values[l] -= 1 - values[s]
+        if values[l] < 1:
+            small.append(large.pop())
+    # Whatever is left over is 1 up to rounding
+    return np.array(prob_list), np.array(alias_list, dtype=np.int64)
+
+
+class AliasTable:
+    """
+    Weighted sampler over a fixed set of items with O(1) draws (alias method). Items appended
+    later go to a second, small table rebuilt on each append, chosen in proportion to its total
+    weight; once it holds MERGE_EVERY items both are merged and the main table rebuilt.
+    """
+
+    def __init__(self, items, weights):
+        self.items = np.asarray(items, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.total = float(self.weights.sum())
+        self.prob, self.alias = _alias_table(self.weights)
+        self.extra = None  # AliasTable of the items appended since the last merge
+
+    def __len__(self):
+        return len(self.items) + (len(self.extra) if self.extra is not None else 0)
+
+    def append(self, item, weight):
+        if self.extra is not None and len(self.extra) + 1 >= MERGE_EVERY:
+            self.__init__(np.concatenate([self.items, self.extra.items, [item]]),
+                          np.concatenate([self.weights, self.extra.weights, [weight]]))
+            return
+        items, weights = ([item], [weight]) if self.extra is None else \
+            (np.append(self.extra.items, item), np.append(self.extra.weights, weight))
+        self.extra = AliasTable(items, weights)
+
+    def weight(self):
+        return self.total + (self.extra.total if self.extra is not None else 0.0)
+
+    def draw(self, rng):
+        """One item, or -1 if every weight is zero."""
+        if self.extra is not None and rng.random() * self.weight() >= self.total:
+            return self.extra.draw(rng)
+        if self.total <= 0:
+            return -1
+        column = int(rng.integers(len(self.items)))
+        return int(self.items[column if rng.random() < self.prob[column] else self.alias[column]])
+
+
+class SurpriseSampler:
+    """
+    Random catalog books for "Surprise me", over Vocabulary book IDs. Each weighting has its alias
+    table, built on first use; "unexplored" picks a genre the user hasn't read or asked for
+    (in proportion to its books' ratings), then a book in it from that genre's table. Draws are
+    O(1); books the user has read are rejected and redrawn. add_book appends to the tables in place.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.vocabulary = metadata.vocabulary
+        self._tables = {}  # weighting -> AliasTable over every catalog book
+        self._genre_tables = {}  # genre ID -> AliasTable of its books, rating-weighted
+        self._genre_weights = None  # total rating weight per genre ID
+        self._unexplored_tables = {}  # frozenset of explored genre IDs -> AliasTable of the other genres
+        self._mean_rating = None  # stands in for missing ratings
+
+    def weights(self, book_ids, weighting):
+        """Weight of each book: 1, its rating (the mean rating if unknown) or 1 + log(1 + review count)."""
+        if weighting == "uniform":
+            return np.ones(len(book_ids))
+        if weighting in ("rating", "unexplored"):
+            ratings = self.vocabulary.book_rating
+            if self._mean_rating is None:
+                known = ratings[self.vocabulary.in_catalog]
+                self._mean_rating = float(np.nanmean(known)) if np.isfinite(known).any() else 1.0
+            return np.nan_to_num(ratings[np.asarray(book_ids, dtype=np.int64)], nan=self._mean_rating).clip(0)
+        if weighting == "reviews":
+            column = self.metadata.columns["reviews_count"]
+            counts = np.array([column[i] if i < len(column) and column[i] is not None else 0
+                               for i in np.asarray(book_ids, dtype=np.int64).tolist()], dtype=np.float64)
+            return 1 + np.log1p(counts.clip(0))
+        raise ValueError(f"unknown weighting {weighting!r} (expected one of {', '.join(WEIGHTINGS)})")
+
+    def _table(self, weighting):
+        table = self._tables.get(weighting)
+        if table is None:
+            books = np.flatnonzero(self.vocabulary.in_catalog)
+            table = self._tables[weighting] = AliasTable(books, self.weights(books, weighting))
+        return table
+
+    def _genre_table(self, genre_id):
+        table = self._genre_tables.get(genre_id)
+        if table is None:
+            books = self.vocabulary.genre_books(genre_id)
+            table = self._genre_tables[genre_id] = AliasTable(books, self.weights(books, "rating"))
+        return table
+
+    def _unexplored_table(self, explored_genres):
+        """
+        Alias table over the genre IDs not in explored_genres, each weighted by its books' total rating.
+        Tables are cached per set of explored genres (oldest dropped first), so a returning set costs a lookup.
+        """
+        key = frozenset(explored_genres)
+        table = self._unexplored_tables.get(key)
+        if table is None:
+            if self._genre_weights is None:
+                books, genres = self.vocabulary.genre_pairs()
+                self._genre_weights = np.bincount(genres, weights=self.weights(books, "rating"),
+                                                  minlength=len(self.vocabulary.genres))
+            unexplored = np.ones(len(self._genre_weights), dtype=bool)
+            unexplored[[g for g in key if 0 <= g < len(unexplored)]] = False
+            genre_ids = np.flatnonzero(unexplored)
+            if len(self._unexplored_tables) >= UNEXPLORED_CACHE:
+                del self._unexplored_tables[next(iter(self._unexplored_tables))]
+            table = self._unexplored_tables[key] = AliasTable(genre_ids, self._genre_weights[genre_ids])
+        return table
+
+    def add_book(self, book_id):
+        """A book was added to the vocabulary's catalog: make it drawable from every table built so far."""
+        for weighting, table in self._tables.items():
+            table.append(book_id, self.weights([book_id], weighting)[0])
+        weight = self.weights([book_id], "rating")[0]
+        for genre_id in self.vocabulary.genres_of(book_id).tolist():
+            if genre_id in self._genre_tables:
+                self._genre_tables[genre_id].append(book_id, weight)
+            if self._genre_weights is not None:
+                if genre_id >= len(self._genre_weights):
+                    self._genre_weights = np.concatenate([self._genre_weights,
+                                                          np.zeros(genre_id + 1 - len(self._genre_weights))])
+                self._genre_weights[genre_id] += weight
+        self._unexplored_tables.clear()  # their genre weights just changed
+
+    def sample(self, n=3, weighting="rating", exclude_titles=(), explored_genres=(), rng=None):
+        """
+        Up to n distinct book IDs, skipping exclude_titles. explored_genres (genre IDs) only matter for
+        "unexplored": if every genre is explored, books are drawn by rating instead.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        draw = self._table("rating" if weighting == "unexplored" else weighting).draw
+        if weighting == "unexplored":
+            genres = self._unexplored_table(explored_genres)
+            if genres.weight() > 0:
+                draw = lambda rng: self._genre_table(genres.draw(rng)).draw(rng)
+        seen = set(self.vocabulary.books.lookup(list(exclude_titles)).tolist())
+        picks = []
+        # Rejection keeps every draw O(1); the cap only matters when almost everything is excluded
+        for _ in range(50 * n):
+            if len(picks) == n:
+                break
+            book_id = draw(rng)
+            if book_id >= 0 and book_id not in seen:
+                seen.add(book_id)
+                picks.append(book_id)
+        return picks
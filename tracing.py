@@ -0,0 +1,221 @@
+import contextlib
+import functools
+import io
+import json
+import os
+import threading
+import time
+
+TRACE_ENV = "BIBLIO_TRACE"  # set to 1 to record spans from startup
+MAX_EVENTS = 100000  # spans kept for the Chrome trace export; histograms count every span
+N_BUCKETS = 32  # bucket i holds durations in [2**(i-1), 2**i) microseconds
+
+
+class _NoSpan:
+    """What span() returns while tracing is off: entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Histogram:
+    """Durations of one span name in power-of-two microsecond buckets, plus count / total / min / max."""
+
+    def __init__(self):
+        self.buckets = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (within a factor of 2), in seconds."""
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "total_s": self.total, "mean_s": self.total / self.count if self.count else 0.0,
+                "min_s": self.min if self.count else 0.0, "max_s": self.max,
+                "p50_s": self.quantile(0.5), "p90_s": self.quantile(0.9), "p99_s": self.quantile(0.99),
+                "buckets_us": {2 ** i: n for i, n in enumerate(self.buckets) if n}}
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Tracer:
+    """
+    Named timing spans around the stages of a request. While disabled, span() hands back a shared
+    do-nothing context manager, so instrumented code pays one attribute check per stage.
+    Enabled, every span adds to a per-name histogram and to a bounded event list that
+    chrome_trace / export_chrome_trace turn into the Trace Event format (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, enabled=False, max_events=MAX_EVENTS):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.histograms = {}
+        self.events = []
+        self.dropped = 0
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def record(self, name, start, end):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(end - start)
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, end, threading.get_ident()))
+            else:
+                self.dropped += 1
+
+    def reset(self):
+        with self._lock:
+            self.histograms, self.events, self.dropped = {}, [], 0
+
+    def summary(self):
+        """{span name: histogram summary}, for /stats or a JSON dump."""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def report(self):
+        """Per-stage table: calls, total, mean and approximate p50 / p99, slowest total first."""
+        rows = sorted(self.summary().items(), key=lambda item: -item[1]["total_s"])
+        lines = [f"{'span':40s} {'calls':>7s} {'total ms':>10s} {'mean ms':>9s} {'p50 ms':>8s} {'p99 ms':>8s}"]
+        for name, s in rows:
+            lines.append(f"{name:40s} {s['count']:7d} {s['total_s'] * 1000:10.2f} {s['mean_s'] * 1000:9.3f} "
+                         f"{s['p50_s'] * 1000:8.3f} {s['p99_s'] * 1000:8.3f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """The recorded spans in the Trace Event format ("X" complete events, microseconds)."""
+        with self._lock:
+            events = list(self.events)
+        pid = os.getpid()
+        return {"traceEvents": [{"name": name, "cat": name.split(".", 1)[0], "ph": "X", "pid": pid, "tid": tid,
+                                 "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6}
+                                for name, start, end, tid in events],
+                "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """Write chrome_trace() to path, for chrome://tracing or Perfetto."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+tracer = Tracer(enabled=os.environ.get(TRACE_ENV, "") not in ("", "0"))
+
+
+def enable():
+    tracer.enabled = True
+
+
+def disable():
+    tracer.enabled = False
+
+
+def span(name):
+    """with span("stage"): ... times the block when tracing is on."""
+    return tracer.span(name)
+
+
+def traced(name):
+    """Decorator: the whole call is one span."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with _Span(tracer, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+_profile_lock = threading.Lock()  # one profiler at a time: cProfile / tracemalloc are process-wide
+
+
+class Profile:
+    """Filled in when a profiled() block exits: report is the cProfile or tracemalloc text."""
+    report = ""
+
+
+@contextlib.contextmanager
+def profiled(mode="cpu", limit=25):
+    """
+    Run one block (e.g. a single request) under cProfile (mode "cpu": top functions by cumulative time)
+    or tracemalloc (mode "memory": peak plus the lines that allocated most). Both are far too slow to
+    leave on, so they are only used on demand.
+    """
+    if mode not in ("cpu", "memory"):
+        raise ValueError(f"unknown profile mode {mode!r} (expected 'cpu' or 'memory')")
+    result = Profile()
+    with _profile_lock:
+        yield from _run_profiled(result, mode, limit)
+
+
+def _run_profiled(result, mode, limit):
+    if mode == "cpu":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            result.report = out.getvalue()
+    elif mode == "memory":
+        import tracemalloc
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield result
+        finally:
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started:
+                tracemalloc.stop()
+            lines = [f"peak traced memory: {peak / 2 ** 20:.1f} MiB", "largest allocations still held, by line:"]
+            lines += [str(stat) for stat in after.compare_to(before, "lineno")[:limit]]
+            result.report = "\n".join(lines)